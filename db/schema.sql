@@ -13,7 +13,9 @@ CREATE TABLE IF NOT EXISTS albums (
 
 CREATE TABLE IF NOT EXISTS directories (
     dir_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    path TEXT UNIQUE NOT NULL
+    path TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL DEFAULT 0,
+    entry_count INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS tracks (
@@ -24,6 +26,14 @@ CREATE TABLE IF NOT EXISTS tracks (
     dir_id INTEGER NOT NULL,
     filename TEXT NOT NULL,
     mtime INTEGER NOT NULL,
+    duration REAL,
+    bitrate INTEGER,
+    sample_rate INTEGER,
+    channels INTEGER,
+    codec TEXT,
+    size INTEGER,
+    fingerprint TEXT,
+    frame_duration REAL,
     UNIQUE(dir_id, filename),
     FOREIGN KEY (artist_id) REFERENCES artists(artist_id),
     FOREIGN KEY (album_id) REFERENCES albums(album_id),
@@ -48,7 +58,8 @@ CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5 (
     artist_name,
     album_title,
     content='tracks_view',
-    content_rowid='rowid'
+    content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
 );
 
 CREATE TRIGGER IF NOT EXISTS tracks_fts_insert AFTER INSERT ON tracks
@@ -63,7 +74,13 @@ END;
 
 CREATE TRIGGER IF NOT EXISTS tracks_fts_update AFTER UPDATE ON tracks
 BEGIN
-    DELETE FROM tracks_fts WHERE rowid = old.track_id;
+    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist_name, album_title)
+    SELECT
+        'delete',
+        old.track_id,
+        old.title,
+        (SELECT name FROM artists WHERE artist_id = old.artist_id),
+        (SELECT name FROM albums WHERE album_id = old.album_id);
     INSERT INTO tracks_fts(rowid, title, artist_name, album_title)
     SELECT
         new.track_id,
@@ -74,5 +91,11 @@ END;
 
 CREATE TRIGGER IF NOT EXISTS tracks_fts_delete AFTER DELETE ON tracks
 BEGIN
-    DELETE FROM tracks_fts WHERE rowid = old.track_id;
+    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist_name, album_title)
+    SELECT
+        'delete',
+        old.track_id,
+        old.title,
+        (SELECT name FROM artists WHERE artist_id = old.artist_id),
+        (SELECT name FROM albums WHERE album_id = old.album_id);
 END;
@@ -1,3 +1,4 @@
+import os
 import logging
 import logging.config
 
@@ -6,8 +7,11 @@ from dotenv import load_dotenv
 from yaml import safe_load
 
 from src.scanner import FileScanner
+from src.watcher import LibraryWatcher
 from src.db_manager import DatabaseManager
 from src.bot import Bot
+from src.search_cache import SearchCache
+from src.transcode_cache import TranscodeCache
 
 load_dotenv()
 
@@ -27,12 +31,42 @@ def setup_logging(config_path: str):
 
 def main():
     setup_logging('logging.conf.yaml')
-    db = DatabaseManager("db/tracks.sqlite")
+    # Optional overrides of the connection pragmas, e.g. DB_CACHE_SIZE
+    db_pragmas = {name: getenv(f'DB_{name.upper()}') for name in DatabaseManager.DEFAULT_PRAGMAS}
+    db_pragmas = {name: value for name, value in db_pragmas.items() if value}
+    db = DatabaseManager("db/tracks.sqlite", pragmas=db_pragmas)
 
-    scanner = FileScanner(library_path=getenv('LIBRARY_PATH'), db=db)
-    scanner.scan()
+    # Several roots, e.g. one per disk, are separated like PATH entries
+    library_paths = getenv('LIBRARY_PATH').split(os.pathsep)
 
-    bot = Bot(db=db) 
+    workers = getenv('SCAN_WORKERS')
+    scanner_options = {
+        'workers': int(workers) if workers else None,
+        'executor': getenv('SCAN_EXECUTOR', 'process'),
+    }
+    # Create or upgrade the schema before the bot starts querying it, the scan itself runs in the background
+    FileScanner(library_path=library_paths, db=db, **scanner_options)
+
+    watcher = LibraryWatcher(
+        library_path=library_paths,
+        db_path=db.filename,
+        mode=getenv('WATCH_MODE', 'auto'),
+        initial_scan=getenv('SCAN_MODE', 'full'),
+        poll_interval=float(getenv('WATCH_POLL_INTERVAL', 60)),
+        db_pragmas=db_pragmas,
+        **scanner_options
+    )
+
+    search_cache = None
+    cache_entries = int(getenv('SEARCH_CACHE_ENTRIES', 1024))
+    if cache_entries > 0:
+        search_cache = SearchCache(max_entries=cache_entries, max_bytes=int(float(getenv('SEARCH_CACHE_MB', 16)) * 1024 * 1024))
+
+    transcode_cache = None
+    if getenv('TRANSCODE_CACHE_PATH'):
+        transcode_cache = TranscodeCache(getenv('TRANSCODE_CACHE_PATH'), max_bytes=int(float(getenv('TRANSCODE_CACHE_MB', 2048)) * 1024 * 1024))
+
+    bot = Bot(db=db, watcher=watcher, search_cache=search_cache, playback_mode=getenv('PLAYBACK_MODE', 'pcm'), transcode_cache=transcode_cache)
     bot.client.run(token=getenv("TOKEN"), log_handler=None)
     
 if __name__ == '__main__':
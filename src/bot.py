@@ -3,15 +3,23 @@ import logging
 import atexit
 import asyncio
 
-from typing import Dict
+from typing import Dict, List, Optional
 from enum import Enum
+from discord.ext import tasks
 
-from src.db_manager import DatabaseManager
+from src.db_manager import DatabaseManager, AsyncQueryExecutor
 from src.views.track_select import TrackResultsView
 from src.views.now_playing import NowPlayingView
 from src.views.queue import QueueView
-from src.models import Track
+from src.models import Track, StreamInfo
 from src.player import Player
+from src.watcher import LibraryWatcher
+from src.scanner import ScanProgress
+from src.search import TrackSearch
+from src.search_cache import SearchCache
+from src.transcode_cache import TranscodeCache
+from src.autocomplete import PrefixIndex
+from src.fuzzy import TrigramIndex
 from src.consts import NOT_PLAYING
 
 def _parse_seconds(time: str):
@@ -26,15 +34,53 @@ def _parse_seconds(time: str):
     scalars = (1, 60, 3600)
     return sum(part * scalar for part, scalar in zip(parts, scalars))
 
+# Value of the autocomplete choices, which pick a track rather than a search query
+_TRACK_CHOICE_PREFIX = "track:"
+
+def _parse_track_choice(query: str) -> Optional[int]:
+    if query.startswith(_TRACK_CHOICE_PREFIX) and query[len(_TRACK_CHOICE_PREFIX):].isdigit():
+        return int(query[len(_TRACK_CHOICE_PREFIX):])
+    return None
+
+def _format_scan_stats(progress: ScanProgress) -> str:
+    state = "running for" if progress.running else "finished in"
+    lines = [
+        f"{'Partial' if progress.partial else 'Full'} scan, {state} {progress.elapsed:.1f}s",
+        f"{progress.directories} directories, {progress.files} files checked ({progress.files_per_second:.0f} files/s)",
+        f"{progress.written} tracks written, {progress.relinked} relinked, {progress.deleted} deleted",
+        "",
+        f"{'phase':<14}{'seconds':>10}{'count':>10}",
+    ]
+    lines += [f"{name:<14}{phase.seconds:>10.2f}{phase.count:>10}" for name, phase in progress.phases.items()]
+
+    slowest = progress.slowest_files()
+    if slowest:
+        lines += ["", "Slowest files:"]
+        lines += [f"{seconds:>8.3f}s {path}" for seconds, path in slowest]
+
+    return "\n".join(lines)
+
 class Bot:
-    def __init__(self, db: DatabaseManager, intents=discord.Intents.default()) -> None:
+    def __init__(self, db: DatabaseManager, watcher: LibraryWatcher = None, search_cache: SearchCache = None, playback_mode: str = 'pcm', transcode_cache: TranscodeCache = None, intents=discord.Intents.default()) -> None:
+        if playback_mode not in Player.MODES:
+            raise ValueError(f"Unknown playback mode {playback_mode}, expected one of {', '.join(Player.MODES)}")
         self.db = db
+        # Lookups run off the event loop, on the executor's threads
+        self.queries = AsyncQueryExecutor(db)
+        self.search = TrackSearch(self.queries, cache=search_cache, generation=lambda: self.watcher.generation if self.watcher else 0)
+        # Built once the bot is ready, then rebuilt after every scan changing the library
+        self.autocomplete: PrefixIndex = None
+        self.watcher = watcher
         self.client = discord.Client(intents=intents)
         self.tree = discord.app_commands.CommandTree(client=self.client)
         self.players: Dict[discord.Guild, Player] = {}
+        self.playback_mode = playback_mode
+        self.transcode_cache = transcode_cache
         self.__logger = logging.getLogger("bot")
 
         self._register_commands()
+        if self.watcher:
+            self.watcher.add_listener(self._refresh_indexes)
 
         self.client.event(self.on_ready)
 
@@ -44,9 +90,48 @@ class Bot:
         await self.tree.sync()
         self.__logger.info("Bot is ready")
 
+        if self.autocomplete is None:
+            await self.queries.run(self._build_indexes)
+
+        # on_ready fires again after reconnects
+        if self.watcher and not self.watcher.started:
+            self.watcher.start()
+            self._report_scan_progress.start()
+
+    def _build_indexes(self, connection):
+        """
+        Build the in-memory autocomplete and spelling indexes. The new indexes replace the old
+        ones once they're complete.
+        """
+        autocomplete = PrefixIndex.from_db(connection)
+        self.search.vocabulary = TrigramIndex(autocomplete.vocabulary())
+        self.autocomplete = autocomplete
+        self.__logger.info(f"Search indexes built over {len(autocomplete)} tracks, {len(self.search.vocabulary)} words")
+
+    def _refresh_indexes(self, progress: ScanProgress):
+        """Rebuild the in-memory indexes after a scan, runs on the watcher's thread"""
+        self._build_indexes(self.db.reader())
+
+    @tasks.loop(seconds=5)
+    async def _report_scan_progress(self):
+        """
+        Show the progress of the startup scan in the bot's presence, clear it once the scan is done
+        """
+        if self.watcher.ready.is_set():
+            await self.client.change_presence(activity=None)
+            self._report_scan_progress.stop()
+            return
+
+        progress = self.watcher.progress
+        activity = discord.Game(name=f"Scanning library: {progress.files} files checked, {progress.written} tracks indexed")
+        await self.client.change_presence(activity=activity)
+
     async def _on_exit(self):
         self.__logger.info("Program exitting, closing connection to discord...")
         await self.client.close()
+        self.queries.close()
+        if self.transcode_cache:
+            self.transcode_cache.close()
 
     def _sync_on_exit(self):
         self.__logger.info("Running atexit cleanup")
@@ -60,15 +145,43 @@ class Bot:
         async def play_command(interaction: discord.Interaction, query: str):
             await self._ensure_connection(interaction=interaction)
 
-            results = self.find_tracks_on_disk(query)
-            if len(results) == 1:
+            track_id = _parse_track_choice(query)
+            track = await self.search.get_track(track_id) if track_id is not None else None
+            if track:
+                await self._queue_selected_track(track, interaction)
+                return
+
+            results = await self.find_tracks_on_disk(query, limit=TrackResultsView.page_limit())
+            fuzzy = False
+            if not results:
+                # Typos, only tried when the exact search finds nothing
+                results = await self.find_tracks_on_disk(query, limit=TrackResultsView.page_limit(), fuzzy=True)
+                fuzzy = True
+
+            # A single fuzzy match is only a guess, let the user confirm it
+            if len(results) == 1 and not fuzzy:
                 await self._queue_selected_track(results[0], interaction)
-            elif len(results) > 1:
-                view = TrackResultsView(results=results, on_select=self._queue_selected_track)
+            elif results:
+                fetch_page = lambda limit, offset: self.find_tracks_on_disk(query, limit, offset, fuzzy=fuzzy)
+                title = f"No exact matches for \"{query}\", did you mean" if fuzzy else "Search Results"
+                view = TrackResultsView(first_page=results, fetch_page=fetch_page, on_select=self._queue_selected_track, title=title)
                 await view.display(interaction=interaction)
+            elif self.watcher and not self.watcher.ready.is_set():
+                await interaction.response.send_message("No results found :( The library is still being scanned, try again in a bit", ephemeral=True)
             else:
                 await interaction.response.send_message("No results found :(", ephemeral=True)
 
+        @play_command.autocomplete('query')
+        async def play_autocomplete(interaction: discord.Interaction, current: str) -> List[discord.app_commands.Choice[str]]:
+            # Answered from memory, Discord drops autocomplete responses taking over 3 seconds
+            if not self.autocomplete:
+                return []
+            return [
+                # Choice names are capped at 100 characters
+                discord.app_commands.Choice(name=track.pretty()[:100], value=f"{_TRACK_CHOICE_PREFIX}{track.id}")
+                for track in self.autocomplete.search(current, limit=25)
+            ]
+
         @self.tree.command(
             name="stop",
             description="Clear playlist and disconnect from voice channel"
@@ -187,6 +300,37 @@ class Bot:
             view = QueueView(player=player)
             await view.display(interaction)
 
+        @self.tree.command(
+            name="scanstats",
+            description="Show statistics of the last library scan"
+        )
+        async def scan_stats_command(interaction: discord.Interaction):
+            if not self.watcher or not self.watcher.progress.started:
+                await interaction.response.send_message("No library scan has run yet", ephemeral=True)
+                return
+
+            content = _format_scan_stats(self.watcher.progress)
+            # Discord messages are capped at 2000 characters
+            await interaction.response.send_message(f"```\n{content[:1900]}\n```", ephemeral=True)
+
+        @self.tree.command(
+            name="cachestats",
+            description="Show statistics of the search result cache"
+        )
+        async def cache_stats_command(interaction: discord.Interaction):
+            cache = self.search.cache
+            if cache is None:
+                await interaction.response.send_message("The search cache is disabled", ephemeral=True)
+                return
+
+            stats = cache.stats
+            content = "\n".join([
+                f"{stats.hits} hits, {stats.misses} misses ({stats.hit_ratio:.1%} hit ratio)",
+                f"{stats.entries}/{cache.max_entries} entries, {stats.bytes / 1024:.0f}/{cache.max_bytes / 1024:.0f} KiB",
+                f"{stats.evictions} evictions, {stats.invalidations} invalidations by library changes",
+            ])
+            await interaction.response.send_message(f"```\n{content}\n```", ephemeral=True)
+
         class SeekType(str, Enum):
             FORWARD = "forward"
             BACK = "back"
@@ -222,22 +366,17 @@ class Bot:
             except ValueError as e:
                 await interaction.response.send_message(str(e), ephemeral=True)
             
-    def find_tracks_on_disk(self, query: str):
+    async def find_tracks_on_disk(self, query: str, limit: int, offset: int = 0, fuzzy: bool = False):
         """
-        Search the database for rows matching the query string. Returns the matching rows.
+        Search the database for rows matching the query string. Returns a page of the matching
+        rows, best matches first.
         """
-        qstr = "SELECT rowid,* FROM tracks_fts WHERE tracks_FTS MATCH ? || \"*\""
-        self.db.cursor.execute(qstr, (query, ))
-
-        results = [Track(*row) for row in self.db.cursor.fetchall()]
-        self.__logger.info(f"Found {len(results)} rows, best match {results[0] if results else 'None'}")
-
-        return results
+        return await self.search.search(query, limit, offset, fuzzy)
 
     async def _queue_selected_track(self, track: Track, interaction: discord.Interaction):
         self.__logger.info(f"Selected {track}")
 
-        path = self._get_path_for_track_id(track.id)
+        path, stream, fingerprint = await self._get_file_for_track_id(track.id)
         self.__logger.info(f"Found path {path}")
         
         player = self.players.get(interaction.guild)
@@ -246,24 +385,28 @@ class Bot:
             return
 
         await interaction.response.send_message(f"🎶 Queued {track.artist} - {track.title} ({track.album}) 🎶", ephemeral=True)
-        await player.queue_track(path, track)
+        await player.queue_track(path, track, stream, fingerprint)
 
-    def _get_path_for_track_id(self, id: int):
+    async def _get_file_for_track_id(self, id: int):
         """
-        Concatenate filename and path columns from tracks and directories and return the result for id
+        Concatenate filename and path columns from tracks and directories and return the result for id,
+        along with the stream properties and content fingerprint stored by the scanner
         """
         q_str = """
-            SELECT directories.path || '/' || tracks.filename AS path
+            SELECT
+                directories.path || '/' || tracks.filename AS path,
+                tracks.duration, tracks.bitrate, tracks.sample_rate, tracks.channels, tracks.codec, tracks.frame_duration,
+                tracks.fingerprint
             FROM tracks
             JOIN directories
             ON tracks.dir_id = directories.dir_id
             WHERE tracks.track_id = ?
         """
-        self.db.cursor.execute(q_str, (id, ))
-        path = self.db.cursor.fetchone()
-        if path:
-            return path[0]
-        return None
+        row = await self.queries.fetchone(q_str, (id, ))
+        if row:
+            path, duration, *properties, fingerprint = row
+            return path, StreamInfo(duration or 0, *properties), fingerprint
+        return None, None, None
 
     async def _ensure_connection(self, interaction: discord.Interaction) -> None:
         """
@@ -286,4 +429,4 @@ class Bot:
         
         self.__logger.info(f"Bot connecting to {user.voice.channel} in guild {interaction.guild.name}")
         voice_client = await user.voice.channel.connect()
-        self.players[interaction.guild] = Player(voice_client=voice_client)
+        self.players[interaction.guild] = Player(voice_client=voice_client, mode=self.playback_mode, transcode_cache=self.transcode_cache)
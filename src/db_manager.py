@@ -1,24 +1,84 @@
+import os
+import asyncio
 import sqlite3
 import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+from urllib.request import pathname2url
 
 logger = logging.getLogger('db_manager')
 
 class DatabaseManager:
-    def __init__(self, db_path: str) -> None:
+    """
+    Owns the database's single writer connection (`connection` and `cursor`) and a read-only
+    connection per thread (`reader()`). The database is in WAL mode, so readers see the last
+    committed state and never wait on the writer, e.g. searches while a scan is running.
+    """
+    # Applied to every connection, see https://www.sqlite.org/pragma.html
+    DEFAULT_PRAGMAS = {
+        # Durable across application crashes, a power loss may roll back the last transactions
+        'synchronous': 'NORMAL',
+        # Negative values are in KiB
+        'cache_size': -16000,
+        'mmap_size': 256 * 1024 * 1024,
+    }
+
+    def __init__(self, db_path: str, pragmas: Optional[dict] = None) -> None:
         self.filename = db_path 
+        self.pragmas = {**DatabaseManager.DEFAULT_PRAGMAS, **(pragmas or {})}
         self.connection = None
         self.cursor = None
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+        for name, value in self.pragmas.items():
+            if not name.isidentifier() or not str(value).lstrip('-').isalnum():
+                raise ValueError(f"Invalid pragma {name} = {value}")
     
     def connect(self):
         try:
             self.connection = sqlite3.connect(self.filename)
             self.connection.row_factory = sqlite3.Row
             self.cursor = self.connection.cursor()
+            # Persistent, readers opened later find the database in WAL mode
+            self.cursor.execute("PRAGMA journal_mode = WAL")
+            self._apply_pragmas(self.connection)
             logger.info(f"Connected to db {self.filename}")
         except sqlite3.Error as e:
             logger.error(f"Failed to connect to db: {e}")
             raise
+
+    def _apply_pragmas(self, connection: sqlite3.Connection):
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
     
+    def connect_reader(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        """
+        Open an additional read-only connection to the database, for use by threads other than the
+        one owning the main connection. The caller is responsible for closing it.
+        """
+        uri = f"file:{pathname2url(os.path.abspath(self.filename))}?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+        self._apply_pragmas(connection)
+        return connection
+
+    def reader(self) -> sqlite3.Connection:
+        """
+        Read-only connection of the calling thread, opened on first use and closed along with the
+        manager. Meant for long-lived threads, short-lived ones should use connect_reader.
+        """
+        connection = getattr(self._local, 'reader', None)
+        if connection is None:
+            # Only ever used by this thread, but closed by whichever thread closes the manager
+            connection = self.connect_reader(check_same_thread=False)
+            self._local.reader = connection
+            with self._readers_lock:
+                self._readers.append(connection)
+        return connection
+
     def executescript(self, path: str):
         if not self.connection:
             self.connect()
@@ -31,7 +91,33 @@ class DatabaseManager:
             logger.error(f"Failed to execute script: {e}")
             raise
     
+    def add_missing_columns(self, table: str, columns: dict) -> list:
+        """
+        Add the columns (name -> definition) missing from an existing table. Used to bring databases
+        created by an older schema up to date, since CREATE TABLE IF NOT EXISTS leaves them untouched.
+        Returns the names of the added columns.
+        """
+        if not self.connection:
+            self.connect()
+
+        existing = {row[1] for row in self.cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+        added = []
+        for name, definition in columns.items():
+            if name not in existing:
+                self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                logger.info(f"Added column {table}.{name}")
+                added.append(name)
+        self.connection.commit()
+        return added
+
     def close(self):
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers.clear()
+        # Threads asking for a reader after this get a new one
+        self._local = threading.local()
+
         if self.connection:
             self.connection.close()
             logger.info(f"Closed connection to db {self.filename}")
@@ -40,4 +126,30 @@ class DatabaseManager:
         if not self.connection:
             self.connect()
         self.cursor.execute("SELECT * FROM {0}".format(table))
-        return len(self.cursor.fetchall())
\ No newline at end of file
+        return len(self.cursor.fetchall())
+
+
+class AsyncQueryExecutor:
+    """
+    Runs read queries on a dedicated pool of threads, each using its own read-only connection, so
+    that lookups never block the asyncio event loop. sqlite3 releases the GIL while a query runs.
+    """
+    def __init__(self, db: DatabaseManager, workers: int = 4) -> None:
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-query')
+
+    async def run(self, function: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Call function with the read-only connection of a pool thread, returns its result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: function(self.db.reader()))
+
+    async def fetchall(self, query: str, parameters: tuple = ()) -> list:
+        return await self.run(lambda connection: connection.execute(query, parameters).fetchall())
+
+    async def fetchone(self, query: str, parameters: tuple = ()):
+        return await self.run(lambda connection: connection.execute(query, parameters).fetchone())
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,81 @@
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Levenshtein distance between a and b, or max_distance + 1 as soon as it's known to exceed
+    max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+def trigrams(word: str) -> List[str]:
+    # Padding makes the first and last letters count as much as the middle ones
+    padded = f"  {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def max_typos(word: str) -> int:
+    """Edit distance tolerated for a word of this length"""
+    if len(word) <= 2:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+
+class TrigramIndex:
+    """
+    Spelling correction over the library's vocabulary: the distinct normalised words of every
+    title, artist and album.
+
+    Candidates for a misspelt word are the vocabulary words sharing the most trigrams with it.
+    They are then re-ranked by edit distance, keeping those within max_typos of the word, closest
+    and most frequent first.
+    """
+    # Vocabulary words sharing the most trigrams with a query word, checked by edit distance
+    MAX_CANDIDATES = 50
+
+    def __init__(self, words: Iterable[Tuple[str, int]] = ()) -> None:
+        self.words: List[str] = []
+        self.frequencies = array('I')
+        postings: Dict[str, array] = {}
+        for number, (word, frequency) in enumerate(words):
+            self.words.append(word)
+            self.frequencies.append(frequency)
+            for trigram in set(trigrams(word)):
+                postings.setdefault(trigram, array('I')).append(number)
+        self.postings = postings
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def corrections(self, word: str, limit: int = 5) -> List[Tuple[str, int]]:
+        """
+        Vocabulary words within max_typos edits of word, as (word, distance) pairs, best first.
+        The word itself comes first when it's part of the vocabulary.
+        """
+        max_distance = max_typos(word)
+        shared = Counter()
+        for trigram in set(trigrams(word)):
+            shared.update(self.postings.get(trigram, ()))
+
+        candidates = []
+        for number, _ in shared.most_common(TrigramIndex.MAX_CANDIDATES):
+            distance = edit_distance(word, self.words[number], max_distance)
+            if distance <= max_distance:
+                candidates.append((distance, -self.frequencies[number], self.words[number]))
+
+        candidates.sort()
+        return [(candidate, distance) for distance, _, candidate in candidates[:limit]]
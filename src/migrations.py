@@ -0,0 +1,117 @@
+"""
+Versioned schema migrations. db/schema.sql creates the tables of a new database, migrations bring
+existing databases up to date in place. A database's version is kept in its user_version pragma:
+the number of migrations applied to it, which run once each, in order.
+
+Migrations must be idempotent. They also run against new databases, whose tables schema.sql has
+already created in their latest form, and a crash before the version is bumped runs them again.
+"""
+import logging
+
+from typing import Callable, List, Tuple
+
+from src.db_manager import DatabaseManager
+
+logger = logging.getLogger('migrations')
+
+# Triggers keeping tracks_fts in sync with tracks, created by db/schema.sql
+FTS_TRIGGERS = ('tracks_fts_insert', 'tracks_fts_update', 'tracks_fts_delete')
+
+
+def _add_scan_columns(db: DatabaseManager):
+    """Columns added to directories and tracks before the schema was versioned"""
+    db.add_missing_columns('directories', {
+        'mtime': 'INTEGER NOT NULL DEFAULT 0',
+        'entry_count': 'INTEGER NOT NULL DEFAULT 0',
+    })
+    added = db.add_missing_columns('tracks', {
+        'duration': 'REAL',
+        'bitrate': 'INTEGER',
+        'sample_rate': 'INTEGER',
+        'channels': 'INTEGER',
+        'codec': 'TEXT',
+        'size': 'INTEGER',
+        'fingerprint': 'TEXT',
+    })
+    # Used to find moved tracks
+    db.cursor.execute("CREATE INDEX IF NOT EXISTS tracks_fingerprint ON tracks(size, fingerprint)")
+    if added:
+        # Existing tracks have no stream properties yet, make incremental scans revisit them
+        db.cursor.execute("UPDATE directories SET mtime = 0")
+
+
+def _add_lookup_indexes(db: DatabaseManager):
+    """
+    Indexes for browsing by artist and album. Lookups by path are covered by the UNIQUE constraints
+    on directories(path) and tracks(dir_id, filename).
+    """
+    db.cursor.execute("CREATE INDEX IF NOT EXISTS tracks_artist ON tracks(artist_id)")
+    db.cursor.execute("CREATE INDEX IF NOT EXISTS tracks_album ON tracks(album_id)")
+    db.cursor.execute("CREATE INDEX IF NOT EXISTS albums_artist ON albums(artist_id)")
+
+
+def _fold_diacritics(db: DatabaseManager):
+    """
+    Recreate tracks_fts with the diacritics folding of unicode61 spelled out, 'remove_diacritics 2'
+    also folds letters carrying several diacritics
+    """
+    sql = db.cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'tracks_fts'").fetchone()[0]
+    if 'remove_diacritics 2' in sql:
+        return
+    db.cursor.execute("DROP TABLE tracks_fts")
+    # Recreates the table from the current schema
+    db.executescript('db/schema.sql')
+    db.cursor.execute("INSERT INTO tracks_fts(tracks_fts) VALUES ('rebuild')")
+
+
+def _add_frame_duration(db: DatabaseManager):
+    """Packet duration of Opus tracks, which are only streamed as they are when it matches discord's"""
+    if db.add_missing_columns('tracks', {'frame_duration': 'REAL'}):
+        # Make incremental scans revisit the directories holding Opus tracks
+        db.cursor.execute("UPDATE directories SET mtime = 0 WHERE dir_id IN (SELECT dir_id FROM tracks WHERE codec = 'opus')")
+
+
+def _recreate_fts_triggers(db: DatabaseManager):
+    """
+    Replace the FTS triggers of databases created before they used the 'delete' command. Their
+    DELETE FROM tracks_fts isn't supported by external content tables and leaves stale entries
+    behind, so the index is rebuilt as well.
+    """
+    for trigger in FTS_TRIGGERS:
+        db.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    # Recreates the triggers from the current schema
+    db.executescript('db/schema.sql')
+    db.cursor.execute("INSERT INTO tracks_fts(tracks_fts) VALUES ('rebuild')")
+
+
+# (description, migration), a database's version is the number of these applied to it
+MIGRATIONS: List[Tuple[str, Callable[[DatabaseManager], None]]] = [
+    ("Add directory mtimes and track stream properties", _add_scan_columns),
+    ("Add artist and album indexes", _add_lookup_indexes),
+    ("Fold diacritics in the search index", _fold_diacritics),
+    ("Add the packet duration of Opus tracks", _add_frame_duration),
+    ("Recreate the search index triggers", _recreate_fts_triggers),
+]
+
+
+def schema_version(db: DatabaseManager) -> int:
+    if not db.connection:
+        db.connect()
+    return db.cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db: DatabaseManager) -> int:
+    """
+    Apply the migrations the database hasn't seen yet. Returns how many were applied.
+    """
+    version = schema_version(db)
+    if version > len(MIGRATIONS):
+        raise RuntimeError(f"Database {db.filename} is at version {version}, newer than this code ({len(MIGRATIONS)})")
+
+    for number, (description, migration) in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Migrating {db.filename} to version {number}: {description}")
+        migration(db)
+        db.cursor.execute(f"PRAGMA user_version = {number}")
+        db.connection.commit()
+
+    return len(MIGRATIONS) - version
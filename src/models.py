@@ -17,6 +17,8 @@ class Track:
 class DirectoryRow:
     id: Optional[int]
     path: str
+    mtime: int = 0
+    entry_count: int = 0
 
 @dataclass
 class TrackRow:
@@ -27,10 +29,30 @@ class TrackRow:
     dir_id: int
     filename: int
     mtime: int
+    duration: Optional[float] = None
+    bitrate: Optional[int] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    codec: Optional[str] = None
+    size: Optional[int] = None
+    fingerprint: Optional[str] = None
+    frame_duration: Optional[float] = None
+
+@dataclass
+class StreamInfo:
+    duration: float = 0
+    bitrate: Optional[int] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    codec: Optional[str] = None
+    # Seconds of audio per packet of Opus streams, when known
+    frame_duration: Optional[float] = None
 
 @dataclass
 class TrackMetadata:
     title: str
     artist: str
     album: str
-    albumartist: str
\ No newline at end of file
+    albumartist: str
+    stream: StreamInfo = None
+    fingerprint: Optional[str] = None
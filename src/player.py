@@ -1,42 +1,118 @@
 import discord
 import logging
 import asyncio
-import mutagen
+import threading
 
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import Callable, Optional
 
-from src.models import Track
+from src.models import Track, StreamInfo
 from src.consts import NOT_PLAYING
+from src.transcode_cache import TranscodeCache
 from src.utils import format_seconds
 
 
 class ProgressAudioSource(discord.AudioSource):
-    def __init__(self, source, seek_offset_sec: float = 0) -> None:
+    # Length of a frame returned by read()
+    FRAME_SECONDS = 0.02
+    # Seconds of played and of upcoming audio kept in memory, seeking within them needs no new ffmpeg process
+    BUFFER_SECONDS = 12
+    # Frames read ahead on every read() until the upcoming buffer is full, ffmpeg decodes faster than real time
+    READ_AHEAD = 4
+
+    def __init__(self, source, seek_offset_sec: float = 0, near_end_sec: Optional[float] = None, on_near_end: Callable[[], None] = None) -> None:
+        """
+        on_near_end is called once from the audio thread, when playback reaches near_end_sec
+        """
         super().__init__()
         self._source = source
         self.seek_offset = seek_offset_sec
         self.read_count = 0
+        self.near_end = near_end_sec
+        self._on_near_end = on_near_end
+
+        capacity = int(ProgressAudioSource.BUFFER_SECONDS / ProgressAudioSource.FRAME_SECONDS)
+        self._capacity = capacity
+        self._played = deque(maxlen=capacity)
+        self._upcoming = deque()
+        self._ended = False
+        # read() runs on the audio thread, seeks on the event loop
+        self._lock = threading.Lock()
 
     def read(self) -> bytes:
-        data = self._source.read()
-        if data:
-            self.read_count += 1
+        # Read from ffmpeg outside of the lock, seeks never wait on it
+        frames = []
+        while not self._ended and len(frames) <= ProgressAudioSource.READ_AHEAD and len(self._upcoming) + len(frames) < self._capacity:
+            frame = self._source.read()
+            if not frame:
+                self._ended = True
+                break
+            frames.append(frame)
+
+        with self._lock:
+            self._upcoming.extend(frames)
+            data = self._upcoming.popleft() if self._upcoming else b''
+            if data:
+                self._played.append(data)
+                self.read_count += 1
+
+        if self._on_near_end and (not data or self.near_end is not None and self.progress >= self.near_end):
+            callback, self._on_near_end = self._on_near_end, None
+            callback()
         return data
-    
+
+    def seek_buffered(self, offset_sec: float) -> bool:
+        """
+        Move playback by offset_sec, backwards when negative, using the buffered frames.
+        Returns False without moving if the target position isn't buffered.
+        """
+        frames = round(offset_sec / ProgressAudioSource.FRAME_SECONDS)
+        with self._lock:
+            if frames < 0 and -frames <= len(self._played):
+                for _ in range(-frames):
+                    self._upcoming.appendleft(self._played.pop())
+            elif 0 <= frames <= len(self._upcoming):
+                for _ in range(frames):
+                    self._played.append(self._upcoming.popleft())
+            else:
+                return False
+            self.read_count += frames
+        return True
+
+    def cleanup(self) -> None:
+        self._source.cleanup()
+
+    def is_opus(self) -> bool:
+        # Opus frames are sent as they are, PCM is encoded by the voice client
+        return self._source.is_opus()
+
     @property
     def progress(self) -> float:
         """Return the current time progress in the track"""
-        return self.read_count * 0.02 + self.seek_offset
+        return self.read_count * ProgressAudioSource.FRAME_SECONDS + self.seek_offset
 
 @dataclass
 class NowPlayingTrack:
-    audio_source: ProgressAudioSource
     track: Track
     path: str
-    duration: float = 0
+    stream: StreamInfo
+    # Content fingerprint stored by the scanner
+    fingerprint: Optional[str] = None
+    # Position playback starts from, in seconds
+    start: float = 0
+    # Only created when the track is about to play, each one holds an ffmpeg process
+    audio_source: Optional[ProgressAudioSource] = None
+
+    @property
+    def duration(self) -> float:
+        return self.stream.duration
 
-    def __post_init__(self):
-        self.duration = _get_track_duration(self.path)
+    def close(self):
+        """Stop the track's ffmpeg process, if it was started"""
+        if self.audio_source:
+            self.audio_source.cleanup()
+            self.audio_source = None
 
 class ObservableQueue:
     def __init__(self, notify_callback) -> None:
@@ -78,19 +154,23 @@ class ObservableQueue:
     def __repr__(self):
         return repr(self._values)
 
-def _get_track_duration(path: str) -> float:
-    """Return the track length in seconds"""
-    audio: mutagen.FileType = mutagen.File(path)
-    if audio:
-        audio.info.pprint()
-        return audio.info.length
-    raise RuntimeError
-
 class Player:
     ON_QUEUE_CHANGED = 'queue_changed'
     ON_TRACK_CHANGED = 'track_changed'
-
-    def __init__(self, voice_client: discord.VoiceClient) -> None:
+    # Seconds before the end of a track at which the next one's ffmpeg is started
+    PREWARM_SECONDS = 5
+    # 'pcm' has ffmpeg decode and the bot encode every frame to Opus, 'opus' leaves the encoding
+    # to ffmpeg, or copies the stream as it is when the file is already Opus
+    MODES = ('pcm', 'opus')
+
+    def __init__(self, voice_client: discord.VoiceClient, mode: str = 'pcm', bitrate: int = 128, transcode_cache: Optional[TranscodeCache] = None) -> None:
+        if mode not in Player.MODES:
+            raise ValueError(f"Unknown playback mode {mode}, expected one of {', '.join(Player.MODES)}")
+        self.mode = mode
+        # Opus bitrate in kbps, when ffmpeg encodes
+        self.bitrate = bitrate
+        # Opus copies of played tracks, streamed as they are on later plays
+        self.transcode_cache = transcode_cache
         self.queue = ObservableQueue(self._on_queue_changed)
         self.voice_client: discord.VoiceClient = voice_client
         self.active_views = {
@@ -141,13 +221,55 @@ class Player:
     def _on_queue_changed(self):
         asyncio.create_task(self._notify_views(Player.ON_QUEUE_CHANGED))
 
-    async def queue_track(self, path: str, track: Track):
-        audio_source = ProgressAudioSource(discord.FFmpegPCMAudio(source=path, executable="ffmpeg"), seek_offset_sec=0)
-        self.queue.append(NowPlayingTrack(audio_source, track, path))
+    async def queue_track(self, path: str, track: Track, stream: StreamInfo, fingerprint: Optional[str] = None):
+        self.queue.append(NowPlayingTrack(track, path, stream, fingerprint))
 
         if not self.voice_client.is_playing():
             await self._play_next()
 
+    def _open(self, entry: NowPlayingTrack) -> ProgressAudioSource:
+        """Start ffmpeg for a track, decoding from its start position"""
+        options = {"before_options": f"-ss {entry.start}"} if entry.start else {}
+        if self.mode == 'opus':
+            path, copyable = entry.path, Player._is_copyable(entry.stream)
+            cached = self.transcode_cache.lookup(entry.fingerprint) if self._is_cacheable(entry) else None
+            if cached:
+                # Encoded in 20 ms packets
+                path, copyable = cached, True
+            # ffmpeg encodes 20 ms packets otherwise, progress is counted the same way
+            codec = 'copy' if copyable else None
+            source = discord.FFmpegOpusAudio(source=path, executable="ffmpeg", codec=codec, bitrate=self.bitrate, **options)
+        else:
+            source = discord.FFmpegPCMAudio(source=entry.path, executable="ffmpeg", **options)
+
+        near_end = entry.duration - Player.PREWARM_SECONDS if entry.duration else None
+        on_near_end = lambda: self.loop.call_soon_threadsafe(self._prewarm)
+        return ProgressAudioSource(source, seek_offset_sec=entry.start, near_end_sec=near_end, on_near_end=on_near_end)
+
+    @staticmethod
+    def _is_copyable(stream: StreamInfo) -> bool:
+        """Opus packets are sent every 20 ms, only streams made of 20 ms packets can be sent as they are"""
+        return stream.codec == 'opus' and stream.frame_duration == ProgressAudioSource.FRAME_SECONDS
+
+    def _is_cacheable(self, entry: NowPlayingTrack) -> bool:
+        """
+        Whether the track is played from the transcode cache. Only the opus mode sends the cached
+        copies as they are, the pcm mode would decode and encode them again at a loss
+        """
+        return (
+            self.mode == 'opus' and self.transcode_cache is not None and entry.fingerprint is not None
+            and not Player._is_copyable(entry.stream)
+        )
+
+    def _prewarm(self):
+        """
+        Start the next track's ffmpeg while the current one finishes, so it has audio ready
+        as soon as it is played
+        """
+        if self.queue and self.queue[0].audio_source is None:
+            self.queue[0].audio_source = self._open(self.queue[0])
+            self.__logger.debug(f"Prewarmed {self.queue[0].track.pretty()}")
+
     async def _play_next(self, error=None):
         if error:
             self.__logger.error(f"Error after playback {error}")
@@ -155,8 +277,13 @@ class Player:
         if self.queue:
             # Read first, then remove
             # Avoids a race condition where a redraw reads current track before it is set
+            if self.queue[0].audio_source is None:
+                self.queue[0].audio_source = self._open(self.queue[0])
             self.current_track = self.queue[0]
             self.queue.pop(0)
+            if self._is_cacheable(self.current_track):
+                # Transcoded in the background, unless it is cached already
+                self.transcode_cache.add(self.current_track.path, self.current_track.fingerprint)
 
             after = lambda e: asyncio.run_coroutine_threadsafe(self._play_next(error=e), self.loop)
             self.voice_client.play(self.current_track.audio_source, after=after)
@@ -192,6 +319,7 @@ class Player:
                 titles.append(self.current_track.track.title)
                 continue
             track: NowPlayingTrack = self.queue.pop()
+            track.close()
             titles.append(track.track.title)
         
         if need_skip:
@@ -207,6 +335,8 @@ class Player:
         """
         if interaction:
             await interaction.response.send_message("Clearing playlist... 🌾")
+        for track in self.queue:
+            track.close()
         self.queue.clear()
 
     async def disconnect(self, interaction: discord.Interaction=None):
@@ -268,23 +398,22 @@ class Player:
 
         if relative:
             seek_to = max(0, progress + seek_to)
-        if seek_to > self.current_track.duration:
+        # Tracks scanned before stream properties were stored have no known duration
+        if self.current_track.duration and seek_to > self.current_track.duration:
             if interaction:
                 await interaction.response.send_message(f"Seek position exceeds track length, skipping")
                 await self.skip()
                 return
 
-        ffmpeg_options = {
-            "before_options": f"-ss {seek_to}"
-        }
-
-        new_source = ProgressAudioSource(discord.FFmpegPCMAudio(self.current_track.path, **ffmpeg_options), seek_offset_sec=seek_to)
-        new_track = self.current_track
-        new_track.audio_source = new_source
-        self.queue.insert(0, new_track)
+        if self.current_track.audio_source.seek_buffered(seek_to - progress):
+            self.__logger.debug(f"Seeked to {seek_to} within the buffer")
+        else:
+            # Its ffmpeg is started when it plays, after the current one is stopped
+            new_track = replace(self.current_track, start=seek_to, audio_source=None)
+            self.queue.insert(0, new_track)
 
-        # Skip to "seeked" track
-        self.voice_client.stop()
+            # Skip to "seeked" track
+            self.voice_client.stop()
 
         if interaction:
             await interaction.response.send_message(f"Skipped {self.current_track.track.pretty()} to {format_seconds(seek_to)}")
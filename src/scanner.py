@@ -1,214 +1,908 @@
 import os
+import json
+import time
+import heapq
+import hashlib
+import queue
 import mutagen
 import logging
+import threading
+import multiprocessing
 
-from dataclasses import dataclass
-from typing import List, Tuple, Dict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import List, Tuple, Dict, Optional, Set, Iterable, Union
 
+from src import migrations, tag_reader
 from src.db_manager import DatabaseManager
-from src.models import TrackMetadata, DirectoryRow, TrackRow
+from src.models import TrackMetadata, DirectoryRow, TrackRow, StreamInfo
 
 class MetadataManager:
+    # mutagen file types whose name doesn't match the codec
+    CODECS = {
+        'EasyMP3': 'mp3',
+        'OggOpus': 'opus',
+        'OggVorbis': 'vorbis',
+        'OggFLAC': 'flac',
+        'WAVE': 'pcm',
+        'AIFF': 'pcm',
+    }
+
+    @staticmethod
+    def get_stream_info(audio: mutagen.FileType) -> StreamInfo:
+        info = audio.info
+        file_type = type(audio).__name__
+        # MP4 containers report their codec, e.g. 'mp4a.40.2' or 'alac'
+        codec = getattr(info, 'codec', None) or MetadataManager.CODECS.get(file_type, file_type.lower())
+        if codec.startswith('mp4a'):
+            codec = 'aac'
+
+        return StreamInfo(
+            duration=info.length,
+            bitrate=getattr(info, 'bitrate', None),
+            sample_rate=getattr(info, 'sample_rate', None),
+            channels=getattr(info, 'channels', None),
+            codec=codec,
+        )
+
     @staticmethod
     def get_metadata(path):
         filename = os.path.basename(path)
 
-        audio = mutagen.File(path, easy=True)
-        if audio is None:
-            return None
-
-        title = audio.get('title', [filename])[0]
-        artist = audio.get('artist', ['Unknown Artist'])[0]
-        albumartist = audio.get('albumartist', [artist])[0]
-        album = audio.get('album', ['Unknown Album'])[0]
-
-        return TrackMetadata(title, artist, album, albumartist)
+        # Common formats are read from their headers only, anything else goes through mutagen
+        result = tag_reader.read_file(path)
+        if result:
+            tags, stream = result
+        else:
+            audio = mutagen.File(path, easy=True)
+            if audio is None:
+                return None
+            tags = {name: values[0] for name, values in audio.items() if name in tag_reader.FIELDS and values}
+            stream = MetadataManager.get_stream_info(audio)
+
+        title = tags.get('title', filename)
+        artist = tags.get('artist', 'Unknown Artist')
+        albumartist = tags.get('albumartist', artist)
+        album = tags.get('album', 'Unknown Album')
+
+        return TrackMetadata(title, artist, album, albumartist, stream)
+
+
+def file_fingerprint(path: str, size: int, block_size: int = 16 * 1024) -> str:
+    """
+    Cheap content fingerprint of a file: a hash of its size along with its first and last blocks.
+    Tag edits usually change the head of the file, while moves and renames leave it untouched.
+    """
+    digest = hashlib.blake2b(size.to_bytes(8, 'little'), digest_size=16)
+    with open(path, 'rb') as fp:
+        digest.update(fp.read(block_size))
+        if size > block_size:
+            fp.seek(max(block_size, size - block_size))
+            digest.update(fp.read(block_size))
+    return digest.hexdigest()
+
+
+def _parse_batch(paths: List[Tuple[str, int]]) -> List[Tuple[Optional[TrackMetadata], float]]:
+    """
+    Parse the tags and fingerprint a batch of (path, size) files. Runs inside the worker pool.
+    Returns the metadata of each file along with the seconds spent on it.
+    """
+    results = []
+    for path, size in paths:
+        start = time.perf_counter()
+        metadata = MetadataManager.get_metadata(path)
+        if metadata:
+            metadata.fingerprint = file_fingerprint(path, size)
+        results.append((metadata, time.perf_counter() - start))
+    return results
+
+
+@dataclass
+class DirectoryScan:
+    """
+    Walk state of a single directory, shared by all of its batches
+    """
+    directory: DirectoryRow
+    cached_files: Dict[str, TrackRow]
+    mtime: int = 0
+    entry_count: int = 0
+    has_audio: bool = False
+    # Cached filenames which are no longer in the directory
+    stale: List[str] = field(default_factory=list)
+    # (track_id, filename, stat) of tracks moved here from elsewhere in the library
+    relinked: List[Tuple[int, str, os.stat_result]] = field(default_factory=list)
+
+
+@dataclass
+class ScanBatch:
+    """
+    Files of a directory that still need their tags parsed, along with the stat results taken
+    during the walk. The last batch of a directory has `final` set.
+    """
+    scan: DirectoryScan
+    pending: List[Tuple[str, os.stat_result]]
+    final: bool = False
+
+
+@dataclass
+class PhaseStats:
+    """
+    Time spent in one phase of a scan, along with the number of items (directories, files,
+    commits...) it handled
+    """
+    count: int = 0
+    seconds: float = 0
+
+    def add(self, seconds: float, count: int = 1):
+        self.count += count
+        self.seconds += seconds
+
+
+@dataclass
+class ScanProgress:
+    """
+    Counters of the running (or last finished) scan. Written by the scan's threads, safe to read
+    from any thread for reporting purposes.
+
+    Phases are timed separately: walk (listing and stat'ing, per directory), parse (per file,
+    summed across workers), write (inserts and updates, FTS triggers included), commit,
+    stale_delete and fts (the index rebuild after a bulk write).
+    """
+    PHASES = ('walk', 'parse', 'write', 'commit', 'stale_delete', 'fts')
+    # Files kept in the slowest to parse list
+    SLOWEST_COUNT = 10
+
+    running: bool = False
+    partial: bool = False
+    directories: int = 0
+    files: int = 0
+    written: int = 0
+    relinked: int = 0
+    deleted: int = 0
+    started: float = 0
+    finished: float = 0
+    phases: Dict[str, PhaseStats] = field(default_factory=lambda: {phase: PhaseStats() for phase in ScanProgress.PHASES})
+    # Min-heap of (seconds, path)
+    slowest: List[Tuple[float, str]] = field(default_factory=list)
+
+    @property
+    def elapsed(self) -> float:
+        return (time.monotonic() if self.running else self.finished) - self.started
+
+    @property
+    def changed(self) -> bool:
+        """Whether the scan wrote or deleted any track"""
+        return self.written > 0 or self.deleted > 0
+
+    @property
+    def files_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.files / elapsed if elapsed > 0 else 0
+
+    def add_parse_time(self, path: str, seconds: float):
+        self.phases['parse'].add(seconds)
+        if len(self.slowest) < ScanProgress.SLOWEST_COUNT:
+            heapq.heappush(self.slowest, (seconds, path))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, path))
+
+    def slowest_files(self) -> List[Tuple[float, str]]:
+        return sorted(self.slowest, reverse=True)
+
+    def to_dict(self) -> dict:
+        stats = asdict(self)
+        stats['elapsed'] = round(self.elapsed, 3)
+        stats['files_per_second'] = round(self.files_per_second, 1)
+        stats['phases'] = {
+            name: {'count': phase.count, 'seconds': round(phase.seconds, 3)} for name, phase in self.phases.items()
+        }
+        stats['slowest'] = [{'path': path, 'seconds': round(seconds, 3)} for seconds, path in self.slowest_files()]
+        del stats['started'], stats['finished']
+        return stats
+
+
+@dataclass
+class _Done:
+    """Marks the end of a pipeline stage's output, carrying the error that stopped it, if any"""
+    error: Optional[BaseException] = None
+
+
+class _ScanCancelled(Exception):
+    pass
+
+
+def _is_within(path: str, roots: Iterable[str]) -> bool:
+    """Whether path is one of roots or lies under one of them"""
+    return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+
+def _group_by_device(roots: List[Tuple[str, bool]]) -> List[List[Tuple[str, bool]]]:
+    """
+    Group roots by the device they live on. Each group gets its own walker, so that disks are read
+    concurrently without several walkers competing for the same one.
+    """
+    groups: Dict[Optional[int], List[Tuple[str, bool]]] = {}
+    for root in roots:
+        try:
+            device = os.stat(root[0]).st_dev
+        except OSError:
+            # Missing roots are dealt with by the walker
+            device = None
+        groups.setdefault(device, []).append(root)
+    return list(groups.values())
+
+
+def _is_covered(path: str, roots: List[Tuple[str, bool]]) -> bool:
+    """Whether a walk of roots, given as (path, recursive) pairs, visits path"""
+    return any(_is_within(path, [root]) if recursive else path == root for root, recursive in roots)
 
 
 class FileScanner:
-    def __init__(self, library_path: str, db: DatabaseManager) -> None:
+    EXECUTORS = ('process', 'thread')
+    FTS_TRIGGERS = migrations.FTS_TRIGGERS
+    # Rows written per transaction
+    CHUNK_SIZE = 1000
+    # Files per tag parsing job
+    BATCH_SIZE = 64
+    # Track writes above which the FTS triggers are suspended in favour of a single rebuild
+    BULK_THRESHOLD = 1000
+
+    def __init__(self, library_path: Union[str, List[str]], db: DatabaseManager, workers: Optional[int] = None, executor: str = 'process') -> None:
+        """
+        `library_path` is a single root or a list of them. `workers` is the size of the tag parsing
+        pool, defaulting to the number of CPUs. A value of 1 parses tags serially on a single thread.
+        `executor` is either 'process' or 'thread'.
+        """
+        if executor not in FileScanner.EXECUTORS:
+            raise ValueError(f"Unknown executor {executor}, expected one of {', '.join(FileScanner.EXECUTORS)}")
+
         self.db = db
-        self.library_path = library_path
+        paths = [library_path] if isinstance(library_path, str) else list(library_path)
+        if not paths:
+            raise ValueError("At least one library path is required")
+        # Roots nested in another root would be walked twice
+        self.library_paths = [path for path in dict.fromkeys(paths) if not _is_within(path, set(paths) - {path})]
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.executor = executor
         self.cached_dirs: Dict[str, DirectoryRow] = {}
-        self.new_directories: List[DirectoryRow] = []
-        self.new_tracks: List[Tuple[str, TrackMetadata]] = []
-        self.updated_tracks: List[Tuple[str, TrackMetadata]] = []
+        self.seen_dirs: Set[str] = set()
+        self.move_candidates: Dict[Tuple[int, str], List[Tuple[int, str]]] = {}
         self.deleted_directories: List[DirectoryRow] = []
+        self.artist_ids: Dict[str, int] = {}
+        self.album_ids: Dict[Tuple[str, int], int] = {}
+        self.__stop = threading.Event()
+        # Guards state shared by the walkers
+        self.__walk_lock = threading.Lock()
+        self.__incremental = False
+        self.progress = ScanProgress()
+        # Bumped by commits which changed tracks, lets readers tell their caches are stale
+        self.generation = 0
+        self.__uncommitted = 0
+        self.__committed_changes = 0
+        self.__fts_suspended = False
         self.__logger = logging.getLogger('scanner')
 
-        # Initialize database schema
+        # A previous bulk scan was interrupted before the FTS index was rebuilt
+        fts_stale = self._fts_suspended()
+
+        # Initialize the database schema, then bring databases created by older versions up to date
         self.db.executescript('db/schema.sql')
-    
-    def scan(self):
+        migrations.migrate(self.db)
+
+        if fts_stale:
+            self.__logger.warning("FTS triggers were missing, rebuilding the search index")
+            self._rebuild_fts()
+
+    def scan(self, incremental: bool = False, bulk: Optional[bool] = None):
+        """
+        Synchronize the database with the library on disk.
+
+        The scan is a pipeline of three stages joined by bounded queues: walker threads list the
+        tree and emit batches of files needing their tags parsed, a dispatcher thread hands them to
+        the worker pool, and the calling thread writes the results in walk order, committing every
+        CHUNK_SIZE rows. Memory use depends on the queue sizes, not on the size of the library.
+        Library roots on different devices are walked concurrently, one walker per device, while
+        all writes go through the single writer.
+
+        A directory's mtime is only stored once all of its files are written, so an interrupted scan
+        leaves the database consistent. The next scan skips every file that was already committed,
+        effectively resuming where the previous one stopped.
+
+        In incremental mode, tracked directories whose mtime and entry count match the stored values
+        are trusted to be unchanged: their files are neither stat'ed nor parsed, only their
+        subdirectories are visited. Tags edited in place (which don't touch the directory's mtime)
+        are only picked up by a full scan.
+
+        With `bulk`, the FTS triggers are dropped while writing and the index is rebuilt once at the
+        end. By default this kicks in once a scan has written BULK_THRESHOLD tracks.
+        """
+        self._run([(path, True) for path in self.library_paths], incremental, bulk, partial=False)
+
+    def scan_paths(self, directories: Iterable[str] = (), trees: Iterable[str] = (), bulk: Optional[bool] = None):
+        """
+        Bring part of the library up to date without walking all of it: the files directly inside
+        each of `directories`, and everything under each of `trees`. Subdirectories of a tree are
+        walked incrementally. Tracks and directories under paths that no longer exist are removed.
+        `bulk` works like it does for scan.
+        """
+        trees = set(trees)
+        roots = [(path, True) for path in trees if not _is_within(path, trees - {path})]
+        roots += [(path, False) for path in set(directories) if not _is_within(path, trees)]
+        if roots:
+            self._run(roots, incremental=True, bulk=bulk, partial=True)
+
+    def _run(self, roots: List[Tuple[str, bool]], incremental: bool, bulk: Optional[bool], partial: bool):
+        """
+        Run the scan pipeline over roots, given as (path, recursive) pairs. For partial runs, stale
+        detection is limited to the directories covered by the roots.
+        """
+        # Name -> id caches are only trusted for the duration of a scan
+        self.artist_ids.clear()
+        self.album_ids.clear()
+        self.__incremental = incremental
+        self.__uncommitted = 0
+        self.__committed_changes = 0
+        self.__stop.clear()
+        self.progress = ScanProgress(running=True, partial=partial, started=time.monotonic())
+
+        try:
+            self._run_pipeline(roots, bulk, partial)
+        finally:
+            self.progress.running = False
+            self.progress.finished = time.monotonic()
+
+        self.__logger.info(f"Scan finished: {json.dumps(self.progress.to_dict())}")
+
+    def _run_pipeline(self, roots: List[Tuple[str, bool]], bulk: Optional[bool], partial: bool):
+
         self.db.cursor.execute("SELECT * FROM directories")
         cached_directories = [DirectoryRow(*row) for row in self.db.cursor.fetchall()]
         self.cached_dirs = {dir.path: dir for dir in cached_directories}
 
-        for directory in self.cached_dirs.values():
-            if not os.path.isdir(directory.path):
+        # (dir_id, filename) of the tracks to delete once the walk is done
+        self.db.cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS stale_tracks (
+                dir_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                PRIMARY KEY (dir_id, filename)
+            )
+        """)
+        self.db.cursor.execute("DELETE FROM temp.stale_tracks")
+
+        if bulk:
+            self._suspend_fts()
+
+        groups = _group_by_device(roots)
+        walk_queue = queue.Queue(maxsize=self.workers * 4)
+        parse_queue = queue.Queue(maxsize=self.workers * 4)
+        executor = self._create_executor()
+        walkers = [
+            threading.Thread(target=self._walk, args=(walk_queue, group, partial), name=f'scan-walker-{i}', daemon=True)
+                for i, group in enumerate(groups)
+        ]
+        dispatcher = threading.Thread(target=self._dispatch, args=(walk_queue, parse_queue, executor, len(walkers)), name='scan-dispatcher', daemon=True)
+
+        for walker in walkers:
+            walker.start()
+        dispatcher.start()
+        try:
+            self._write(parse_queue, allow_bulk=bulk is None)
+        finally:
+            self.__stop.set()
+            for walker in walkers:
+                walker.join()
+            dispatcher.join()
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        scoped_dirs = list(self.cached_dirs.values())
+        if partial:
+            scoped_dirs = [directory for directory in scoped_dirs if _is_covered(directory.path, roots)]
+
+        # Tracked directories the walk did not reach no longer exist
+        for directory in scoped_dirs:
+            if directory.path not in self.seen_dirs:
                 self.deleted_directories.append(directory)
-                continue
 
-        library_directory = DirectoryRow(None, self.library_path)
-        self._scan_directory(library_directory)
-            
+        start = time.perf_counter()
         self._delete_stale_tracks()
         self._delete_stale_directories()
 
-        self._commit_directories()
-        self._commit_tracks()
-
         # Commit transaction
         self.db.connection.commit()
+        self._bump_generation()
+        self.progress.phases['stale_delete'].add(time.perf_counter() - start)
 
-    def _scan_directory(self, directory: DirectoryRow):
-        self.__logger.info(f"Scanning directory {directory.path}")
-
-        self.db.cursor.execute("SELECT * FROM tracks WHERE dir_id = ?", (directory.id,))
-        cached_files = [TrackRow(*row) for row in self.db.cursor.fetchall()]
-        files_on_disk = os.listdir(directory.path)
-        has_audio = False
-
-        for filename in files_on_disk:
-            filepath = os.path.join(directory.path, filename)
-
-            if os.path.isdir(filepath):
-                new_directory = DirectoryRow(None, filepath)
-                if filepath in self.cached_dirs:
-                    new_directory = self.cached_dirs[filepath]
-                self._scan_directory(new_directory)
-
-            if os.path.isfile(filepath):
-                cached_track = next((t for t in cached_files if t.filename == filename), None)
-                mtime = int(os.path.getmtime(filepath))
-                if cached_track and cached_track.mtime == mtime:
-                    # Cached and up-to-date
-                    has_audio = True
-                    continue
+        if self.__fts_suspended:
+            self._rebuild_fts()
+
+        self.seen_dirs.clear()
+        self.move_candidates.clear()
 
-                self.__logger.info(f"Scanning track {filepath}")
-                metadata = MetadataManager().get_metadata(filepath)
-                if not metadata:
+    def _create_executor(self) -> Optional[Executor]:
+        if self.workers <= 1:
+            return None
+        if self.executor == 'process':
+            # Workers are started from the dispatcher thread, forking a multi-threaded process is unsafe
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def _put(self, stage_queue: queue.Queue, item) -> float:
+        """
+        Blocking put that gives up once the scan is being torn down. Returns the seconds spent waiting
+        for room in the queue.
+        """
+        start = time.perf_counter()
+        while not self.__stop.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return time.perf_counter() - start
+            except queue.Full:
+                continue
+        raise _ScanCancelled
+
+    def _get(self, stage_queue: queue.Queue):
+        """
+        Blocking get that gives up once the scan is being torn down
+        """
+        while not self.__stop.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise _ScanCancelled
+
+    def _walk(self, walk_queue: queue.Queue, roots: List[Tuple[str, bool]], partial: bool):
+        """
+        Walker stage. Lists the roots and emits ScanBatches for files which are new or changed.
+        Uses its own read-only connection to look up the tracks cached for each directory.
+        """
+        reader = None
+        try:
+            reader = self.db.connect_reader()
+            for path, recursive in roots:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    if not partial:
+                        raise
+                    # Removed since the change was reported, its rows are cleaned up as stale
                     continue
 
-                has_audio = True
-                
-                if cached_track:
-                    # Track exists in db but has changed on disk
-                    self.updated_tracks.append((filepath, metadata))
-                else:
-                    # Track is not in db
-                    self.new_tracks.append((filepath, metadata))
+                directory = self.cached_dirs.get(path, DirectoryRow(None, path))
+                # Roots of a partial scan are known to have changed, never trust their mtime
+                self._walk_directory(reader, walk_queue, directory, stat, recursive=recursive, force=partial)
+            self._put(walk_queue, _Done())
+        except _ScanCancelled:
+            pass
+        except BaseException as e:
+            try:
+                self._put(walk_queue, _Done(e))
+            except _ScanCancelled:
+                pass
+        finally:
+            if reader:
+                reader.close()
+
+    def _walk_directory(self, reader, walk_queue: queue.Queue, directory: DirectoryRow, stat: os.stat_result, recursive: bool = True, force: bool = False):
+        """
+        Walk directory with a single scandir pass. Every file is stat'ed at most once, the result
+        travels with the file through the rest of the scan.
+        """
+        self.__logger.debug(f"Scanning directory {directory.path}")
+        start = time.perf_counter()
+        # Time spent blocked on the queue isn't walking
+        waited = 0
+
+        rows = reader.execute("SELECT * FROM tracks WHERE dir_id = ?", (directory.id,)).fetchall()
+        cached_files = {track.filename: track for track in (TrackRow(*row) for row in rows)}
+        scan = DirectoryScan(directory, cached_files, mtime=stat.st_mtime_ns)
+        subdirectories = []
+        pending = []
+
+        try:
+            with os.scandir(directory.path) as iterator:
+                entries = list(iterator)
+        except FileNotFoundError:
+            # Removed since it was listed, its rows are cleaned up as stale
+            self.__logger.debug(f"Directory {directory.path} disappeared during the scan")
+            return
+        self.seen_dirs.add(directory.path)
+
+        scan.entry_count = len(entries)
+        unchanged = (
+            self.__incremental
+            and not force
+            and directory.id is not None
+            and directory.mtime == scan.mtime
+            and directory.entry_count == scan.entry_count
+        )
+        if unchanged:
+            # Entries haven't been added, removed or renamed since the last scan
+            scan.has_audio = bool(cached_files)
+        seen_files = set()
+        files = 0
+
+        for entry in entries:
+            # Uses the d_type reported by scandir, no stat needed on most filesystems
+            if entry.is_dir():
+                subdirectories.append(entry)
+                continue
 
-        if has_audio:
-            if directory.path not in self.cached_dirs:
-                # New directory with audio
-                self.new_directories.append(directory)
-        elif directory.path in self.cached_dirs:
-            # Directory no longer has audio in it, untrack
-            self.deleted_directories.append(directory)
+            if unchanged or not entry.is_file():
+                continue
 
-    
-    def _delete_stale_directories(self):
-        for dir in self.deleted_directories:
-            self.__logger.info(f"Deleting directory {dir.path}")
-            self.db.cursor.execute("DELETE FROM directories WHERE path = ?", (dir.path,))
-        
-        self.deleted_directories.clear()
-    
-    def _delete_stale_tracks(self):
-        self.db.cursor.execute("""
-            SELECT directories.path || '/' || tracks.filename AS path
-            FROM tracks
-            JOIN directories
-            ON tracks.dir_id = directories.dir_id
-        """)
-        cached_track_paths = [path[0] for path in self.db.cursor.fetchall() if path is not None]
-        deleted_tracks = []
+            try:
+                file_stat = entry.stat()
+            except FileNotFoundError:
+                # Removed since the directory was listed, handled like a stale file
+                continue
+            seen_files.add(entry.name)
+            files += 1
+            cached_track = cached_files.get(entry.name)
+            if cached_track and FileScanner._is_up_to_date(cached_track, file_stat):
+                # Cached and up-to-date
+                scan.has_audio = True
+                continue
+
+            track_id = None if cached_track else self._find_moved_track(reader, entry.path, file_stat)
+            if track_id is not None:
+                # Moved or renamed, the existing row is relinked without parsing the file
+                scan.relinked.append((track_id, entry.name, file_stat))
+                scan.has_audio = True
+                continue
 
-        for path in cached_track_paths:
-            if os.path.isfile(path):
+            pending.append((entry.path, file_stat))
+            if len(pending) == FileScanner.BATCH_SIZE:
+                waited += self._put(walk_queue, ScanBatch(scan, pending))
+                pending = []
+
+        if not unchanged:
+            scan.stale = [filename for filename in cached_files if filename not in seen_files]
+        waited += self._put(walk_queue, ScanBatch(scan, pending, final=True))
+        with self.__walk_lock:
+            self.progress.directories += 1
+            self.progress.files += files
+            self.progress.phases['walk'].add(time.perf_counter() - start - waited)
+
+        if not recursive:
+            return
+
+        for entry in subdirectories:
+            try:
+                subdirectory_stat = entry.stat()
+            except FileNotFoundError:
                 continue
-            
-            self.__logger.info(f"Deleting track {path}")
-            deleted_tracks.append(os.path.basename(path))
+            subdirectory = self.cached_dirs.get(entry.path, DirectoryRow(None, entry.path))
+            self._walk_directory(reader, walk_queue, subdirectory, subdirectory_stat)
 
-        placeholders = ', '.join('?' for _ in deleted_tracks)
-        query = f"DELETE FROM tracks WHERE filename IN ({placeholders})"
-        self.db.cursor.execute(query, deleted_tracks)
+    @staticmethod
+    def _is_up_to_date(track: TrackRow, stat: os.stat_result) -> bool:
+        # Rows written before a property was stored are reparsed to fill it in
+        return (
+            track.mtime == int(stat.st_mtime)
+            and track.duration is not None
+            and track.fingerprint is not None
+            and (track.codec != 'opus' or track.frame_duration is not None)
+        )
+
+    def _find_moved_track(self, reader, path: str, stat: os.stat_result) -> Optional[int]:
+        """
+        Look for the row of a file which was moved to path: one with the same size and fingerprint
+        whose file no longer exists. The file is only fingerprinted if tracks of the same size are
+        stored. Returns the id of the matching track, if any.
+        """
+        if reader.execute("SELECT 1 FROM tracks WHERE size = ? LIMIT 1", (stat.st_size, )).fetchone() is None:
+            return None
 
-    def _commit(self):
-        self._commit_directories()
-        self._commit_tracks()
-        self.db.connection.commit()
+        key = (stat.st_size, file_fingerprint(path, stat.st_size))
+        # Candidates are shared by the walkers, each row must only be relinked once
+        with self.__walk_lock:
+            candidates = self.move_candidates.get(key)
+            if candidates is None:
+                # Loaded once per fingerprint and consumed as rows are relinked, so that libraries
+                # with many identical files don't rescan the same candidates for each of them
+                query = """
+                    SELECT tracks.track_id, directories.path || '/' || tracks.filename
+                    FROM tracks
+                    JOIN directories
+                    ON tracks.dir_id = directories.dir_id
+                    WHERE tracks.size = ? AND tracks.fingerprint = ?
+                    ORDER BY tracks.track_id DESC
+                """
+                candidates = self.move_candidates[key] = reader.execute(query, key).fetchall()
+
+            while candidates:
+                track_id, old_path = candidates.pop()
+                # Otherwise it's a copy rather than a move
+                if not os.path.lexists(old_path):
+                    return track_id
+
+        return None
+
+    def _dispatch(self, walk_queue: queue.Queue, parse_queue: queue.Queue, executor: Optional[Executor], walkers: int):
+        """
+        Tag parsing stage. Submits each batch to the worker pool and forwards it to the writer along
+        with its future. The bounded parse queue caps the number of batches in flight. Finishes
+        once all of the walkers are done, or as soon as one of them fails.
+        """
+        try:
+            while True:
+                batch = self._get(walk_queue)
+                if isinstance(batch, _Done):
+                    walkers -= 1
+                    if batch.error or walkers == 0:
+                        self._put(parse_queue, (batch, None))
+                        return
+                    continue
 
-    def _commit_directories(self):
-        for directory in self.new_directories:
-            self.__logger.info(f"Inserting directory {directory.path}")
-            query = "INSERT INTO directories (path) VALUES (?)" 
-            self.db.cursor.execute(query, (directory.path, ))
-        self.new_directories.clear()
+                paths = [(path, stat.st_size) for path, stat in batch.pending]
+                for path, _ in paths:
+                    self.__logger.debug(f"Scanning track {path}")
 
-    def _commit_tracks(self):
-        self.db.cursor.execute("SELECT dir_id, path FROM directories")
-        directories = {path: dir_id for dir_id, path in self.db.cursor.fetchall()}
+                if executor and paths:
+                    future = executor.submit(_parse_batch, paths)
+                else:
+                    future = Future()
+                    future.set_result(_parse_batch(paths))
+                self._put(parse_queue, (batch, future))
+        except _ScanCancelled:
+            pass
+        except BaseException as e:
+            try:
+                self._put(parse_queue, (_Done(e), None))
+            except _ScanCancelled:
+                pass
+
+    def _write(self, parse_queue: queue.Queue, allow_bulk: bool):
+        """
+        Writer stage, runs on the calling thread which owns the database connection
+        """
+        while True:
+            batch, future = self._get(parse_queue)
+            if isinstance(batch, _Done):
+                if batch.error:
+                    raise batch.error
+                break
+
+            written = self._write_batch(batch, future.result())
+            self.progress.written += written
+            self.__uncommitted += written
+
+            if self.__uncommitted >= FileScanner.CHUNK_SIZE:
+                self._commit()
+                self.__uncommitted = 0
+
+            if allow_bulk and not self.__fts_suspended and self.progress.written >= FileScanner.BULK_THRESHOLD:
+                self._suspend_fts()
+
+        self._commit()
 
-        for track in self.new_tracks:
-            filename = os.path.basename(track[0])
-            dir_path = os.path.dirname(track[0])
-            mtime = int(os.path.getmtime(track[0]))
+    def _commit(self):
+        start = time.perf_counter()
+        self.db.connection.commit()
+        self._bump_generation()
+        self.progress.phases['commit'].add(time.perf_counter() - start)
+
+    def _bump_generation(self):
+        """Bump the library generation after a commit, if tracks were written or deleted since the last bump"""
+        changes = self.progress.written + self.progress.deleted
+        if changes != self.__committed_changes:
+            self.__committed_changes = changes
+            self.generation += 1
+
+    def _write_batch(self, batch: ScanBatch, results: List[Tuple[Optional[TrackMetadata], float]]) -> int:
+        """
+        Write the parsed tracks of a batch. Returns the number of rows written, relinked ones included
+        """
+        scan = batch.scan
+        directory = scan.directory
+        new_tracks = []
+        updated_tracks = []
+        start = time.perf_counter()
+
+        for (path, stat), (metadata, seconds) in zip(batch.pending, results):
+            self.progress.add_parse_time(path, seconds)
+            if not metadata:
+                continue
+
+            scan.has_audio = True
 
-            artist_id = self._get_or_insert_artist(track[1].artist)
-            albumartist_id = self._get_or_insert_artist(track[1].albumartist)
-            album_id = self._get_or_insert_album(track[1].album, albumartist_id)
-            dir_id = directories.get(dir_path)
+            if os.path.basename(path) in scan.cached_files:
+                # Track exists in db but has changed on disk
+                updated_tracks.append((path, metadata, stat))
+            else:
+                # Track is not in db
+                new_tracks.append((path, metadata, stat))
 
-            self.__logger.info(f"Inserting track {filename}")
+        if scan.has_audio and directory.id is None:
+            # New directory with audio. Its mtime is stored along with its last batch, so an
+            # interrupted scan revisits it
+            self.__logger.debug(f"Inserting directory {directory.path}")
+            self.db.cursor.execute("INSERT INTO directories (path) VALUES (?)", (directory.path, ))
+            directory.id = self.db.cursor.lastrowid
 
+        if new_tracks:
+            self.__logger.debug(f"Inserting {len(new_tracks)} tracks in {directory.path}")
             query = """
-                INSERT INTO tracks (title, artist_id, album_id, dir_id, filename, mtime)
-                    VALUES (?, ?, ?, ?, ?, ?)
+                INSERT INTO tracks (title, artist_id, album_id, mtime, duration, bitrate, sample_rate, channels, codec, size, fingerprint, frame_duration, dir_id, filename)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """
-            self.db.cursor.execute(query, (track[1].title, artist_id, album_id, dir_id, filename, mtime))
-        
-        for track in self.updated_tracks:
-            title = track[1].title
-            artist_id = self._get_or_insert_artist(track[1].artist)
-            albumartist_id = self._get_or_insert_artist(track[1].albumartist)
-            album_id = self._get_or_insert_album(track[1].album, albumartist_id)
-            mtime = int(os.path.getmtime(track[0]))
-            filename = os.path.basename(track[0])
-
-            self.__logger.info(f"Updating track {filename}")
+            self.db.cursor.executemany(query, [self._track_values(track, directory.id) for track in new_tracks])
 
+        if updated_tracks:
+            self.__logger.debug(f"Updating {len(updated_tracks)} tracks in {directory.path}")
+            query = """
+                UPDATE tracks
+                SET title = ?, artist_id = ?, album_id = ?, mtime = ?,
+                    duration = ?, bitrate = ?, sample_rate = ?, channels = ?, codec = ?,
+                    size = ?, fingerprint = ?, frame_duration = ?
+                WHERE dir_id = ? AND filename = ?
+            """
+            self.db.cursor.executemany(query, [self._track_values(track, directory.id) for track in updated_tracks])
+
+        relinked = self._finish_directory(scan) if batch.final else 0
+        self.progress.phases['write'].add(time.perf_counter() - start, len(new_tracks) + len(updated_tracks) + relinked)
+
+        return len(new_tracks) + len(updated_tracks) + relinked
+
+    def _finish_directory(self, scan: DirectoryScan) -> int:
+        """
+        Apply the changes of a directory known once it has been walked completely. Returns the number
+        of relinked tracks
+        """
+        directory = scan.directory
+        if scan.relinked:
+            self.__logger.debug(f"Relinking {len(scan.relinked)} moved tracks to {directory.path}")
+            # Titles which fell back to the filename follow the rename
             query = """
                 UPDATE tracks
-                SET title = ?, artist_id = ?, album_id = ?, mtime = ?
-                WHERE filename = ?
+                SET title = CASE WHEN title = filename THEN :filename ELSE title END,
+                    dir_id = :dir_id, filename = :filename, mtime = :mtime
+                WHERE track_id = :track_id
             """
-            self.db.cursor.execute(query, (title, artist_id, album_id, mtime, filename))
-        
-        self.new_tracks.clear()
-        self.updated_tracks.clear()
+            self.db.cursor.executemany(query, [
+                {'dir_id': directory.id, 'filename': filename, 'mtime': int(stat.st_mtime), 'track_id': track_id}
+                    for track_id, filename, stat in scan.relinked
+            ])
+            self.progress.relinked += len(scan.relinked)
+
+        if scan.stale:
+            for filename in scan.stale:
+                self.__logger.debug(f"Deleting track {os.path.join(directory.path, filename)}")
+            query = "INSERT INTO temp.stale_tracks (dir_id, filename) VALUES (?, ?)"
+            self.db.cursor.executemany(query, [(directory.id, filename) for filename in scan.stale])
+
+        if scan.has_audio:
+            if (directory.mtime, directory.entry_count) != (scan.mtime, scan.entry_count):
+                query = "UPDATE directories SET mtime = ?, entry_count = ? WHERE dir_id = ?"
+                self.db.cursor.execute(query, (scan.mtime, scan.entry_count, directory.id))
+        elif directory.path in self.cached_dirs:
+            # Directory no longer has audio in it, untrack
+            self.deleted_directories.append(directory)
+
+        return len(scan.relinked)
+
+    def _track_values(self, track: Tuple[str, TrackMetadata, os.stat_result], dir_id: int) -> tuple:
+        """
+        Row values for a scanned track, ordered as (title, artist_id, album_id, mtime, duration,
+        bitrate, sample_rate, channels, codec, size, fingerprint, frame_duration, dir_id, filename)
+        """
+        path, metadata, stat = track
+        stream = metadata.stream
+        artist_id = self._get_or_insert_artist(metadata.artist)
+        albumartist_id = self._get_or_insert_artist(metadata.albumartist)
+        album_id = self._get_or_insert_album(metadata.album, albumartist_id)
+
+        return (
+            metadata.title,
+            artist_id,
+            album_id,
+            int(stat.st_mtime),
+            stream.duration,
+            stream.bitrate,
+            stream.sample_rate,
+            stream.channels,
+            stream.codec,
+            stat.st_size,
+            metadata.fingerprint,
+            stream.frame_duration,
+            dir_id,
+            os.path.basename(path),
+        )
+
+    def _delete_stale_directories(self):
+        for dir in self.deleted_directories:
+            self.__logger.debug(f"Deleting directory {dir.path}")
+            self.db.cursor.execute("DELETE FROM directories WHERE path = ?", (dir.path,))
+
+        self.deleted_directories.clear()
+
+    def _delete_stale_tracks(self):
+        """
+        Delete the tracks collected in stale_tracks by the walk, along with every track of the
+        directories being deleted, in a single statement. Only the changes are touched, not the
+        whole library.
+        """
+        query = """
+            INSERT OR IGNORE INTO temp.stale_tracks (dir_id, filename)
+                SELECT dir_id, filename FROM tracks WHERE dir_id = ?
+        """
+        self.db.cursor.executemany(query, [(dir.id, ) for dir in self.deleted_directories])
+
+        self.db.cursor.execute("""
+            DELETE FROM tracks
+            WHERE (dir_id, filename) IN (SELECT dir_id, filename FROM temp.stale_tracks)
+        """)
+        if self.db.cursor.rowcount > 0:
+            self.__logger.info(f"Deleted {self.db.cursor.rowcount} stale tracks")
+            self.progress.deleted += self.db.cursor.rowcount
+        self.db.cursor.execute("DELETE FROM temp.stale_tracks")
+
+    def _fts_suspended(self) -> bool:
+        """
+        Whether the tracks table exists but some of the triggers keeping tracks_fts in sync don't
+        """
+        if not self.db.connection:
+            self.db.connect()
+
+        self.db.cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        names = {row[0] for row in self.db.cursor.fetchall()}
+        return 'tracks' in names and not all(trigger in names for trigger in FileScanner.FTS_TRIGGERS)
+
+    def _suspend_fts(self):
+        """
+        Drop the FTS sync triggers. They run correlated subqueries for every written row, which
+        dominates bulk imports. _rebuild_fts must be called once writing is done.
+        """
+        self.__logger.info("Suspending FTS triggers for bulk write")
+        for trigger in FileScanner.FTS_TRIGGERS:
+            self.db.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        self.db.connection.commit()
+        self.__fts_suspended = True
+
+    def _rebuild_fts(self):
+        """
+        Repopulate tracks_fts from tracks_view in one pass and restore the sync triggers
+        """
+        self.__logger.info("Rebuilding FTS index")
+        start = time.perf_counter()
+        self.db.cursor.execute("INSERT INTO tracks_fts(tracks_fts) VALUES ('rebuild')")
+        self.db.connection.commit()
+        if self.progress.changed:
+            # Tracks written while the triggers were dropped only become searchable now
+            self.generation += 1
+        # Recreates the dropped triggers
+        self.db.executescript('db/schema.sql')
+        self.__fts_suspended = False
+        self.progress.phases['fts'].add(time.perf_counter() - start)
 
     def _get_or_insert_artist(self, name: str):
+        if name in self.artist_ids:
+            return self.artist_ids[name]
+
         self.db.cursor.execute("SELECT artist_id FROM artists WHERE name = ?", (name, ))
         artist_id = self.db.cursor.fetchone()
 
         if artist_id is None:
-            self.__logger.info(f"Inserting artist {name}")
+            self.__logger.debug(f"Inserting artist {name}")
             self.db.cursor.execute("INSERT INTO artists (name) VALUES (?)", (name, ))
-            return self.db.cursor.lastrowid
+            artist_id = (self.db.cursor.lastrowid, )
 
+        self.artist_ids[name] = artist_id[0]
         return artist_id[0]
 
     def _get_or_insert_album(self, name: str, artist_id: int):
+        if (name, artist_id) in self.album_ids:
+            return self.album_ids[(name, artist_id)]
+
         self.db.cursor.execute("SELECT album_id FROM albums WHERE name = ? AND artist_id = ?", (name, artist_id))
         album_id = self.db.cursor.fetchone()
 
         if album_id is None:
-            self.__logger.info(f"Inserting album {name}")
+            self.__logger.debug(f"Inserting album {name}")
             self.db.cursor.execute("INSERT INTO albums (name, artist_id) VALUES (?, ?)", (name, artist_id))
-            return self.db.cursor.lastrowid
+            album_id = (self.db.cursor.lastrowid, )
 
+        self.album_ids[(name, artist_id)] = album_id[0]
         return album_id[0]
@@ -0,0 +1,113 @@
+import logging
+import sqlite3
+
+from typing import Callable, List, Optional
+
+from src.db_manager import AsyncQueryExecutor
+from src.autocomplete import tokenize
+from src.fuzzy import TrigramIndex, max_typos
+from src.models import Track
+from src.search_cache import SearchCache
+
+
+class TrackSearch:
+    """
+    Full text search over the library, ranked and paginated in SQL so that broad queries only
+    ever materialise the requested page.
+
+    The fuzzy mode tolerates typos: every query word is replaced by its closest spellings in the
+    library's vocabulary, the best FUZZY_CANDIDATES matches are then re-ranked by how many edits
+    they needed.
+
+    Results are cached when a cache is given, keyed by the library generation returned by
+    generation() and the version of the vocabulary.
+    """
+    # bm25 weights of tracks_fts' title, artist_name and album_title columns
+    COLUMN_WEIGHTS = (10.0, 5.0, 2.0)
+    # Fuzzy matches re-ranked in memory, fuzzy searches return no more than these
+    FUZZY_CANDIDATES = 100
+
+    def __init__(self, queries: AsyncQueryExecutor, cache: Optional[SearchCache] = None, generation: Callable[[], int] = lambda: 0) -> None:
+        self.queries = queries
+        self.cache = cache
+        self.generation = generation
+        self._vocabulary = TrigramIndex()
+        self._vocabulary_version = 0
+        self.__logger = logging.getLogger('search')
+
+    @property
+    def vocabulary(self) -> TrigramIndex:
+        return self._vocabulary
+
+    @vocabulary.setter
+    def vocabulary(self, vocabulary: TrigramIndex):
+        # Replaced whenever the library changes, possibly from another thread
+        self._vocabulary = vocabulary
+        self._vocabulary_version += 1
+
+    async def search(self, query: str, limit: int, offset: int = 0, fuzzy: bool = False) -> List[Track]:
+        """
+        Tracks matching every word of query, the last one as a prefix, best matches first.
+        Returns at most limit tracks, skipping the first offset.
+        """
+        key = (query.strip().casefold(), limit, offset, fuzzy)
+        generation = (self.generation(), self._vocabulary_version)
+        if self.cache is not None:
+            results = self.cache.get(key, generation)
+            if results is not None:
+                return results
+
+        if fuzzy:
+            results = await self._fuzzy_search(query, limit, offset)
+        else:
+            try:
+                results = await self._match(query + '*', limit, offset)
+            except sqlite3.OperationalError as e:
+                # Not a valid FTS expression, e.g. 'AC/DC', the fuzzy search only looks at its words
+                self.__logger.debug(f"Invalid search query {query}: {e}")
+                results = []
+
+        self.__logger.debug(f"Found {len(results)} {'fuzzy ' if fuzzy else ''}rows at offset {offset}, best match {results[0] if results else 'None'}")
+        # Results read while the library changed may already be stale
+        if self.cache is not None and generation == (self.generation(), self._vocabulary_version):
+            self.cache.put(key, results, generation)
+        return results
+
+    async def _match(self, expression: str, limit: int, offset: int) -> List[Track]:
+        title, artist, album = TrackSearch.COLUMN_WEIGHTS
+        q_str = f"""
+            SELECT rowid, title, artist_name, album_title
+            FROM tracks_fts
+            WHERE tracks_fts MATCH ?
+            ORDER BY bm25(tracks_fts, {title}, {artist}, {album}), rowid
+            LIMIT ? OFFSET ?
+        """
+        rows = await self.queries.fetchall(q_str, (expression, limit, offset))
+        return [Track(*row) for row in rows]
+
+    async def _fuzzy_search(self, query: str, limit: int, offset: int) -> List[Track]:
+        words = tokenize(query)
+        # (spelling -> edits) for every word of the query
+        spellings = [dict(self.vocabulary.corrections(word)) for word in words]
+        if not words or not all(spellings):
+            return []
+
+        expression = ' AND '.join(
+            '(' + ' OR '.join(f'"{spelling}"' for spelling in options) + ')' for options in spellings
+        )
+        candidates = await self._match(expression, TrackSearch.FUZZY_CANDIDATES, 0)
+
+        def edits(track: Track) -> int:
+            tokens = set(tokenize(f"{track.title} {track.artist} {track.album}"))
+            return sum(
+                min((distance for spelling, distance in options.items() if spelling in tokens), default=max_typos(word) + 1)
+                for word, options in zip(words, spellings)
+            )
+
+        # Stable, bm25 breaks ties
+        candidates.sort(key=edits)
+        return candidates[offset:offset + limit]
+
+    async def get_track(self, track_id: int) -> Optional[Track]:
+        row = await self.queries.fetchone("SELECT rowid, title, artist_name, album_title FROM tracks_view WHERE rowid = ?", (track_id, ))
+        return Track(*row) if row else None
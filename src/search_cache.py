@@ -0,0 +1,108 @@
+import sys
+
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Hashable, List, Optional
+
+from src.models import Track
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    # Times the cache was cleared because the library changed
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def to_dict(self) -> dict:
+        stats = asdict(self)
+        stats['hit_ratio'] = round(self.hit_ratio, 3)
+        return stats
+
+
+def _size_of(key: Hashable, tracks: List[Track]) -> int:
+    """Approximate memory held by an entry, its key and result list included"""
+    size = sys.getsizeof(key) + sys.getsizeof(tracks)
+    if isinstance(key, tuple):
+        size += sum(sys.getsizeof(part) for part in key)
+    for track in tracks:
+        size += sys.getsizeof(track) + sys.getsizeof(track.__dict__)
+        size += sys.getsizeof(track.title) + sys.getsizeof(track.artist) + sys.getsizeof(track.album)
+    return size
+
+
+class SearchCache:
+    """
+    LRU cache of search results, bounded by entry count and by the approximate memory they use.
+
+    Entries are tagged with the library generation they were read at, a counter bumped by the
+    scanner on every commit changing tracks. The whole cache is dropped as soon as get() sees a new
+    generation, and put() ignores results read at an older generation than the last one seen.
+    Callers are expected to check the generation didn't change while their query ran.
+    """
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.stats = CacheStats()
+        self._entries: OrderedDict[Hashable, List[Track]] = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_generation(self, generation: int):
+        if generation != self.generation:
+            if self._entries:
+                self.stats.invalidations += 1
+            self.clear()
+            self.generation = generation
+
+    def get(self, key: Hashable, generation: int) -> Optional[List[Track]]:
+        self._check_generation(generation)
+        tracks = self._entries.get(key)
+        if tracks is None:
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return list(tracks)
+
+    def put(self, key: Hashable, tracks: List[Track], generation: int):
+        """Store the results of a search which started at generation"""
+        if generation != self.generation:
+            # The library changed while the query ran
+            return
+
+        size = _size_of(key, tracks)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = list(tracks)
+        self._sizes[key] = size
+        self.stats.bytes += size
+        while len(self._entries) > self.max_entries or self.stats.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+        self.stats.entries = len(self._entries)
+
+    def _remove(self, key: Hashable):
+        del self._entries[key]
+        self.stats.bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self.stats.entries = 0
+        self.stats.bytes = 0
@@ -0,0 +1,609 @@
+"""
+Header-only readers for the tags and stream properties of the most common formats: MP3 (ID3v2),
+FLAC, Ogg Opus/Vorbis and MP4/M4A.
+
+mutagen finds a file's format by scoring it against every parser it knows, then loads all of its
+tags, cover art included. These readers only look at the few tags the scanner stores and seek over
+everything else, so a file costs a handful of small reads. Anything they don't fully understand
+(unsynchronised or compressed ID3 frames, multiplexed Ogg streams, oversized comment packets...)
+is left to mutagen: `read_file` returns None and the caller falls back.
+"""
+import os
+import struct
+
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from src.models import StreamInfo
+
+# Tags read by the scanner, named after mutagen's easy keys
+FIELDS = ('title', 'artist', 'album', 'albumartist')
+
+ID3_FRAMES = {
+    b'TIT2': 'title',
+    b'TPE1': 'artist',
+    b'TALB': 'album',
+    b'TPE2': 'albumartist',
+}
+ID3V22_FRAMES = {
+    b'TT2': 'title',
+    b'TP1': 'artist',
+    b'TAL': 'album',
+    b'TP2': 'albumartist',
+}
+ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+# Fields an ID3v1 tag can hold, mutagen uses them to fill in the ones missing from the ID3v2 tag
+ID3V1_FIELDS = ('title', 'artist', 'album')
+ID3V1_SIZE = 128
+
+MP4_ITEMS = {
+    b'\xa9nam': 'title',
+    b'\xa9ART': 'artist',
+    b'\xa9alb': 'album',
+    b'aART': 'albumartist',
+}
+MP4_CONTAINERS = (b'moov', b'trak', b'mdia', b'minf', b'stbl', b'udta', b'meta', b'ilst')
+
+# Layer III bitrates in kbps, for MPEG 1 and MPEG 2/2.5
+MPEG_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_SAMPLE_RATES = (44100, 48000, 32000)
+
+# Bytes searched for the first MPEG frame after the ID3 tag
+MPEG_SYNC_WINDOW = 16 * 1024
+# Bytes searched for the last Ogg page, which holds the stream's length
+OGG_TAIL_WINDOW = 64 * 1024
+# Largest Ogg comment packet read, embedded pictures make them arbitrarily large
+OGG_MAX_PACKET = 256 * 1024
+
+TagsAndStream = Tuple[Dict[str, str], StreamInfo]
+
+
+class UnsupportedFile(Exception):
+    """The file uses a feature the readers don't handle"""
+
+
+def read_file(path: str) -> Optional[TagsAndStream]:
+    """
+    Read the tags and stream properties of path. Returns None for files which should be handed
+    to mutagen: unknown formats, non-audio files and anything unusual.
+    """
+    with open(path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        head = fp.read(12)
+        try:
+            if head.startswith(b'ID3'):
+                return _read_mp3(fp, size)
+            if head.startswith(b'fLaC'):
+                return _read_flac(fp, size)
+            if head.startswith(b'OggS'):
+                return _read_ogg(fp, size)
+            if head[4:8] == b'ftyp':
+                return _read_mp4(fp, size)
+            if head[0] == 0xff and _parse_mpeg_header(head, 0):
+                # MP3 without an ID3v2 tag, whose tags can only be in an ID3v1 tag
+                if _id3v1_size(fp, size):
+                    raise UnsupportedFile("ID3v1 tag")
+                return {}, _read_mpeg_stream(fp, size, 0)
+        except (UnsupportedFile, struct.error, ValueError, IndexError):
+            # Truncated or malformed, mutagen knows how to deal with (or reject) it
+            return None
+    return None
+
+
+def _read_exactly(fp: BinaryIO, size: int) -> bytes:
+    data = fp.read(size)
+    if len(data) != size:
+        raise UnsupportedFile("Unexpected end of file")
+    return data
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _id3v1_size(fp: BinaryIO, size: int) -> int:
+    """Size of the ID3v1 tag ending the file, 0 if there is none"""
+    if size < ID3V1_SIZE:
+        return 0
+    fp.seek(size - ID3V1_SIZE)
+    return ID3V1_SIZE if fp.read(3) == b'TAG' else 0
+
+
+def _read_mp3(fp: BinaryIO, size: int) -> TagsAndStream:
+    fp.seek(0)
+    header = _read_exactly(fp, 10)
+    major, flags = header[3], header[5]
+    # Unsynchronised tags and extended headers (compression on 2.2) need mutagen
+    if major not in (2, 3, 4) or flags & 0xc0:
+        raise UnsupportedFile(f"ID3v2.{major} with flags {flags:#x}")
+
+    tag_end = 10 + _syncsafe(header[6:10])
+    frames, header_size, id_size = (ID3V22_FRAMES, 6, 3) if major == 2 else (ID3_FRAMES, 10, 4)
+    tags = {}
+    offset = 10
+
+    while offset + header_size <= tag_end and len(tags) < len(FIELDS):
+        fp.seek(offset)
+        frame_header = _read_exactly(fp, header_size)
+        frame_id = frame_header[:id_size]
+        if frame_id[0] == 0:
+            # Padding
+            break
+        if not frame_id.isalnum():
+            raise UnsupportedFile(f"Invalid frame id {frame_id}")
+
+        if major == 2:
+            frame_size, frame_flags = int.from_bytes(frame_header[3:6], 'big'), 0
+        elif major == 3:
+            # Compression, encryption, grouping
+            frame_size, frame_flags = int.from_bytes(frame_header[4:8], 'big'), frame_header[9] & 0xe0
+        else:
+            # Grouping, compression, encryption, unsynchronisation, data length indicator
+            frame_size, frame_flags = _syncsafe(frame_header[4:8]), frame_header[9] & 0x4f
+
+        name = frames.get(frame_id)
+        if name and name not in tags:
+            if frame_flags:
+                raise UnsupportedFile(f"Frame {frame_id} has flags {frame_flags:#x}")
+            tags[name] = _decode_id3_text(_read_exactly(fp, frame_size))
+        offset += header_size + frame_size
+
+    id3v1_size = _id3v1_size(fp, size)
+    if id3v1_size and any(name not in tags for name in ID3V1_FIELDS):
+        # Merged into the ID3v2 tags by mutagen
+        raise UnsupportedFile("ID3v1 tag completing the ID3v2 tag")
+
+    # A footer follows 2.4 tags which have the footer flag
+    audio_start = tag_end + (10 if major == 4 and flags & 0x10 else 0)
+    return tags, _read_mpeg_stream(fp, size - id3v1_size, audio_start)
+
+
+def _decode_id3_text(data: bytes) -> str:
+    if not data or data[0] >= len(ID3_ENCODINGS):
+        raise UnsupportedFile("Invalid text frame")
+    text = data[1:].decode(ID3_ENCODINGS[data[0]], errors='replace')
+    # Frames may hold several null separated values, the scanner uses the first one
+    return text.split('\0')[0]
+
+
+def _read_mpeg_stream(fp: BinaryIO, size: int, audio_start: int) -> StreamInfo:
+    fp.seek(audio_start)
+    data = fp.read(MPEG_SYNC_WINDOW)
+
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xff or data[offset + 1] & 0xe0 != 0xe0:
+            continue
+        frame = _parse_mpeg_header(data, offset)
+        if frame is None:
+            continue
+
+        # A sync word can appear by chance, require the next frame to follow
+        frame_length, version, bitrate, sample_rate, channels = frame
+        following = offset + frame_length
+        if following + 4 <= len(data) and _parse_mpeg_header(data, following) is None:
+            continue
+
+        return _mpeg_stream_info(data, offset, size - audio_start - offset, *frame)
+
+    raise UnsupportedFile("No MPEG frame found")
+
+
+def _parse_mpeg_header(data: bytes, offset: int) -> Optional[Tuple[int, int, int, int, int]]:
+    """
+    Parse the Layer III frame header at offset. Returns (frame length, version, bitrate, sample
+    rate, channels), or None if the header isn't valid
+    """
+    if offset + 4 > len(data) or data[offset] != 0xff:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version_bits, layer_bits = (b1 >> 3) & 3, (b1 >> 1) & 3
+    bitrate_index, sample_rate_index = b2 >> 4, (b2 >> 2) & 3
+    if b1 & 0xe0 != 0xe0 or version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    # 3 is MPEG 1, 2 is MPEG 2 and 0 is MPEG 2.5
+    version = 1 if version_bits == 3 else 2
+    bitrate = MPEG_BITRATES[version][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[sample_rate_index] >> {3: 0, 2: 1, 0: 2}[version_bits]
+    padding = (b2 >> 1) & 1
+    channels = 1 if b3 >> 6 == 3 else 2
+    frame_length = (144 if version == 1 else 72) * bitrate // sample_rate + padding
+    return frame_length, version, bitrate, sample_rate, channels
+
+
+def _mpeg_stream_info(data: bytes, offset: int, audio_size: int, frame_length: int, version: int, bitrate: int, sample_rate: int, channels: int) -> StreamInfo:
+    """
+    Stream properties from the first frame, using its Xing/Info or VBRI header when there is one.
+    Matches the way mutagen computes them.
+    """
+    samples_per_frame = 1152 if version == 1 else 576
+    side_info = (32 if channels == 2 else 17) if version == 1 else (17 if channels == 2 else 9)
+    xing = offset + 4 + side_info
+    vbri = offset + 4 + 32
+
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[xing + 4:xing + 8], 'big')
+        position = xing + 8
+        frames = audio_bytes = None
+        if flags & 1:
+            frames = int.from_bytes(data[position:position + 4], 'big')
+            position += 4
+        if flags & 2:
+            audio_bytes = int.from_bytes(data[position:position + 4], 'big')
+            position += 4
+        position += (100 if flags & 4 else 0) + (4 if flags & 8 else 0)
+
+        if frames is not None:
+            samples = frames * samples_per_frame
+            if audio_bytes is not None and samples > 0:
+                # The Xing frame itself is counted in bytes but not in frames
+                bitrate = round(max(0, audio_bytes - frame_length) * 8 * sample_rate / samples)
+            samples = max(0, samples - _lame_gapless_samples(data, position))
+            return StreamInfo(samples / sample_rate, bitrate, sample_rate, channels, 'mp3')
+
+    elif data[vbri:vbri + 4] == b'VBRI':
+        audio_bytes = int.from_bytes(data[vbri + 10:vbri + 14], 'big')
+        frames = int.from_bytes(data[vbri + 14:vbri + 18], 'big')
+        duration = frames * samples_per_frame / sample_rate
+        if duration:
+            bitrate = int(audio_bytes * 8 / duration)
+        return StreamInfo(duration, bitrate, sample_rate, channels, 'mp3')
+
+    # Constant bitrate, estimated from the file size
+    return StreamInfo(audio_size * 8 / bitrate, bitrate, sample_rate, channels, 'mp3')
+
+
+def _lame_gapless_samples(data: bytes, position: int) -> int:
+    """
+    Encoder delay and padding stored by LAME 3.90+ after the Xing header, in samples
+    """
+    version = data[position:position + 9]
+    if not version.startswith((b'LAME', b'L3.99')) or len(data) < position + 24:
+        return 0
+    if version.startswith(b'LAME'):
+        digits = version[4:].split(b'.')
+        if len(digits) < 2 or not digits[0].isdigit():
+            return 0
+        minor = bytes(c for c in digits[1] if chr(c).isdigit())
+        if (int(digits[0]), int(minor or b'0')) < (3, 90):
+            return 0
+
+    gapless = int.from_bytes(data[position + 21:position + 24], 'big')
+    return (gapless >> 12) + (gapless & 0xfff)
+
+
+def _parse_vorbis_comments(data: bytes, offset: int = 0) -> Dict[str, str]:
+    def read_length():
+        nonlocal offset
+        if offset + 4 > len(data):
+            raise UnsupportedFile("Truncated comment block")
+        value = int.from_bytes(data[offset:offset + 4], 'little')
+        offset += 4
+        return value
+
+    vendor_length = read_length()
+    offset += vendor_length
+    tags = {}
+    for _ in range(read_length()):
+        length = read_length()
+        if offset + length > len(data):
+            raise UnsupportedFile("Truncated comment")
+        key, _, value = data[offset:offset + length].decode('utf-8', errors='replace').partition('=')
+        offset += length
+        key = key.lower()
+        if key in FIELDS and key not in tags:
+            tags[key] = value
+    return tags
+
+
+def _read_flac(fp: BinaryIO, size: int) -> TagsAndStream:
+    fp.seek(4)
+    tags = {}
+    sample_rate = channels = total_samples = None
+
+    while True:
+        header = _read_exactly(fp, 4)
+        block_type, length = header[0] & 0x7f, int.from_bytes(header[1:4], 'big')
+        if block_type == 0:
+            block = _read_exactly(fp, length)
+            sample_rate = int.from_bytes(block[10:13], 'big') >> 4
+            channels = ((block[12] >> 1) & 7) + 1
+            total_samples = ((block[13] & 0x0f) << 32) | int.from_bytes(block[14:18], 'big')
+        elif block_type == 4:
+            tags = _parse_vorbis_comments(_read_exactly(fp, length))
+        else:
+            # Pictures, seek tables and padding
+            fp.seek(length, os.SEEK_CUR)
+
+        if header[0] & 0x80:
+            break
+
+    if not sample_rate:
+        raise UnsupportedFile("No stream info")
+
+    duration = total_samples / sample_rate
+    bitrate = int((size - fp.tell()) * 8 / duration) if duration else 0
+    return tags, StreamInfo(duration, bitrate, sample_rate, channels, 'flac')
+
+
+def _read_ogg_page(fp: BinaryIO) -> Tuple[int, int, bytes]:
+    """
+    Read the page at the current position. Returns its header type, serial number and segment
+    table, the page's data follows
+    """
+    header = _read_exactly(fp, 27)
+    if header[:4] != b'OggS':
+        raise UnsupportedFile("Lost Ogg page sync")
+    serial = int.from_bytes(header[14:18], 'little')
+    segments = _read_exactly(fp, header[26])
+    return header[5], serial, segments
+
+
+def _read_ogg_packets(fp: BinaryIO, count: int) -> Tuple[int, list]:
+    """
+    Read the first count packets of the stream starting at the beginning of the file. Returns the
+    stream's serial number along with the packets.
+    """
+    fp.seek(0)
+    packets = []
+    packet = b''
+    stream_serial = None
+
+    while len(packets) < count:
+        _, serial, segments = _read_ogg_page(fp)
+        if stream_serial is None:
+            stream_serial = serial
+        elif serial != stream_serial:
+            raise UnsupportedFile("Multiplexed Ogg streams")
+
+        data = _read_exactly(fp, sum(segments))
+        position = 0
+        for lacing in segments:
+            packet += data[position:position + lacing]
+            position += lacing
+            if lacing < 255:
+                packets.append(packet)
+                packet = b''
+                if len(packets) == count:
+                    break
+        if len(packet) > OGG_MAX_PACKET:
+            raise UnsupportedFile("Oversized Ogg packet")
+
+    return stream_serial, packets
+
+
+def _last_ogg_granule(fp: BinaryIO, size: int, serial: int) -> int:
+    fp.seek(max(0, size - OGG_TAIL_WINDOW))
+    data = fp.read(OGG_TAIL_WINDOW)
+    offset = data.rfind(b'OggS')
+    while offset != -1:
+        if offset + 27 <= len(data) and int.from_bytes(data[offset + 14:offset + 18], 'little') == serial:
+            return int.from_bytes(data[offset + 6:offset + 14], 'little', signed=True)
+        offset = data.rfind(b'OggS', 0, offset)
+    raise UnsupportedFile("Last Ogg page not found")
+
+
+def _opus_packet_duration(packet: bytes) -> Optional[float]:
+    """Seconds of audio in an Opus packet, from its TOC byte (RFC 6716, section 3.1)"""
+    if not packet:
+        return None
+    config, code = packet[0] >> 3, packet[0] & 3
+    if config < 12:
+        frame_ms = (10, 20, 40, 60)[config & 3]
+    elif config < 16:
+        frame_ms = (10, 20)[config & 1]
+    else:
+        frame_ms = (2.5, 5, 10, 20)[config & 3]
+
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    elif len(packet) > 1:
+        frames = packet[1] & 0x3f
+    else:
+        return None
+    return frames * frame_ms / 1000
+
+
+def _read_ogg(fp: BinaryIO, size: int) -> TagsAndStream:
+    serial, (head, comments) = _read_ogg_packets(fp, 2)
+
+    if head.startswith(b'OpusHead') and comments.startswith(b'OpusTags'):
+        channels, pre_skip = head[9], int.from_bytes(head[10:12], 'little')
+        # Opus always decodes at 48 kHz
+        duration = max(0, _last_ogg_granule(fp, size, serial) - pre_skip) / 48000
+        bitrate = int(size * 8 / duration) if duration else 0
+        try:
+            # Encoders use the same packet duration throughout, the first audio packet tells it
+            frame_duration = _opus_packet_duration(_read_ogg_packets(fp, 3)[1][2])
+        except UnsupportedFile:
+            # Empty stream
+            frame_duration = None
+        return _parse_vorbis_comments(comments, 8), StreamInfo(duration, bitrate, 48000, channels, 'opus', frame_duration)
+
+    if head.startswith(b'\x01vorbis') and comments.startswith(b'\x03vorbis'):
+        channels, sample_rate = head[11], int.from_bytes(head[12:16], 'little')
+        nominal_bitrate = int.from_bytes(head[20:24], 'little', signed=True)
+        duration = max(0, _last_ogg_granule(fp, size, serial)) / sample_rate
+        bitrate = nominal_bitrate if nominal_bitrate > 0 else (int(size * 8 / duration) if duration else 0)
+        return _parse_vorbis_comments(comments, 7), StreamInfo(duration, bitrate, sample_rate, channels, 'vorbis')
+
+    raise UnsupportedFile("Unknown Ogg codec")
+
+
+def _iter_atoms(fp: BinaryIO, start: int, end: int):
+    """
+    Yield the (type, data start, data end) of the MP4 atoms between start and end, seeking over
+    their contents
+    """
+    offset = start
+    while offset + 8 <= end:
+        fp.seek(offset)
+        header = _read_exactly(fp, 8)
+        size, atom_type = int.from_bytes(header[:4], 'big'), header[4:]
+        data_start = offset + 8
+        if size == 1:
+            size = int.from_bytes(_read_exactly(fp, 8), 'big')
+            data_start += 8
+        elif size == 0:
+            size = end - offset
+        if size < data_start - offset or offset + size > end:
+            raise UnsupportedFile(f"Invalid atom size for {atom_type}")
+
+        yield atom_type, data_start, offset + size
+        offset += size
+
+
+def _find_atom(fp: BinaryIO, start: int, end: int, path: Tuple[bytes, ...]) -> Optional[Tuple[int, int]]:
+    """Data range of the first atom found by following path, a tuple of atom types"""
+    for atom_type, data_start, data_end in _iter_atoms(fp, start, end):
+        if atom_type != path[0]:
+            continue
+        if len(path) == 1:
+            return data_start, data_end
+        if atom_type == b'meta':
+            # A full atom, its children follow the version and flags
+            data_start += 4
+        return _find_atom(fp, data_start, data_end, path[1:])
+    return None
+
+
+def _read_mp4(fp: BinaryIO, size: int) -> TagsAndStream:
+    moov = _find_atom(fp, 0, size, (b'moov', ))
+    if moov is None:
+        raise UnsupportedFile("No moov atom")
+
+    stream = None
+    for atom_type, start, end in _iter_atoms(fp, *moov):
+        if atom_type == b'trak':
+            stream = _read_mp4_track(fp, start, end, size)
+            if stream:
+                break
+    if stream is None:
+        raise UnsupportedFile("No audio track")
+
+    tags = {}
+    ilst = _find_atom(fp, *moov, (b'udta', b'meta', b'ilst'))
+    if ilst:
+        for item, start, end in _iter_atoms(fp, *ilst):
+            name = MP4_ITEMS.get(item)
+            if name is None or name in tags:
+                continue
+            data = _find_atom(fp, start, end, (b'data', ))
+            if data is None:
+                continue
+            fp.seek(data[0])
+            value = _read_exactly(fp, data[1] - data[0])
+            data_type = int.from_bytes(value[:4], 'big')
+            # After the type and locale, UTF-8 or UTF-16
+            if data_type == 1:
+                tags[name] = value[8:].decode('utf-8', errors='replace')
+            elif data_type == 2:
+                tags[name] = value[8:].decode('utf-16-be', errors='replace')
+
+    return tags, stream
+
+
+def _read_mp4_track(fp: BinaryIO, start: int, end: int, size: int) -> Optional[StreamInfo]:
+    """Stream properties of the trak atom between start and end, None if it isn't an audio track"""
+    hdlr = _find_atom(fp, start, end, (b'mdia', b'hdlr'))
+    if hdlr is None:
+        return None
+    fp.seek(hdlr[0] + 8)
+    if _read_exactly(fp, 4) != b'soun':
+        return None
+
+    mdhd = _find_atom(fp, start, end, (b'mdia', b'mdhd'))
+    stsd = _find_atom(fp, start, end, (b'mdia', b'minf', b'stbl', b'stsd'))
+    if mdhd is None or stsd is None:
+        raise UnsupportedFile("Incomplete audio track")
+
+    fp.seek(mdhd[0])
+    data = _read_exactly(fp, min(mdhd[1] - mdhd[0], 36))
+    if data[0] == 1:
+        timescale, duration = struct.unpack('>IQ', data[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', data[12:20])
+    length = duration / timescale if timescale else 0
+
+    # The first sample description, after the stsd's version, flags and entry count
+    entry = next(_iter_atoms(fp, stsd[0] + 8, stsd[1]), None)
+    if entry is None:
+        raise UnsupportedFile("No sample description")
+    codec, entry_start, entry_end = entry
+    fp.seek(entry_start)
+    data = _read_exactly(fp, 28)
+    sound_version = int.from_bytes(data[8:10], 'big')
+    if sound_version != 0:
+        # QuickTime sound descriptions with extended fields
+        raise UnsupportedFile(f"Sound description version {sound_version}")
+    channels = int.from_bytes(data[16:18], 'big')
+    sample_rate = int.from_bytes(data[24:28], 'big') >> 16
+    bitrate = int(size * 8 / length) if length else 0
+
+    if codec == b'mp4a':
+        esds = _find_atom(fp, entry_start + 28, entry_end, (b'esds', ))
+        if esds is None:
+            raise UnsupportedFile("No esds atom")
+        fp.seek(esds[0])
+        object_type, average_bitrate = _parse_esds(_read_exactly(fp, esds[1] - esds[0]))
+        if object_type in (0x40, 0x66, 0x67, 0x68):
+            codec = 'aac'
+        elif object_type in (0x69, 0x6b):
+            codec = 'mp3'
+        else:
+            raise UnsupportedFile(f"Object type {object_type:#x}")
+        bitrate = average_bitrate or bitrate
+    elif codec == b'alac':
+        # The decoder config follows the version and flags of the inner alac atom
+        config = _find_atom(fp, entry_start + 28, entry_end, (b'alac', ))
+        if config:
+            fp.seek(config[0] + 20)
+            bitrate = int.from_bytes(_read_exactly(fp, 4), 'big') or bitrate
+        codec = 'alac'
+    else:
+        raise UnsupportedFile(f"Codec {codec}")
+
+    return StreamInfo(length, bitrate, sample_rate, channels, codec)
+
+
+def _parse_esds(data: bytes) -> Tuple[int, int]:
+    """
+    Object type and average bitrate from the decoder config descriptor of an esds atom
+    """
+    def read_descriptor(offset):
+        tag = data[offset]
+        length = 0
+        offset += 1
+        # Lengths are stored on up to 4 bytes, 7 bits each
+        for _ in range(4):
+            byte = data[offset]
+            offset += 1
+            length = (length << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                break
+        return tag, offset, length
+
+    # After the version and flags
+    tag, offset, _ = read_descriptor(4)
+    if tag != 0x03:
+        raise UnsupportedFile("No ES descriptor")
+    flags = data[offset + 2]
+    # ES id and flags, then the optional dependency, URL and OCR fields
+    offset += 3
+    if flags & 0x80:
+        offset += 2
+    if flags & 0x40:
+        offset += 1 + data[offset]
+    if flags & 0x20:
+        offset += 2
+
+    tag, offset, _ = read_descriptor(offset)
+    if tag != 0x04:
+        raise UnsupportedFile("No decoder config descriptor")
+    object_type = data[offset]
+    average_bitrate = int.from_bytes(data[offset + 9:offset + 13], 'big')
+    return object_type, average_bitrate
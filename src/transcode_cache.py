@@ -0,0 +1,198 @@
+import os
+import logging
+import subprocess
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+
+class TranscodeCache:
+    """
+    On-disk cache of tracks transcoded to Opus, so that tracks played again are streamed as they
+    are instead of being encoded by ffmpeg every time.
+
+    Entries are named after the content fingerprint the scanner stored for the source file and the
+    bitrate, moved or renamed files keep their entry while edited ones get a new one. Lookups only
+    touch the disk off the event loop, on the transcoding thread. Once the entries exceed
+    max_bytes the least recently played ones are deleted, the order is kept on disk as the
+    entries' mtime so that it survives restarts.
+    """
+    SUFFIX = '.opus'
+
+    def __init__(self, directory: str, max_bytes: int, bitrate: int = 128, workers: int = 1) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bitrate = bitrate
+        self.size = 0
+        self.evictions = 0
+        # Entry name -> size, least recently used first
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcode')
+        self.__logger = logging.getLogger('transcode_cache')
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        # The size limit may have been lowered since the last run
+        self._evict()
+
+    def _load(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.part'):
+                # Left over by an interrupted transcode
+                os.remove(entry.path)
+            elif entry.name.endswith(TranscodeCache.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, entry.name, stat.st_size))
+
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self.size += size
+        self.__logger.info(f"Loaded {len(self._entries)} transcoded tracks, {self.size // (1024 * 1024)} MiB")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _name(self, fingerprint: str) -> str:
+        return f"{fingerprint}-{self.bitrate}k{TranscodeCache.SUFFIX}"
+
+    def lookup(self, fingerprint: str) -> Optional[str]:
+        """Path of the transcoded copy of the file with this fingerprint, if it is cached"""
+        name = self._name(fingerprint)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+
+        cached = os.path.join(self.directory, name)
+        # Keeps the order of use across restarts
+        self._executor.submit(self._touch, name)
+        return cached
+
+    def _touch(self, name: str):
+        try:
+            os.utime(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            # Deleted behind our back
+            with self._lock:
+                self.size -= self._entries.pop(name, 0)
+
+    def add(self, path: str, fingerprint: str) -> Optional[Future]:
+        """
+        Transcode the file at path in the background, unless it is cached or being transcoded already
+        """
+        if fingerprint in self._pending:
+            return None
+        self._pending.add(fingerprint)
+        return self._executor.submit(self._add, path, fingerprint)
+
+    def _add(self, path: str, fingerprint: str) -> Optional[str]:
+        try:
+            return self.lookup(fingerprint) or self.transcode(path, fingerprint)
+        finally:
+            self._pending.discard(fingerprint)
+
+    def transcode(self, path: str, fingerprint: str) -> Optional[str]:
+        """
+        Transcode the file at path, whose content has this fingerprint, into the cache. Returns the
+        path of the copy, or None if ffmpeg failed
+        """
+        name = self._name(fingerprint)
+        cached = os.path.join(self.directory, name)
+        temporary = f"{cached}.{threading.get_ident()}.part"
+        # The format discord expects: 48 kHz stereo in 20 ms frames
+        args = [
+            "ffmpeg", "-loglevel", "error", "-nostdin", "-y", "-i", path, "-map", "0:a:0", "-map_metadata", "-1",
+            "-c:a", "libopus", "-b:a", f"{self.bitrate}k", "-ar", "48000", "-ac", "2", "-frame_duration", "20",
+            "-f", "ogg", temporary
+        ]
+        result = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            self.__logger.warning(f"Couldn't transcode {path}: {result.stderr.decode(errors='replace').strip()}")
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return None
+
+        os.replace(temporary, cached)
+        size = os.path.getsize(cached)
+        with self._lock:
+            self.size += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+        self.__logger.debug(f"Transcoded {path} to {name}")
+        self._evict()
+        return cached
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self.size <= self.max_bytes or not self._entries:
+                    return
+                name, size = self._entries.popitem(last=False)
+                self.size -= size
+                self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            self.__logger.debug(f"Evicted {name}")
+
+    def warm(self, files: Iterable[Tuple[str, str]]) -> int:
+        """
+        Transcode (path, fingerprint) files in order until the cache is full, i.e. until one of
+        them evicts an entry. Returns the number of files transcoded
+        """
+        transcoded, evictions = 0, self.evictions
+        for path, fingerprint in files:
+            if not self.lookup(fingerprint) and self.transcode(path, fingerprint):
+                transcoded += 1
+            if self.evictions > evictions:
+                break
+        return transcoded
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    """
+    Fill the transcode cache ahead of time, with the most recently added tracks first
+    """
+    import argparse
+    from dotenv import load_dotenv
+    from src.db_manager import DatabaseManager
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--db', default="db/tracks.sqlite", help="Library database")
+    parser.add_argument('--limit', type=int, default=None, help="Tracks to transcode at most")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    directory = os.getenv('TRANSCODE_CACHE_PATH')
+    if not directory:
+        parser.error("TRANSCODE_CACHE_PATH is not set")
+    cache = TranscodeCache(directory, max_bytes=int(float(os.getenv('TRANSCODE_CACHE_MB', 2048)) * 1024 * 1024))
+
+    db = DatabaseManager(args.db)
+    rows = db.reader().execute("""
+        SELECT directories.path || '/' || tracks.filename, tracks.fingerprint
+        FROM tracks
+        JOIN directories
+        ON tracks.dir_id = directories.dir_id
+        -- Opus tracks made of 20 ms packets are streamed as they are
+        WHERE tracks.fingerprint IS NOT NULL AND NOT (tracks.codec IS 'opus' AND tracks.frame_duration IS 0.02)
+        ORDER BY tracks.track_id DESC
+    """).fetchall()
+
+    transcoded = cache.warm(rows[:args.limit])
+    logging.info(f"Transcoded {transcoded} tracks, the cache holds {len(cache)} tracks in {cache.size // (1024 * 1024)} MiB")
+    db.close()
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,48 @@
 import discord
 
-from typing import List, Callable
+from typing import Awaitable, List, Callable
 from src.models import Track
 
 TrackSelectionCallback = Callable[[Track, discord.Interaction], None]
+# Fetches up to limit results, skipping the first offset: (limit, offset) -> tracks
+PageFetcher = Callable[[int, int], Awaitable[List[Track]]]
 
 class TrackResultsView(discord.ui.View):
-    def __init__(self, results: List[Track], on_select: TrackSelectionCallback):
+    """
+    Pages through search results, fetching each page when it's shown. Only the current page is
+    kept in memory, however many tracks match.
+    """
+    results_per_page = 5
+
+    def __init__(self, first_page: List[Track], fetch_page: PageFetcher, on_select: TrackSelectionCallback, title: str = "Search Results"):
         super().__init__()
+        self.title = title
         self.on_select = on_select
-        self.results = results
+        self.fetch_page = fetch_page
         self.page = 0
-        self.results_per_page = 5
-        self.max_page = (len(results) - 1) // self.results_per_page
+        self.results: List[Track] = []
+        self.has_next_page = False
         self.original_response: discord.InteractionMessage = None
 
+        self.set_results(first_page)
+
+    @staticmethod
+    def page_limit() -> int:
+        """Results to fetch per page, one more than shown tells whether a next page exists"""
+        return TrackResultsView.results_per_page + 1
+
+    def set_results(self, results: List[Track]):
+        self.results = results[:self.results_per_page]
+        self.has_next_page = len(results) > self.results_per_page
         self.set_buttons()
 
+    async def load_page(self, page: int):
+        results = await self.fetch_page(self.page_limit(), page * self.results_per_page)
+        # The library may have changed since the previous page was shown
+        if results or page == 0:
+            self.page = page
+            self.set_results(results)
+
     async def display(self, interaction: discord.Interaction):
         await interaction.response.send_message(embed=self.create_embed(), view=self, ephemeral=True)
         self.original_response = await interaction.original_response()
@@ -25,28 +51,27 @@ class TrackResultsView(discord.ui.View):
         self.clear_items()
 
         start_index = self.page * self.results_per_page
-        end_index = min(start_index + self.results_per_page, len(self.results))
-        for i in range(start_index, end_index):
-            self.add_item(TrackSelectionButton(i, self.results[i], self.on_select))
+        for i, track in enumerate(self.results, start=start_index):
+            self.add_item(TrackSelectionButton(i, track, self.on_select))
 
-        if self.max_page == 0:
+        if self.page == 0 and not self.has_next_page:
             return
 
         if self.page > 0:
             self.add_item(PreviousPageButton())
         else:
             self.add_item(PreviousPageButton(disabled=True))
-        if self.page < self.max_page:
+        if self.has_next_page:
             self.add_item(NextPageButton())
         else:
             self.add_item(NextPageButton(disabled=True))
 
-    async def update_view(self, interaction: discord.Interaction):
+    async def update_view(self, interaction: discord.Interaction, page: int):
         """
-        Updates the embed and buttons when navigating pages.
+        Fetches the page, then updates the embed and buttons when navigating pages.
         """
+        await self.load_page(page)
         embed = self.create_embed()
-        self.set_buttons()
         await interaction.response.edit_message(embed=embed, view=self)
 
     def create_embed(self):
@@ -54,13 +79,12 @@ class TrackResultsView(discord.ui.View):
         Create an embed with the current page of results.
         """
         embed = discord.Embed(
-            title=f"Search Results (Page {self.page + 1}/{self.max_page + 1})",
+            title=f"{self.title} (Page {self.page + 1})"[:256],
             description="Select a track to play:",
             color=discord.Color.yellow(),
         )
         start_index = self.page * self.results_per_page
-        end_index = min(start_index + self.results_per_page, len(self.results))
-        for i, track in enumerate(self.results[start_index:end_index], start=1):
+        for i, track in enumerate(self.results, start=1):
             embed.add_field(
                 name=f"{start_index + i}. {track.title} - {track.artist}",
                 value=f"{track.album}",
@@ -87,8 +111,7 @@ class PreviousPageButton(discord.ui.Button):
 
     async def callback(self, interaction: discord.Interaction):
         view: TrackResultsView = self.view
-        view.page -= 1
-        await view.update_view(interaction)
+        await view.update_view(interaction, view.page - 1)
 
 
 class NextPageButton(discord.ui.Button):
@@ -97,5 +120,4 @@ class NextPageButton(discord.ui.Button):
 
     async def callback(self, interaction: discord.Interaction):
         view: TrackResultsView = self.view
-        view.page += 1
-        await view.update_view(interaction)
+        await view.update_view(interaction, view.page + 1)
@@ -0,0 +1,293 @@
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from src.db_manager import DatabaseManager
+from src.scanner import FileScanner, ScanProgress
+
+
+class Inotify:
+    """
+    Minimal ctypes binding for the Linux inotify API, watching directories only
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this platform")
+
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.watches: Dict[int, str] = {}
+        self.__logger = logging.getLogger('watcher')
+
+        self.fd = libc.inotify_init1(Inotify.IN_NONBLOCK | Inotify.IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno()
+
+    @staticmethod
+    def _raise_errno():
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+    def add_tree(self, path: str):
+        """
+        Watch path and every directory below it. Raises OSError once the watch or file descriptor
+        limit is reached, directories which can't be watched, e.g. removed before their watch was
+        added, are skipped.
+        """
+        for dir_path, _, _ in os.walk(path):
+            wd = self._add_watch(self.fd, os.fsencode(dir_path), Inotify.WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOSPC, errno.EMFILE):
+                    self._raise_errno()
+                # Usually removed or renamed while being copied, the parent's events cover it
+                self.__logger.debug(f"Not watching {dir_path}: {os.strerror(error)}")
+                continue
+            self.watches[wd] = dir_path
+
+    def remove_tree(self, path: str):
+        """
+        Stop watching path and every directory below it. Needed when a directory is moved, as
+        inotify keeps following it under its new name.
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        for wd, dir_path in list(self.watches.items()):
+            if dir_path == path or dir_path.startswith(prefix):
+                self._rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def read(self, timeout: float) -> List[Tuple[str, int, str]]:
+        """
+        Wait up to timeout seconds for events. Returns them as (directory, mask, name) tuples
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = Inotify.EVENT.unpack_from(data, offset)
+            offset += Inotify.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & Inotify.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd in self.watches or mask & Inotify.IN_Q_OVERFLOW:
+                events.append((self.watches.get(wd), mask, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    """
+    Keeps the database in sync with the library while the bot is running.
+
+    Everything runs on a background thread. An optional initial scan runs first, `ready` is set
+    once it's done. Afterwards, the watcher uses inotify where available: change events are collected until the library has been quiet
+    for `debounce` seconds, then only the affected directories are rescanned. Otherwise (or if
+    the inotify watch limit is reached) it falls back to an incremental scan every
+    `poll_interval` seconds, which doesn't notice tags edited in place. With mode 'off', the
+    thread exits after the initial scan.
+
+    Listeners are called on the watcher's thread after every scan which changed the library.
+    """
+    MODES = ('auto', 'inotify', 'poll', 'off')
+    SCAN_MODES = ('full', 'incremental')
+
+    def __init__(self, library_path: Union[str, List[str]], db_path: str, mode: str = 'auto', initial_scan: Optional[str] = None, debounce: float = 2.0, poll_interval: float = 60.0, db_pragmas: Optional[dict] = None, **scanner_options) -> None:
+        if initial_scan is not None and initial_scan not in LibraryWatcher.SCAN_MODES:
+            raise ValueError(f"Unknown scan mode {initial_scan}, expected one of {', '.join(LibraryWatcher.SCAN_MODES)}")
+        if mode not in LibraryWatcher.MODES:
+            raise ValueError(f"Unknown watch mode {mode}, expected one of {', '.join(LibraryWatcher.MODES)}")
+
+        self.library_paths = [library_path] if isinstance(library_path, str) else list(library_path)
+        self.db_path = db_path
+        self.db_pragmas = db_pragmas
+        self.mode = mode
+        self.initial_scan = initial_scan
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.scanner_options = scanner_options
+        self.scanner: FileScanner = None
+        self.ready = threading.Event()
+        self.listeners: List[Callable[[ScanProgress], None]] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+        self.__logger = logging.getLogger('watcher')
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def progress(self) -> ScanProgress:
+        """Progress of the current or last scan"""
+        return self.scanner.progress if self.scanner else ScanProgress()
+
+    @property
+    def generation(self) -> int:
+        """Library generation, bumped by every commit of the scanner which changed tracks"""
+        return self.scanner.generation if self.scanner else 0
+
+    def add_listener(self, listener: Callable[[ScanProgress], None]):
+        self.listeners.append(listener)
+
+    def _notify(self):
+        progress = self.scanner.progress
+        if not progress.changed:
+            return
+        for listener in self.listeners:
+            try:
+                listener(progress)
+            except Exception as e:
+                self.__logger.exception(f"Scan listener failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        # SQLite connections can't be shared across threads, the watcher uses its own
+        db = DatabaseManager(self.db_path, pragmas=self.db_pragmas)
+        try:
+            self.scanner = FileScanner(library_path=self.library_paths, db=db, **self.scanner_options)
+
+            if self.initial_scan:
+                self.__logger.info(f"Starting {self.initial_scan} library scan")
+                # The bot searches while the watcher scans, the FTS index is kept up to date as tracks are written
+                self.scanner.scan(incremental=self.initial_scan == 'incremental', bulk=False)
+                progress = self.scanner.progress
+                self.__logger.info(f"Library scan done in {progress.elapsed:.1f}s, {progress.files} files checked, {progress.written} tracks written")
+                self._notify()
+            self.ready.set()
+
+            if self.mode == 'off':
+                return
+
+            if self.mode != 'poll':
+                try:
+                    self._watch()
+                    return
+                except OSError as e:
+                    if self.mode == 'inotify':
+                        raise
+                    self.__logger.warning(f"Can't watch library with inotify ({e}), polling every {self.poll_interval}s instead")
+                    # Changes made while the watches were being torn down are picked up by the first poll
+                    self._apply(set(), set(self.library_paths))
+
+            self._poll()
+        except Exception as e:
+            self.__logger.exception(f"Library watcher stopped: {e}")
+        finally:
+            self.ready.set()
+            db.close()
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.scanner.scan(incremental=True, bulk=False)
+                self._notify()
+            except Exception as e:
+                self.__logger.error(f"Polling scan failed: {e}")
+
+    def _watch(self):
+        inotify = Inotify()
+        try:
+            for path in self.library_paths:
+                inotify.add_tree(path)
+            self.__logger.info(f"Watching {len(inotify.watches)} directories under {', '.join(self.library_paths)}")
+
+            directories: Set[str] = set()
+            trees: Set[str] = set()
+            first_event = last_event = None
+
+            while not self._stop.is_set():
+                events = inotify.read(timeout=min(0.5, self.debounce))
+
+                for dir_path, mask, name in events:
+                    if mask & Inotify.IN_Q_OVERFLOW:
+                        # Events were dropped, only a walk of the whole library is safe
+                        self.__logger.warning("inotify queue overflowed, rescanning library")
+                        trees.update(self.library_paths)
+                        continue
+
+                    path = os.path.join(dir_path, name)
+                    if mask & Inotify.IN_ISDIR and mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                        inotify.add_tree(path)
+                        trees.add(path)
+                    elif mask & Inotify.IN_ISDIR and mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                        inotify.remove_tree(path)
+                        trees.add(path)
+
+                    # The directory's own files or entry count changed
+                    directories.add(dir_path)
+
+                now = time.monotonic()
+                if events:
+                    first_event = first_event or now
+                    last_event = now
+
+                # Apply once things settle down, or periodically during a long running copy
+                if last_event and (now - last_event >= self.debounce or now - first_event >= self.debounce * 10):
+                    if self._apply(directories, trees):
+                        directories, trees = set(), set()
+                        first_event = last_event = None
+                    else:
+                        # Kept, and applied again along with newer changes once things settle down
+                        first_event = last_event = now
+        finally:
+            inotify.close()
+
+    def _apply(self, directories: Set[str], trees: Set[str]) -> bool:
+        """Rescan the changed paths. Returns False if the scan failed, the changes should be retried"""
+        self.__logger.info(f"Updating {len(directories)} directories and {len(trees)} trees")
+        try:
+            self.scanner.scan_paths(directories=directories, trees=trees, bulk=False)
+        except Exception as e:
+            self.__logger.error(f"Failed to apply library changes, retrying later: {e}")
+            return False
+        self._notify()
+        return True
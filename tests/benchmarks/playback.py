@@ -0,0 +1,96 @@
+"""
+Measure the CPU time spent per stream by each playback mode, for an MP3 and an Opus track.
+
+Every source is read as fast as possible, the way the voice client reads it. In 'pcm' mode each
+frame is then Opus encoded in this process like discord.py does, which needs libopus. CPU time is
+counted for both this process and ffmpeg, and reported per second of audio streamed.
+
+Usage:
+    python -m tests.benchmarks.playback --seconds 60 --modes pcm opus
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import time
+
+import discord
+
+from src import tag_reader
+from src.models import Track
+from src.player import NowPlayingTrack, Player
+
+_AUDIO_PATH = './tests/bench_audio'
+
+
+def make_tracks(seconds: int) -> dict:
+    """Encode a few seconds of noise to each format. Returns their paths by format"""
+    os.makedirs(_AUDIO_PATH, exist_ok=True)
+    tracks = {'mp3': f"{_AUDIO_PATH}/noise.mp3", 'opus': f"{_AUDIO_PATH}/noise.opus"}
+    for path in tracks.values():
+        subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"anoisesrc=duration={seconds}:color=pink", "-ac", "2", path],
+            check=True
+        )
+    return tracks
+
+
+def cpu_seconds() -> tuple:
+    """CPU time used by this process, and by the ffmpeg processes it reaped"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def stream(player: Player, path: str) -> dict:
+    # The packet duration decides whether Opus files are copied
+    _, stream_info = tag_reader.read_file(path)
+    source = player._open(NowPlayingTrack(Track(0, "Noise", "Benchmark", "Benchmark"), path, stream_info))
+    encoder = None if source.is_opus() else discord.opus.Encoder()
+
+    start, (own_start, ffmpeg_start) = time.perf_counter(), cpu_seconds()
+    while data := source.read():
+        if encoder:
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+    source.cleanup()
+    own, ffmpeg = (end - start for end, start in zip(cpu_seconds(), (own_start, ffmpeg_start)))
+
+    return {
+        'audio_seconds': round(source.progress, 2),
+        'wall_seconds': round(time.perf_counter() - start, 3),
+        'bot_cpu_per_audio_second': round(own / source.progress, 5),
+        'ffmpeg_cpu_per_audio_second': round(ffmpeg / source.progress, 5),
+        'cpu_per_audio_second': round((own + ffmpeg) / source.progress, 5),
+    }
+
+
+class SilentVoiceClient:
+    def is_playing(self):
+        return False
+
+
+async def measure(args):
+    tracks = make_tracks(args.seconds)
+    for mode in args.modes:
+        player = Player(SilentVoiceClient(), mode=mode)
+        for file_format, path in tracks.items():
+            try:
+                result = stream(player, path)
+            except discord.opus.OpusNotLoaded:
+                result = {'error': "libopus could not be loaded"}
+            print(json.dumps({'mode': mode, 'format': file_format, **result}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=60, help="Length of the generated tracks")
+    parser.add_argument('--modes', nargs='+', choices=Player.MODES, default=list(Player.MODES))
+    args = parser.parse_args()
+
+    asyncio.run(measure(args))
+
+
+if __name__ == '__main__':
+    main()
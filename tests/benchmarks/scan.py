@@ -0,0 +1,167 @@
+"""
+Time FileScanner.scan() against generated libraries, for the scenarios a library goes through:
+a cold import into an empty database, a rescan with nothing changed, a rescan after 1% of the
+files were retagged and one after 10% were deleted.
+
+Prints one JSON object per library size and scenario. Each scan runs in a fresh process so that
+its peak RSS and syscall counts aren't mixed with the library generation or other scans. Syscalls
+are those of the scanning process: file opens and directory listings, as reported by audit hooks,
+and read/write calls from /proc/self/io. Tags parsed in worker processes aren't included, use
+`--executor thread` to account for them too.
+
+Usage:
+    python -m tests.benchmarks.scan --files 1000 10000 100000 --depth 2 4 --branch 2 6 --tag-size 0 --seed 0
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from mutagen.mp3 import MP3
+from mutagen.easyid3 import EasyID3
+
+from tests.util import DirManager, LibraryManager, remove_database
+from src.db_manager import DatabaseManager
+from src.scanner import FileScanner
+
+_TREE_PATH = './tests/bench_tree'
+_DB_PATH = './tests/bench_db.sqlite'
+
+SCENARIOS = ('cold', 'noop', 'changed', 'deleted')
+
+
+def _read_proc_io() -> dict:
+    try:
+        with open('/proc/self/io') as fp:
+            return dict((key, int(value)) for key, value in (line.split(': ') for line in fp))
+    except OSError:
+        return {}
+
+
+def measure(workers: int, executor: str, incremental: bool) -> dict:
+    """
+    Scan the benchmark tree into the benchmark database, runs in the child process
+    """
+    calls = {'open': 0, 'os.scandir': 0}
+
+    def count_calls(event, args):
+        if event in calls:
+            calls[event] += 1
+
+    db = DatabaseManager(_DB_PATH)
+    scanner = FileScanner(library_path=_TREE_PATH, db=db, workers=workers, executor=executor)
+
+    io_before = _read_proc_io()
+    sys.addaudithook(count_calls)
+    start = time.perf_counter()
+    scanner.scan(incremental=incremental)
+    elapsed = time.perf_counter() - start
+    io_after = _read_proc_io()
+
+    progress = scanner.progress
+    result = {
+        'seconds': round(elapsed, 4),
+        'files_per_sec': round(progress.files / elapsed, 1),
+        'files_checked': progress.files,
+        'directories': progress.directories,
+        'written': progress.written,
+        'tracks': db.count_rows("tracks"),
+        'syscalls': {
+            'open': calls['open'],
+            'scandir': calls['os.scandir'],
+            'read': io_after.get('syscr', 0) - io_before.get('syscr', 0),
+            'write': io_after.get('syscw', 0) - io_before.get('syscw', 0),
+        },
+        # Kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_worker_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+    db.close()
+    return result
+
+
+def run_scan(args) -> dict:
+    command = [
+        sys.executable, '-m', 'tests.benchmarks.scan', '--measure',
+        '--workers', str(args.workers), '--executor', args.executor,
+    ]
+    if args.incremental:
+        command.append('--incremental')
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def change_tracks(lm: LibraryManager, ratio: float, rng: random.Random):
+    """Retag a random sample of the library's tracks in place"""
+    paths = [path for album in lm.albums for path in album]
+    for path in rng.sample(paths, max(1, int(len(paths) * ratio))):
+        audio = MP3(path, ID3=EasyID3)
+        audio['title'] = f"Changed {os.path.basename(path)}"
+        audio.save()
+
+
+def delete_tracks(lm: LibraryManager, ratio: float, rng: random.Random):
+    paths = [path for album in lm.albums for path in album]
+    for path in rng.sample(paths, max(1, int(len(paths) * ratio))):
+        os.remove(path)
+
+
+def benchmark(files: int, args, rng: random.Random):
+    remove_database(_DB_PATH)
+
+    start = time.perf_counter()
+    dm = DirManager(p_dir=args.p_dir, depth=tuple(args.depth), branch=tuple(args.branch), rng=rng)
+    lm = LibraryManager(_TREE_PATH, dm)
+    lm.make_library(files, album_size=args.album_size, tag_size=args.tag_size)
+    generated = time.perf_counter() - start
+
+    for scenario in SCENARIOS:
+        if scenario == 'changed':
+            change_tracks(lm, 0.01, rng)
+        elif scenario == 'deleted':
+            delete_tracks(lm, 0.1, rng)
+
+        result = {
+            'files': files,
+            'scenario': scenario,
+            'directories_in_tree': len(dm.tree_ref_index) + 1,
+            'tag_size': args.tag_size,
+            'workers': args.workers,
+            'executor': args.executor,
+            'incremental': args.incremental,
+            'generate_seconds': round(generated, 2),
+        }
+        result.update(run_scan(args))
+        print(json.dumps(result), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, nargs='+', default=[1000, 10000, 100000], help="Library sizes to measure")
+    parser.add_argument('--depth', type=int, nargs=2, default=[2, 4], metavar=('MIN', 'MAX'), help="Depth of the generated directory tree")
+    parser.add_argument('--branch', type=int, nargs=2, default=[2, 6], metavar=('MIN', 'MAX'), help="Subdirectories per directory")
+    parser.add_argument('--p-dir', type=float, default=0.5, help="Chance of creating each optional subdirectory")
+    parser.add_argument('--album-size', type=int, default=10, help="Tracks per generated album")
+    parser.add_argument('--tag-size', type=int, default=0, help="Bytes of padding added to each file's tags")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Size of the tag parsing pool")
+    parser.add_argument('--executor', choices=list(FileScanner.EXECUTORS), default='process')
+    parser.add_argument('--incremental', action='store_true', help="Rescan in incremental mode")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.workers, args.executor, args.incremental)))
+        return
+
+    rng = random.Random(args.seed)
+    for files in args.files:
+        benchmark(files, args, rng)
+
+
+if __name__ == '__main__':
+    main()
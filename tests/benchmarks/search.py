@@ -0,0 +1,131 @@
+"""
+Measure search latency on a large synthetic library: exact (prefix) searches, and misspelt
+searches which find nothing exactly and fall back to the fuzzy mode, as /play does.
+
+Prints one JSON object per mode with p50/p99 latencies, along with the time taken to build the
+in-memory indexes.
+
+Usage:
+    python -m tests.benchmarks.search --tracks 100000 --queries 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import time
+
+from tests.util import remove_database
+from src import migrations
+from src.autocomplete import PrefixIndex
+from src.db_manager import DatabaseManager, AsyncQueryExecutor
+from src.fuzzy import TrigramIndex
+from src.scanner import FileScanner
+from src.search import TrackSearch
+
+_DB_PATH = './tests/bench_db.sqlite'
+
+
+def make_library(db: DatabaseManager, tracks: int, rng: random.Random) -> list:
+    """
+    Fill the database with tracks named after random words. Returns their (title, artist) pairs
+    """
+    vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(tracks // 4)]
+    words = lambda count: ' '.join(rng.choice(vocabulary) for _ in range(count)).title()
+
+    artists = [words(rng.randint(1, 2)) for _ in range(max(1, tracks // 100))]
+    db.cursor.executemany("INSERT OR IGNORE INTO artists (name) VALUES (?)", [(name, ) for name in artists])
+    db.cursor.executemany(
+        "INSERT OR IGNORE INTO albums (name, artist_id) VALUES (?, ?)",
+        [(words(rng.randint(1, 3)), artist_id) for artist_id in range(1, len(artists) + 1) for _ in range(10)]
+    )
+    album_count = db.cursor.execute("SELECT COUNT(*) FROM albums").fetchone()[0]
+    db.cursor.execute("INSERT INTO directories (path) VALUES ('/music')")
+
+    # Bulk insert without the FTS triggers, then index everything at once like the scanner does
+    for trigger in FileScanner.FTS_TRIGGERS:
+        db.cursor.execute(f"DROP TRIGGER {trigger}")
+    rows = []
+    for i in range(tracks):
+        album_id = rng.randint(1, album_count)
+        artist_id = db.cursor.execute("SELECT artist_id FROM albums WHERE album_id = ?", (album_id, )).fetchone()[0]
+        rows.append((words(rng.randint(1, 4)), artist_id, album_id, f"{i}.mp3"))
+    db.cursor.executemany("INSERT INTO tracks (title, artist_id, album_id, dir_id, filename, mtime) VALUES (?, ?, ?, 1, ?, 0)", rows)
+    db.cursor.execute("INSERT INTO tracks_fts(tracks_fts) VALUES ('rebuild')")
+    db.connection.commit()
+    db.executescript('db/schema.sql')
+
+    return [(title, artists[artist_id - 1]) for title, artist_id, _, _ in rows]
+
+
+def misspell(word: str, rng: random.Random) -> str:
+    position = rng.randrange(len(word))
+    edit = rng.choice(('replace', 'delete', 'swap'))
+    if edit == 'replace':
+        return word[:position] + rng.choice(string.ascii_lowercase) + word[position + 1:]
+    if edit == 'delete' and len(word) > 3:
+        return word[:position] + word[position + 1:]
+    position = min(position, len(word) - 2)
+    return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+
+
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+async def measure(db: DatabaseManager, samples: list, args, rng: random.Random):
+    queries = AsyncQueryExecutor(db)
+    search = TrackSearch(queries)
+
+    start = time.perf_counter()
+    index = await queries.run(PrefixIndex.from_db)
+    search.vocabulary = TrigramIndex(index.vocabulary())
+    print(json.dumps({'tracks': args.tracks, 'index_build_seconds': round(time.perf_counter() - start, 3), 'vocabulary': len(search.vocabulary)}))
+
+    exact, fuzzy, found = [], [], 0
+    for title, artist in samples:
+        words = f"{title} {artist}".lower().split()
+        query = ' '.join(rng.sample(words, min(2, len(words))))
+
+        start = time.perf_counter()
+        await search.search(query, limit=6)
+        exact.append(time.perf_counter() - start)
+
+        typo = ' '.join(misspell(word, rng) if len(word) > 4 else word for word in query.split())
+        start = time.perf_counter()
+        results = await search.search(typo, limit=6)
+        if not results:
+            results = await search.search(typo, limit=6, fuzzy=True)
+        fuzzy.append(time.perf_counter() - start)
+        found += any(track.title == title for track in results)
+
+    queries.close()
+    print(json.dumps({'mode': 'exact', 'queries': len(exact), **percentiles(exact)}))
+    print(json.dumps({'mode': 'misspelt', 'queries': len(fuzzy), 'found_ratio': round(found / len(fuzzy), 3), **percentiles(fuzzy)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=100000, help="Tracks in the generated library")
+    parser.add_argument('--queries', type=int, default=1000, help="Searches per mode")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    remove_database(_DB_PATH)
+    db = DatabaseManager(_DB_PATH)
+    db.executescript('db/schema.sql')
+    migrations.migrate(db)
+
+    tracks = make_library(db, args.tracks, rng)
+    asyncio.run(measure(db, rng.sample(tracks, min(args.queries, len(tracks))), args, rng))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
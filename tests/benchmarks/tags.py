@@ -0,0 +1,109 @@
+"""
+Compare the header-only tag readers against mutagen. For each format, a tagged template file is
+copied --files times, optionally with cover art, then read by both parsers.
+
+Prints one JSON object per format and parser, with the time per file and the bytes read per file
+as reported by /proc/self/io (rchar, which counts reads served from the page cache too).
+
+Usage:
+    python -m tests.benchmarks.tags --files 500 --cover-size 262144
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import mutagen
+from pydub import AudioSegment
+
+from src import tag_reader
+from src.scanner import MetadataManager
+from tests.util import FORMATS, TAGS
+
+
+def _read_chars() -> int:
+    try:
+        with open('/proc/self/io') as fp:
+            return next(int(line.split(': ')[1]) for line in fp if line.startswith('rchar'))
+    except (OSError, StopIteration):
+        return 0
+
+
+def read_with_mutagen(path):
+    audio = mutagen.File(path, easy=True)
+    return dict(audio), MetadataManager.get_stream_info(audio)
+
+
+PARSERS = {
+    'mutagen': read_with_mutagen,
+    'header': tag_reader.read_file,
+}
+
+
+def make_template(directory: str, extension: str, duration: int, cover_size: int) -> str:
+    path = os.path.join(directory, f"template.{extension}")
+    AudioSegment.silent(duration=duration * 1000).export(path, **FORMATS[extension])
+
+    audio = mutagen.File(path, easy=True)
+    audio.update(TAGS)
+    audio.save()
+
+    if cover_size:
+        audio = mutagen.File(path)
+        cover = b'\xff' * cover_size
+        if extension == 'mp3':
+            from mutagen.id3 import APIC
+            audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3, data=cover))
+        elif extension == 'm4a':
+            from mutagen.mp4 import MP4Cover
+            audio['covr'] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+        elif extension == 'flac':
+            from mutagen.flac import Picture
+            picture = Picture()
+            picture.type, picture.mime, picture.data = 3, 'image/jpeg', cover
+            audio.add_picture(picture)
+        audio.save()
+    return path
+
+
+def benchmark(extension: str, args) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        template = make_template(directory, extension, args.duration, args.cover_size)
+        paths = [os.path.join(directory, f"{i}.{extension}") for i in range(args.files)]
+        for path in paths:
+            shutil.copyfile(template, path)
+
+        for name, parse in PARSERS.items():
+            chars_before = _read_chars()
+            start = time.perf_counter()
+            for path in paths:
+                parse(path)
+            elapsed = time.perf_counter() - start
+            chars_read = _read_chars() - chars_before
+
+            print(json.dumps({
+                'format': extension,
+                'parser': name,
+                'files': args.files,
+                'file_size': os.path.getsize(template),
+                'ms_per_file': round(elapsed * 1000 / args.files, 3),
+                'bytes_read_per_file': chars_read // args.files,
+            }), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=500, help="Copies of each template to read")
+    parser.add_argument('--formats', nargs='+', choices=list(FORMATS), default=list(FORMATS))
+    parser.add_argument('--duration', type=int, default=30, help="Length of the template audio in seconds")
+    parser.add_argument('--cover-size', type=int, default=0, help="Bytes of cover art embedded in each file (not for Ogg)")
+    args = parser.parse_args()
+
+    for extension in args.formats:
+        benchmark(extension, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measure how FileScanner's tag parsing throughput scales with the size of the worker pool.
+
+Usage:
+    python -m tests.benchmarks.workers --files 400 --workers 1 2 4 8 --executor process
+"""
+import argparse
+import time
+
+from tests.util import DirManager, LibraryManager, remove_database
+from src.db_manager import DatabaseManager
+from src.scanner import FileScanner
+
+_TREE_PATH = './tests/bench_tree'
+_DB_PATH = './tests/bench_db.sqlite'
+
+
+def run(files: int, workers: int, executor: str) -> float:
+    """
+    Cold scan the benchmark tree into a fresh database. Returns the elapsed time in seconds
+    """
+    remove_database(_DB_PATH)
+
+    db = DatabaseManager(_DB_PATH)
+    scanner = FileScanner(library_path=_TREE_PATH, db=db, workers=workers, executor=executor)
+
+    start = time.perf_counter()
+    scanner.scan()
+    elapsed = time.perf_counter() - start
+
+    assert db.count_rows("tracks") == files
+    db.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=400, help="Number of audio files in the generated library")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help="Pool sizes to measure")
+    parser.add_argument('--executor', choices=list(FileScanner.EXECUTORS), default='process')
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per pool size, the best one is reported")
+    args = parser.parse_args()
+
+    lm = LibraryManager(_TREE_PATH, DirManager(p_dir=0.5, depth=(2, 4), branch=(2, 4)))
+    lm.make_album(args.files, "Benchmark Album", "Benchmark Artist", "Benchmark Artist")
+
+    print(f"{'workers':>8} {'seconds':>10} {'files/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        elapsed = min(run(args.files, workers, args.executor) for _ in range(args.repeat))
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>10.3f} {args.files / elapsed:>10.1f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import pytest
+import random
+import string
+import time
+from tests.util import insert_tracks, remove_database
+from src import migrations
+from src.autocomplete import PrefixIndex
+from src.db_manager import DatabaseManager
+from src.models import Track
+
+_DB_PATH = './tests/test_db.sqlite'
+
+_TRACKS = [
+    Track(1, "Halo", "Beyoncé", "I Am... Sasha Fierce"),
+    Track(2, "Hallelujah", "Jeff Buckley", "Grace"),
+    Track(3, "Grace", "Jeff Buckley", "Grace"),
+    Track(4, "Hello", "Adele", "25"),
+    Track(5, "Lover, You Should've Come Over", "Jeff Buckley", "Grace"),
+]
+
+
+def titles(results):
+    return [track.title for track in results]
+
+
+def test_prefix_search():
+    """
+    Every word of the query should prefix a word of the track's title, artist or album. Results
+    come in title order
+    """
+    index = PrefixIndex(_TRACKS)
+
+    assert titles(index.search("hal")) == ["Hallelujah", "Halo"]
+    assert titles(index.search("jeff gr")) == ["Grace", "Hallelujah", "Lover, You Should've Come Over"]
+    assert titles(index.search("GRACE grace")) == ["Grace", "Hallelujah", "Lover, You Should've Come Over"]
+    assert titles(index.search("beyonce")) == ["Halo"]
+    assert titles(index.search("should")) == ["Lover, You Should've Come Over"]
+    assert titles(index.search("h", limit=2)) == ["Hallelujah", "Halo"]
+    assert index.search("adele halo") == []
+    assert index.search("  ") == []
+
+
+def test_from_db():
+    remove_database(_DB_PATH)
+    db = DatabaseManager(_DB_PATH)
+    db.executescript('db/schema.sql')
+    migrations.migrate(db)
+    insert_tracks(db, [(track.title, track.artist, track.album) for track in _TRACKS])
+
+    index = PrefixIndex.from_db(db.reader())
+    assert len(index) == len(_TRACKS)
+    assert index.search("hello") == [Track(4, "Hello", "Adele", "25")]
+    db.close()
+
+
+def test_latency():
+    """
+    Autocomplete must answer well within Discord's deadline on a large library
+    """
+    rng = random.Random(0)
+    vocabulary = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(20000)]
+    words = lambda count: ' '.join(rng.choice(vocabulary) for _ in range(count))
+    tracks = [Track(i, words(rng.randint(1, 4)), words(rng.randint(1, 2)), words(rng.randint(1, 3))) for i in range(100000)]
+
+    queries = []
+    for track in rng.sample(tracks, 2000):
+        query = f"{track.title} {track.artist}"
+        queries.append(query[:rng.randint(1, len(query))])
+
+    index = PrefixIndex(tracks)
+    del tracks
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    assert latencies[int(len(latencies) * 0.99)] < 0.02
@@ -0,0 +1,118 @@
+import pytest
+import asyncio
+import sqlite3
+import threading
+import time
+from tests.util import remove_database
+from src.db_manager import DatabaseManager, AsyncQueryExecutor
+
+_DB_PATH = './tests/test_db.sqlite'
+
+@pytest.fixture(scope="function")
+def get_db():
+    remove_database(_DB_PATH)
+
+    db = DatabaseManager(_DB_PATH, pragmas={'cache_size': -2000})
+    db.connect()
+    db.cursor.execute("CREATE TABLE items (name TEXT)")
+    db.cursor.execute("INSERT INTO items VALUES ('first')")
+    db.connection.commit()
+    yield db
+    db.close()
+
+
+def run_in_thread(function):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_pragmas(get_db):
+    """
+    The database should be in WAL mode, and the configured pragmas applied to readers too
+    """
+    assert get_db.cursor.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert get_db.cursor.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert get_db.reader().execute("PRAGMA cache_size").fetchone()[0] == -2000
+
+    with pytest.raises(ValueError):
+        DatabaseManager(_DB_PATH, pragmas={'cache_size': "0; DROP TABLE items"})
+
+
+def test_reads_dont_wait_on_writes(get_db):
+    """
+    Readers should see the last committed rows straight away while the writer holds a transaction open
+    """
+    get_db.cursor.execute("INSERT INTO items VALUES ('second')")
+
+    def count_items():
+        start = time.perf_counter()
+        count = get_db.reader().execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        return count, time.perf_counter() - start
+
+    count, elapsed = run_in_thread(count_items)
+    assert count == 1
+    assert elapsed < 0.5
+
+    get_db.connection.commit()
+    count, _ = run_in_thread(count_items)
+    assert count == 2
+
+
+def test_reader_per_thread(get_db):
+    """
+    Each thread should get its own reader, reused across calls and closed along with the manager
+    """
+    reader = get_db.reader()
+    assert get_db.reader() is reader
+    assert run_in_thread(get_db.reader) is not reader
+
+    with pytest.raises(sqlite3.OperationalError):
+        reader.execute("INSERT INTO items VALUES ('read-only')")
+
+    get_db.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        reader.execute("SELECT 1")
+
+
+def test_async_queries_loop_lag(get_db):
+    """
+    Run slow queries in parallel through the async executor. The event loop should keep ticking
+    on time, while running the same queries on the loop would block it for their whole duration.
+    """
+    get_db.cursor.execute("""
+        WITH RECURSIVE numbers(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM numbers WHERE n < 200000)
+        INSERT INTO items SELECT 'item ' || n FROM numbers
+    """)
+    get_db.connection.commit()
+    query = "SELECT COUNT(*) FROM items WHERE name LIKE '%99%'"
+    max_lag = 0.05
+
+    async def measure():
+        queries = AsyncQueryExecutor(get_db)
+        interval = 0.005
+        lag = 0.0
+
+        async def tick():
+            nonlocal lag
+            while True:
+                start = time.perf_counter()
+                await asyncio.sleep(interval)
+                lag = max(lag, time.perf_counter() - start - interval)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(interval * 2)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(queries.fetchone(query) for _ in range(16)))
+        elapsed = time.perf_counter() - start
+        ticker.cancel()
+        queries.close()
+        return results, elapsed, lag
+
+    results, elapsed, lag = asyncio.run(measure())
+    assert all(row[0] == results[0][0] > 0 for row in results)
+    # The queries must be slow enough that running them on the loop would exceed the threshold
+    assert elapsed > max_lag
+    assert lag < max_lag
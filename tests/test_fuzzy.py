@@ -0,0 +1,33 @@
+import pytest
+from src.fuzzy import TrigramIndex, edit_distance
+
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("beatles", "beatles", 0),
+    ("beetles", "beatles", 1),
+    ("beatls", "beatles", 1),
+    ("baetles", "beatles", 2),
+    ("bjrok", "bjork", 2),
+    ("", "abc", 3),
+])
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b, max_distance=3) == distance
+
+
+def test_edit_distance_cutoff():
+    assert edit_distance("abcdefgh", "zyxwvuts", max_distance=2) == 3
+    assert edit_distance("a", "abcdef", max_distance=2) == 3
+
+
+def test_corrections():
+    """
+    Misspelt words should be corrected to the closest vocabulary words, the most frequent first
+    """
+    index = TrigramIndex([("beatles", 40), ("battles", 3), ("beetle", 1), ("bjork", 12), ("radiohead", 20)])
+
+    assert index.corrections("beatles")[0] == ("beatles", 0)
+    assert index.corrections("beetles") == [("beatles", 1), ("beetle", 1), ("battles", 2)]
+    assert index.corrections("bjrok") == []
+    assert index.corrections("radiohaed") == [("radiohead", 2)]
+    # Short words must match exactly
+    assert index.corrections("bj") == []
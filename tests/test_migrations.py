@@ -0,0 +1,198 @@
+import pytest
+from tests.util import remove_database
+from src import migrations
+from src.db_manager import DatabaseManager
+
+_DB_PATH = './tests/test_db.sqlite'
+
+# db/schema.sql as it was before migrations existed, triggers included
+_LEGACY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (
+    artist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS albums (
+    album_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    artist_id INTEGER NOT NULL,
+    UNIQUE(name, artist_id),
+    FOREIGN KEY (artist_id) REFERENCES artists(artist_id)
+);
+
+CREATE TABLE IF NOT EXISTS directories (
+    dir_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tracks (
+    track_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    artist_id INTEGER NOT NULL,
+    album_id INTEGER NOT NULL,
+    dir_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    UNIQUE(dir_id, filename),
+    FOREIGN KEY (artist_id) REFERENCES artists(artist_id),
+    FOREIGN KEY (album_id) REFERENCES albums(album_id),
+    FOREIGN KEY (dir_id) REFERENCES directories(dir_id)
+);
+
+CREATE VIEW IF NOT EXISTS tracks_view AS
+SELECT
+    t.track_id AS rowid,
+    t.title,
+    ar.name AS artist_name,
+    al.name AS album_title
+FROM
+    tracks t
+JOIN
+    artists ar ON t.artist_id = ar.artist_id
+JOIN
+    albums al ON t.album_id = al.album_id;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5 (
+    title,
+    artist_name,
+    album_title,
+    content='tracks_view',
+    content_rowid='rowid'
+);
+
+CREATE TRIGGER IF NOT EXISTS tracks_fts_insert AFTER INSERT ON tracks
+BEGIN
+    INSERT INTO tracks_fts(rowid, title, artist_name, album_title)
+    SELECT
+        new.track_id,
+        new.title,
+        (SELECT name FROM artists WHERE artist_id = new.artist_id),
+        (SELECT name FROM albums WHERE album_id = new.album_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tracks_fts_update AFTER UPDATE ON tracks
+BEGIN
+    DELETE FROM tracks_fts WHERE rowid = old.track_id;
+    INSERT INTO tracks_fts(rowid, title, artist_name, album_title)
+    SELECT
+        new.track_id,
+        new.title,
+        (SELECT name FROM artists WHERE artist_id = new.artist_id),
+        (SELECT name FROM albums WHERE album_id = new.album_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tracks_fts_delete AFTER DELETE ON tracks
+BEGIN
+    DELETE FROM tracks_fts WHERE rowid = old.track_id;
+END;
+INSERT INTO artists (name) VALUES ('Artist');
+INSERT INTO albums (name, artist_id) VALUES ('Album', 1);
+INSERT INTO directories (path) VALUES ('/music/album');
+INSERT INTO tracks (title, artist_id, album_id, dir_id, filename, mtime) VALUES ('Sunrise', 1, 1, 1, '0.mp3', 0);
+INSERT INTO tracks (title, artist_id, album_id, dir_id, filename, mtime) VALUES ('Sunset', 1, 1, 1, '1.mp3', 0);
+"""
+
+# The queries run for every directory or track by the scanner, and for every command by the bot
+HOT_QUERIES = {
+    'cached tracks': ("SELECT * FROM tracks WHERE dir_id = ?", (1, )),
+    'size probe': ("SELECT 1 FROM tracks WHERE size = ? LIMIT 1", (1, )),
+    'move candidates': ("""
+        SELECT tracks.track_id, directories.path || '/' || tracks.filename
+        FROM tracks
+        JOIN directories
+        ON tracks.dir_id = directories.dir_id
+        WHERE tracks.size = ? AND tracks.fingerprint = ?
+    """, (1, 'x')),
+    'update track': ("UPDATE tracks SET title = ? WHERE dir_id = ? AND filename = ?", ('x', 1, 'x')),
+    'relink track': ("UPDATE tracks SET dir_id = ?, filename = ? WHERE track_id = ?", (1, 'x', 1)),
+    'update directory': ("UPDATE directories SET mtime = ?, entry_count = ? WHERE dir_id = ?", (1, 1, 1)),
+    'delete directory': ("DELETE FROM directories WHERE path = ?", ('x', )),
+    'directory tracks': ("SELECT dir_id, filename FROM tracks WHERE dir_id = ?", (1, )),
+    'artist': ("SELECT artist_id FROM artists WHERE name = ?", ('x', )),
+    'album': ("SELECT album_id FROM albums WHERE name = ? AND artist_id = ?", ('x', 1)),
+    'search': ("SELECT rowid,* FROM tracks_fts WHERE tracks_FTS MATCH ? || \"*\"", ('x', )),
+    'track path': ("""
+        SELECT directories.path || '/' || tracks.filename AS path
+        FROM tracks
+        JOIN directories
+        ON tracks.dir_id = directories.dir_id
+        WHERE tracks.track_id = ?
+    """, (1, )),
+    'artist tracks': ("SELECT * FROM tracks WHERE artist_id = ?", (1, )),
+    'album tracks': ("SELECT * FROM tracks WHERE album_id = ?", (1, )),
+    'artist albums': ("SELECT * FROM albums WHERE artist_id = ?", (1, )),
+}
+
+@pytest.fixture(scope="function")
+def get_db():
+    remove_database(_DB_PATH)
+    db = DatabaseManager(_DB_PATH)
+    db.connect()
+    yield db
+    db.close()
+
+
+def test_migrate_legacy_database(get_db):
+    """
+    A database created before versioning should be brought up to date in place, only once
+    """
+    get_db.cursor.executescript(_LEGACY_SCHEMA)
+    assert migrations.schema_version(get_db) == 0
+
+    get_db.executescript('db/schema.sql')
+    assert migrations.migrate(get_db) == len(migrations.MIGRATIONS)
+    assert migrations.schema_version(get_db) == len(migrations.MIGRATIONS)
+
+    columns = {row[1] for row in get_db.cursor.execute("PRAGMA table_info(tracks)").fetchall()}
+    assert {'duration', 'size', 'fingerprint', 'frame_duration'} <= columns
+    indexes = {row[0] for row in get_db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()}
+    assert {'tracks_fingerprint', 'tracks_artist', 'tracks_album', 'albums_artist'} <= indexes
+    assert get_db.cursor.execute("SELECT mtime FROM directories").fetchone()[0] == 0
+    fts = get_db.cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'tracks_fts'").fetchone()[0]
+    assert 'remove_diacritics 2' in fts
+
+    assert migrations.migrate(get_db) == 0
+
+
+def test_migrated_search_index(get_db):
+    """
+    Updates and deletes on a migrated database should keep the search index in sync
+    """
+    def matches(query):
+        return [row[0] for row in get_db.cursor.execute("SELECT rowid FROM tracks_fts WHERE tracks_fts MATCH ?", (query, )).fetchall()]
+
+    get_db.cursor.executescript(_LEGACY_SCHEMA)
+    get_db.executescript('db/schema.sql')
+    migrations.migrate(get_db)
+    assert matches("Sunrise") == [1]
+
+    get_db.cursor.execute("UPDATE tracks SET title = 'Moonrise' WHERE track_id = 1")
+    get_db.cursor.execute("DELETE FROM tracks WHERE track_id = 2")
+    get_db.connection.commit()
+
+    assert matches("Sunrise") == [] and matches("Sunset") == []
+    assert matches("Moonrise") == [1]
+    # Raises if the index and its content disagree
+    get_db.cursor.execute("INSERT INTO tracks_fts(tracks_fts) VALUES ('integrity-check')")
+
+
+def test_newer_database(get_db):
+    get_db.cursor.execute(f"PRAGMA user_version = {len(migrations.MIGRATIONS) + 1}")
+
+    with pytest.raises(RuntimeError):
+        migrations.migrate(get_db)
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_hot_queries_use_indexes(get_db, name):
+    """
+    None of the hot queries should scan a whole table
+    """
+    get_db.executescript('db/schema.sql')
+    migrations.migrate(get_db)
+
+    query, parameters = HOT_QUERIES[name]
+    plan = [row[3] for row in get_db.cursor.execute(f"EXPLAIN QUERY PLAN {query}", parameters).fetchall()]
+    # FTS queries are reported as scans of the virtual table, using its own index
+    scans = [step for step in plan if step.startswith('SCAN') and 'VIRTUAL TABLE' not in step]
+    assert not scans, plan
@@ -0,0 +1,250 @@
+import pytest
+import asyncio
+import discord
+from src.models import Track, StreamInfo
+from src.player import Player
+
+
+class FakeFFmpeg(discord.AudioSource):
+    """Stands in for an ffmpeg process, counting the ones alive"""
+    running = 0
+
+    def __init__(self, source, executable="ffmpeg", **options) -> None:
+        self.source = source
+        self.options = options
+        self.closed = False
+        self.frames = 0
+        FakeFFmpeg.running += 1
+
+    def read(self) -> bytes:
+        # Numbered 20 ms frames
+        self.frames += 1
+        return self.frames.to_bytes(4, 'little') * 960
+
+    def cleanup(self) -> None:
+        if not self.closed:
+            self.closed = True
+            FakeFFmpeg.running -= 1
+
+
+class FakeVoiceClient:
+    def __init__(self) -> None:
+        self.source = None
+        self.after = None
+
+    def is_playing(self):
+        return self.source is not None
+
+    def is_paused(self):
+        return False
+
+    def play(self, source, after):
+        self.source, self.after = source, after
+
+    def stop(self):
+        source, after = self.source, self.after
+        self.source = None
+        source.cleanup()
+        after(None)
+
+
+@pytest.fixture(scope="function")
+def fake_ffmpeg(monkeypatch):
+    FakeFFmpeg.running = 0
+    monkeypatch.setattr(discord, "FFmpegPCMAudio", FakeFFmpeg)
+    monkeypatch.setattr(discord, "FFmpegOpusAudio", type("FakeFFmpegOpus", (FakeFFmpeg, ), {"is_opus": lambda self: True}))
+    yield
+
+
+def test_lazy_sources(fake_ffmpeg):
+    """
+    Queued tracks should only start ffmpeg shortly before they play, one or two processes at most
+    """
+    async def play():
+        voice_client = FakeVoiceClient()
+        player = Player(voice_client)
+        for i in range(200):
+            await player.queue_track(f"/music/{i}.mp3", Track(i, f"Song {i}", "Artist", "Album"), StreamInfo(duration=10))
+        assert FakeFFmpeg.running == 1
+        assert player.get_now_playing_track().id == 0
+
+        # Play up to the prewarm point of the first track
+        frames = int((10 - Player.PREWARM_SECONDS) / 0.02)
+        for _ in range(frames - 1):
+            voice_client.source.read()
+        await asyncio.sleep(0.01)
+        assert FakeFFmpeg.running == 1
+        voice_client.source.read()
+        await asyncio.sleep(0.01)
+        assert FakeFFmpeg.running == 2
+        prewarmed = player.queue[0].audio_source
+
+        # The track ends, the prewarmed source is played
+        voice_client.stop()
+        await asyncio.sleep(0.01)
+        assert voice_client.source is prewarmed
+        assert FakeFFmpeg.running == 1
+
+        await player.clear()
+        assert FakeFFmpeg.running == 1
+
+    asyncio.run(play())
+
+
+def test_seek_restarts_lazily(fake_ffmpeg):
+    """
+    Seeking should replace the current ffmpeg process with one starting at the new position
+    """
+    async def play():
+        voice_client = FakeVoiceClient()
+        player = Player(voice_client)
+        await player.queue_track("/music/0.mp3", Track(0, "Song", "Artist", "Album"), StreamInfo(duration=60))
+        await player.queue_track("/music/1.mp3", Track(1, "Other", "Artist", "Album"), StreamInfo(duration=60))
+
+        await player.seek(30)
+        await asyncio.sleep(0.01)
+        assert FakeFFmpeg.running == 1
+        assert voice_client.source._source.options == {"before_options": "-ss 30"}
+        assert player.get_current_track_progress() == (30, 60)
+        assert [track.id for track in player.get_queued_tracks()] == [1]
+
+    asyncio.run(play())
+
+
+def test_opus_mode(fake_ffmpeg):
+    """
+    The opus mode should have ffmpeg encode, copying Opus files as they are, with progress counted the same way
+    """
+    async def play():
+        voice_client = FakeVoiceClient()
+        player = Player(voice_client, mode='opus')
+        await player.queue_track("/music/0.opus", Track(0, "Song", "Artist", "Album"), StreamInfo(duration=60, codec='opus', frame_duration=0.02))
+        await player.queue_track("/music/1.mp3", Track(1, "Other", "Artist", "Album"), StreamInfo(duration=60, codec='mp3'))
+
+        source = voice_client.source
+        assert source.is_opus()
+        assert source._source.options["codec"] == "copy"
+        for _ in range(50):
+            source.read()
+        assert source.progress == pytest.approx(1)
+
+        await player.seek(20)
+        await asyncio.sleep(0.01)
+        assert voice_client.source._source.options["codec"] == "copy"
+        assert voice_client.source.progress == 20
+
+        await player.skip()
+        await asyncio.sleep(0.01)
+        assert voice_client.source.is_opus()
+        assert voice_client.source._source.options["codec"] is None
+
+    asyncio.run(play())
+
+    with pytest.raises(ValueError):
+        Player(FakeVoiceClient(), mode='flac')
+
+
+def test_opus_copy_needs_20ms_packets(fake_ffmpeg):
+    """
+    Opus files made of longer packets, or whose packet duration isn't known, should be encoded again
+    """
+    async def play():
+        voice_client = FakeVoiceClient()
+        player = Player(voice_client, mode='opus')
+        for frame_duration in (0.06, None):
+            await player.queue_track("/music/0.opus", Track(0, "Song", "Artist", "Album"), StreamInfo(duration=60, codec='opus', frame_duration=frame_duration))
+            assert voice_client.source._source.options["codec"] is None
+            await player.skip()
+            await asyncio.sleep(0.01)
+
+    asyncio.run(play())
+
+
+def test_buffered_seek(fake_ffmpeg):
+    """
+    Seeks within the buffered frames should be served from memory, only others restart ffmpeg
+    """
+    def frame_number(data: bytes) -> int:
+        return int.from_bytes(data[:4], 'little')
+
+    async def play():
+        voice_client = FakeVoiceClient()
+        player = Player(voice_client)
+        await player.queue_track("/music/0.mp3", Track(0, "Song", "Artist", "Album"), StreamInfo(duration=60))
+        source = voice_client.source
+        for _ in range(600):
+            data = source.read()
+        assert frame_number(data) == 600
+
+        await player.seek(-10, relative=True)
+        assert voice_client.source is source and FakeFFmpeg.running == 1
+        assert player.get_current_track_progress()[0] == pytest.approx(2)
+        assert frame_number(source.read()) == 101
+
+        await player.seek(10, relative=True)
+        assert voice_client.source is source
+        assert frame_number(source.read()) == 602
+
+        await player.seek(40)
+        await asyncio.sleep(0.01)
+        assert voice_client.source is not source and FakeFFmpeg.running == 1
+        assert voice_client.source._source.options == {"before_options": "-ss 40"}
+        assert player.get_current_track_progress()[0] == 40
+
+    asyncio.run(play())
+
+
+class FakeTranscodeCache:
+    def __init__(self, cached) -> None:
+        self.cached = cached
+        self.added = []
+
+    def lookup(self, fingerprint):
+        return self.cached.get(fingerprint)
+
+    def add(self, path, fingerprint):
+        self.added.append((path, fingerprint))
+
+
+def test_transcode_cache(fake_ffmpeg):
+    """
+    Cached tracks should be streamed from their Opus copy, others transcoded once they play
+    """
+    async def play():
+        voice_client = FakeVoiceClient()
+        cache = FakeTranscodeCache({"a0": "/cache/0.opus"})
+        player = Player(voice_client, mode='opus', transcode_cache=cache)
+        await player.queue_track("/music/0.mp3", Track(0, "Song", "Artist", "Album"), StreamInfo(duration=60, codec='mp3'), "a0")
+        await player.queue_track("/music/1.flac", Track(1, "Other", "Artist", "Album"), StreamInfo(duration=60, codec='flac'), "b1")
+        # Not scanned yet, so not cached either
+        await player.queue_track("/music/2.flac", Track(2, "New", "Artist", "Album"), StreamInfo(duration=60, codec='flac'))
+
+        assert voice_client.source._source.source == "/cache/0.opus"
+        assert voice_client.source._source.options["codec"] == "copy"
+
+        await player.skip()
+        await asyncio.sleep(0.01)
+        assert voice_client.source._source.source == "/music/1.flac"
+        assert voice_client.source._source.options["codec"] is None
+        await player.skip()
+        await asyncio.sleep(0.01)
+        assert voice_client.source._source.source == "/music/2.flac"
+        assert cache.added == [("/music/0.mp3", "a0"), ("/music/1.flac", "b1")]
+
+    asyncio.run(play())
+
+
+def test_transcode_cache_unused_in_pcm_mode(fake_ffmpeg):
+    """
+    The pcm mode should play the original files and leave the transcode cache alone
+    """
+    async def play():
+        voice_client = FakeVoiceClient()
+        cache = FakeTranscodeCache({"a0": "/cache/0.opus"})
+        player = Player(voice_client, mode='pcm', transcode_cache=cache)
+        await player.queue_track("/music/0.mp3", Track(0, "Song", "Artist", "Album"), StreamInfo(duration=60, codec='mp3'), "a0")
+
+        assert voice_client.source._source.source == "/music/0.mp3"
+        assert cache.added == []
+
+    asyncio.run(play())
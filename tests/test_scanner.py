@@ -1,10 +1,18 @@
 import pytest
 import os
+import json
 import random
-from tests.util import DirManager, LibraryManager
+import shutil
+import logging
+import threading
+import contextlib
+from tests.util import DirManager, LibraryManager, remove_database
+import src.scanner as scanner_module
 from src.scanner import FileScanner
 from src.scanner import TrackRow
 from src.scanner import DirectoryRow
+from src.scanner import ScanProgress
+from src.db_manager import DatabaseManager
 
 _DB_PATH = './tests/test_db.sqlite'
 
@@ -16,10 +24,9 @@ def get_library_manager():
 
 @pytest.fixture(scope="function")
 def get_scanner():
-    if os.path.exists(_DB_PATH):
-        os.remove(_DB_PATH)
+    remove_database(_DB_PATH)
 
-    return FileScanner(library_path="./tests/tree", db_path=_DB_PATH)
+    return FileScanner(library_path="./tests/tree", db=DatabaseManager(_DB_PATH))
 
 
 def test_directory_tracking(get_library_manager, get_scanner):
@@ -142,4 +149,326 @@ def test_rename_file(get_library_manager, get_scanner):
     # New mtime is correct
     assert new_track.mtime == int(os.path.getmtime(new_path))
     # Doesn't create a new track
-    assert get_scanner.db.count_rows("tracks") == 10
\ No newline at end of file
+    assert get_scanner.db.count_rows("tracks") == 10
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_parallel_matches_serial(get_library_manager, executor):
+    """
+    Scan the same library with a serial and a parallel scanner. Both should produce identical rows, in the same order
+    """
+    get_library_manager.make_album(6, "First", "Artist A", "Artist A")
+    get_library_manager.make_album(6, "Second", "Artist B", "Artist B")
+
+    rows = []
+    for workers in (1, 4):
+        remove_database(_DB_PATH)
+        scanner = FileScanner(library_path="./tests/tree", db=DatabaseManager(_DB_PATH), workers=workers, executor=executor)
+        scanner.scan()
+        rows.append([tuple(row) for row in scanner.db.cursor.execute("SELECT * FROM tracks ORDER BY track_id").fetchall()])
+        scanner.db.close()
+
+    assert len(rows[0]) == 12
+    assert rows[0] == rows[1]
+
+
+def test_single_stat_walk(get_library_manager, get_scanner, monkeypatch):
+    """
+    Rescan after removing an album with the per-path os helpers disabled. The walk's scandir/stat results should
+    be enough for change detection, commit and stale detection
+    """
+    index = get_library_manager.make_album(5, "Awesome album", "Great singer", "Great singer")
+    get_library_manager.make_album(5, "Other album", "Great singer", "Great singer")
+    get_scanner.scan()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Scanner touched the filesystem outside of the walk")
+
+    for name in ("isfile", "isdir", "getmtime", "exists"):
+        monkeypatch.setattr(os.path, name, fail)
+    monkeypatch.setattr(os, "listdir", fail)
+
+    get_library_manager.rm_album(index)
+    get_scanner.scan()
+
+    assert get_scanner.db.count_rows("tracks") == 5
+
+
+def test_entries_removed_during_walk(get_library_manager, get_scanner, monkeypatch):
+    """
+    Files and directories removed while the walk lists them should be handled like stale ones, not abort the scan
+    """
+    index = get_library_manager.make_album(5, "Awesome album", "Great singer", "Great singer")
+    victim, template = get_library_manager.get_tracks_in_album(index)[:2]
+    vanishing = "./tests/tree/vanishing"
+    os.makedirs(vanishing)
+    shutil.copyfile(template, os.path.join(vanishing, "copy.mp3"))
+    get_scanner.scan()
+    assert get_scanner.db.count_rows("tracks") == 6
+
+    scandir = os.scandir
+    def racing_scandir(path):
+        if not isinstance(path, str):
+            # shutil.rmtree lists directories by descriptor
+            return scandir(path)
+        if os.path.normpath(path) == os.path.normpath(vanishing):
+            shutil.rmtree(vanishing)
+        with scandir(path) as iterator:
+            entries = list(iterator)
+        if os.path.normpath(path) == os.path.dirname(os.path.normpath(victim)):
+            os.remove(victim)
+        return contextlib.nullcontext(entries)
+    monkeypatch.setattr(os, "scandir", racing_scandir)
+
+    get_scanner.scan()
+    assert get_scanner.db.count_rows("tracks") == 4
+    paths = [row[0] for row in get_scanner.db.cursor.execute("SELECT path FROM directories").fetchall()]
+    assert not any(path.endswith("vanishing") for path in paths)
+
+def test_incremental_skips_unchanged(get_library_manager, get_scanner):
+    """
+    Edit a track's tags in place. An incremental scan trusts the unchanged directory mtime and skips it, a full scan picks up the edit
+    """
+    index = get_library_manager.make_album(5, "Awesome album", "Great singer", "Great singer")
+    get_scanner.scan()
+
+    path = get_library_manager.get_tracks_in_album(index)[0]
+    get_library_manager.change_track_metadata(path)
+    # Make sure the file mtime moves to another second
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 2))
+
+    get_scanner.scan(incremental=True)
+    assert get_scanner.db.cursor.execute("SELECT * FROM tracks WHERE title = ?", ("new_title", )).fetchall().__len__() == 0
+
+    get_scanner.scan()
+    assert get_scanner.db.cursor.execute("SELECT * FROM tracks WHERE title = ?", ("new_title", )).fetchall().__len__() == 1
+
+def test_incremental_detects_changes(get_library_manager, get_scanner):
+    """
+    Add and remove albums between incremental scans. Changed directories and new subdirectories should be picked up
+    """
+    index = get_library_manager.make_album(5, "Awesome album", "Great singer", "Great singer")
+    get_scanner.scan(incremental=True)
+
+    get_library_manager.make_album(4, "Second album", "Great singer", "Great singer")
+    new_dir = os.path.join(get_library_manager.dm.get_non_empty_directories()[0], "bonus")
+    os.makedirs(new_dir)
+    shutil.copy(get_library_manager.get_tracks_in_album(index)[0], os.path.join(new_dir, "bonus_track"))
+    get_scanner.scan(incremental=True)
+
+    assert get_scanner.db.count_rows("tracks") == 10
+
+    get_library_manager.rm_album(index)
+    get_scanner.scan(incremental=True)
+
+    assert get_scanner.db.count_rows("tracks") == 5
+
+def test_delete_same_filename(get_library_manager, get_scanner):
+    """
+    Delete a file whose name is shared with a file in another directory. Only the deleted one should be removed
+    """
+    index = get_library_manager.make_album(1, "Awesome album", "Great singer", "Great singer")
+    source = get_library_manager.get_tracks_in_album(index)[0]
+    copies = []
+    for name in ("first", "second"):
+        directory = os.path.join("./tests/tree", name)
+        os.makedirs(directory)
+        copies.append(os.path.join(directory, "track"))
+        shutil.copy(source, copies[-1])
+    get_scanner.scan()
+    assert get_scanner.db.count_rows("tracks") == 3
+
+    os.remove(copies[0])
+    get_scanner.scan(incremental=True)
+
+    query = "SELECT path FROM tracks JOIN directories ON tracks.dir_id = directories.dir_id WHERE filename = ?"
+    paths = [row[0] for row in get_scanner.db.cursor.execute(query, ("track", )).fetchall()]
+    assert paths == ["./tests/tree/second"]
+    assert get_scanner.db.count_rows("tracks") == 2
+
+def test_stream_properties(get_library_manager, get_scanner):
+    """
+    Scan an album. Duration and stream properties should be stored with each track, and tracks missing them should be reparsed
+    """
+    get_library_manager.make_album(3, "Awesome album", "Great singer", "Great singer")
+    get_scanner.scan()
+
+    get_scanner.db.cursor.execute("SELECT * FROM tracks")
+    tracks = [TrackRow(*row) for row in get_scanner.db.cursor.fetchall()]
+    assert len(tracks) == 3
+    for track in tracks:
+        assert track.duration == pytest.approx(1.0, abs=0.2)
+        assert track.codec == "mp3"
+        assert track.sample_rate > 0 and track.channels > 0 and track.bitrate > 0
+
+    get_scanner.db.cursor.execute("UPDATE tracks SET duration = NULL, codec = NULL")
+    get_scanner.db.connection.commit()
+    get_scanner.scan()
+
+    assert get_scanner.db.cursor.execute("SELECT * FROM tracks WHERE duration IS NULL OR codec IS NULL").fetchall() == []
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_fts_after_scan(get_library_manager, get_scanner, bulk):
+    """
+    Scan with and without suspending the FTS triggers. The search index should match the tracks table either way,
+    and the triggers should be back in place afterwards
+    """
+    index = get_library_manager.make_album(6, "Searchable", "Findable", "Findable")
+    get_library_manager.make_album(4, "Other", "Someone", "Someone")
+    get_scanner.scan(bulk=bulk)
+
+    fts_query = "SELECT rowid FROM tracks_fts WHERE tracks_fts MATCH ?"
+    assert get_scanner.db.cursor.execute(fts_query, ("Searchable", )).fetchall().__len__() == 6
+
+    get_library_manager.rm_album(index)
+    get_scanner.scan(bulk=bulk)
+
+    assert get_scanner.db.cursor.execute(fts_query, ("Searchable", )).fetchall().__len__() == 0
+    assert get_scanner.db.cursor.execute(fts_query, ("Other", )).fetchall().__len__() == 4
+
+    triggers = get_scanner.db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    assert sorted(row[0] for row in triggers) == sorted(FileScanner.FTS_TRIGGERS)
+
+def test_resume_interrupted_scan(get_library_manager, get_scanner, monkeypatch):
+    """
+    Interrupt a scan after a few batches were committed. The next scan should only parse the files that weren't written yet
+    """
+    get_library_manager.make_album(30, "Big album", "Prolific", "Prolific")
+    monkeypatch.setattr(FileScanner, "CHUNK_SIZE", 1)
+    monkeypatch.setattr(FileScanner, "BATCH_SIZE", 4)
+    get_scanner.workers = 1
+
+    write_batch = FileScanner._write_batch
+    calls = []
+    def interrupted_write_batch(self, batch, results):
+        if len(calls) == 3:
+            raise RuntimeError("Interrupted")
+        if batch.pending:
+            calls.append(batch)
+        return write_batch(self, batch, results)
+
+    monkeypatch.setattr(FileScanner, "_write_batch", interrupted_write_batch)
+    with pytest.raises(RuntimeError):
+        get_scanner.scan()
+    monkeypatch.setattr(FileScanner, "_write_batch", write_batch)
+
+    committed = DatabaseManager(_DB_PATH).count_rows("tracks")
+    assert 0 < committed < 30
+
+    parse_batch = scanner_module._parse_batch
+    parsed = []
+    def counting_parse_batch(paths):
+        parsed.extend(paths)
+        return parse_batch(paths)
+
+    monkeypatch.setattr(scanner_module, "_parse_batch", counting_parse_batch)
+    get_scanner.scan()
+
+    assert len(parsed) == 30 - committed
+    assert get_scanner.db.count_rows("tracks") == 30
+
+def test_moved_tracks_keep_ids(get_library_manager, get_scanner, monkeypatch):
+    """
+    Move an album and rename one of its tracks. Rows should be relinked to the new paths, keeping their ids, without parsing any file
+    """
+    index = get_library_manager.make_album(6, "Awesome album", "Great singer", "Great singer")
+    get_scanner.workers = 1
+    get_scanner.scan()
+
+    query = "SELECT filename, track_id, title FROM tracks"
+    before = {filename: (track_id, title) for filename, track_id, title in get_scanner.db.cursor.execute(query).fetchall()}
+
+    get_library_manager.move_album_to_empty(index)
+    os.makedirs(os.path.join("./tests/tree", "renamed"))
+    renamed_from = os.path.basename(get_library_manager.get_tracks_in_album(index)[0])
+    for root, _, files in os.walk("./tests/tree"):
+        if renamed_from in files:
+            os.rename(os.path.join(root, renamed_from), os.path.join("./tests/tree", "renamed", "renamed_track"))
+
+    parsed = []
+    monkeypatch.setattr(scanner_module, "_parse_batch", lambda paths: parsed.extend(paths) or [])
+    get_scanner.scan()
+
+    assert parsed == []
+    assert get_scanner.progress.relinked == 6
+    after = {filename: (track_id, title) for filename, track_id, title in get_scanner.db.cursor.execute(query).fetchall()}
+    assert set(after) == set(before) - {renamed_from} | {"renamed_track"}
+    # The generated tracks are identical, any of them may be relinked to the renamed file
+    assert {track_id for track_id, _ in after.values()} == {track_id for track_id, _ in before.values()}
+    # None of them has a title tag, titles follow the filename
+    assert all(title == filename for filename, (_, title) in after.items())
+
+def test_scan_stats(get_library_manager, get_scanner, caplog):
+    """
+    Scan an album. Phase timings, the slowest files and a JSON summary should be reported
+    """
+    get_library_manager.make_album(12, "Awesome album", "Great singer", "Great singer")
+    get_scanner.workers = 1
+    generation = get_scanner.generation
+    with caplog.at_level(logging.INFO, logger="scanner"):
+        get_scanner.scan(bulk=True)
+    assert get_scanner.generation > generation
+
+    progress = get_scanner.progress
+    assert progress.files == 12 and progress.files_per_second > 0
+    for phase in ("walk", "parse", "write", "commit", "fts"):
+        assert progress.phases[phase].count > 0
+    assert progress.phases["parse"].count == 12
+    slowest = progress.slowest_files()
+    assert len(slowest) == ScanProgress.SLOWEST_COUNT
+    assert slowest == sorted(slowest, reverse=True)
+
+    summaries = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Scan finished: ")]
+    assert len(summaries) == 1
+    summary = json.loads(summaries[0][len("Scan finished: "):])
+    assert summary["written"] == 12 and summary["phases"]["parse"]["count"] == 12
+    # Per-file lines are only logged at DEBUG
+    assert not any(record.getMessage().startswith("Scanning track") for record in caplog.records)
+
+def test_generation(get_library_manager, get_scanner):
+    """
+    The generation should only move when a scan changes tracks
+    """
+    index = get_library_manager.make_album(3, "Awesome album", "Great singer", "Great singer")
+    get_scanner.scan()
+    generation = get_scanner.generation
+
+    get_scanner.scan(incremental=True)
+    get_scanner.scan()
+    assert not get_scanner.progress.changed
+    assert get_scanner.generation == generation
+
+    get_library_manager.rm_album(index)
+    get_scanner.scan(incremental=True)
+    assert get_scanner.generation > generation
+
+def test_multiple_roots(get_library_manager, monkeypatch):
+    """
+    Scan two library roots with a walker each. Tracks of both should be merged into the database, and dropped along with their root
+    """
+    second_library = LibraryManager("./tests/tree2", DirManager(p_dir=0.3, depth=(2,4), branch=(1,4)))
+    get_library_manager.make_album(5, "First album", "Singer", "Singer")
+    second_library.make_album(7, "Second album", "Singer", "Singer")
+
+    remove_database(_DB_PATH)
+    db = DatabaseManager(_DB_PATH)
+
+    # Both roots live on the same device here, give each one its own walker regardless
+    monkeypatch.setattr(scanner_module, "_group_by_device", lambda roots: [[root] for root in roots])
+    walk = FileScanner._walk
+    walkers = set()
+    def recording_walk(self, *args):
+        walkers.add(threading.current_thread().name)
+        return walk(self, *args)
+    monkeypatch.setattr(FileScanner, "_walk", recording_walk)
+
+    scanner = FileScanner(library_path=["./tests/tree", "./tests/tree2", "./tests/tree2/dir_0"], db=db, workers=1)
+    assert scanner.library_paths == ["./tests/tree", "./tests/tree2"]
+    scanner.scan()
+
+    assert len(walkers) == 2
+    assert db.count_rows("tracks") == 12
+
+    FileScanner(library_path="./tests/tree2", db=db, workers=1).scan()
+    assert db.count_rows("tracks") == 7
+    db.close()
@@ -0,0 +1,148 @@
+import pytest
+import asyncio
+from tests.util import insert_tracks, remove_database
+from src import migrations
+from src.autocomplete import PrefixIndex
+from src.db_manager import DatabaseManager, AsyncQueryExecutor
+from src.fuzzy import TrigramIndex
+from src.search import TrackSearch
+from src.search_cache import SearchCache
+
+_DB_PATH = './tests/test_db.sqlite'
+
+
+@pytest.fixture(scope="function")
+def get_db():
+    remove_database(_DB_PATH)
+    db = DatabaseManager(_DB_PATH)
+    db.executescript('db/schema.sql')
+    migrations.migrate(db)
+    yield db
+    db.close()
+
+
+def run_search(db, query, limit, offset=0, fuzzy=False):
+    async def search():
+        queries = AsyncQueryExecutor(db)
+        try:
+            search = TrackSearch(queries)
+            search.vocabulary = TrigramIndex(PrefixIndex.from_db(db.reader()).vocabulary())
+            return await search.search(query, limit, offset, fuzzy)
+        finally:
+            queries.close()
+    return asyncio.run(search())
+
+
+def test_title_ranked_over_album(get_db):
+    """
+    A word found in a track's title should rank it above tracks having it in their album
+    """
+    insert_tracks(get_db, [
+        ("Intro", "Band", "Midnight Album"),
+        ("Outro", "Band", "Midnight Album"),
+        ("Midnight", "Other Band", "Singles"),
+    ])
+
+    results = run_search(get_db, "midnight", limit=10)
+    assert [track.title for track in results] == ["Midnight", "Intro", "Outro"]
+
+
+def test_pagination(get_db):
+    """
+    Pages should be bounded by the limit, and together return every match exactly once
+    """
+    insert_tracks(get_db, [(f"Song {i}", f"Artist {i % 3}", "Album") for i in range(23)])
+
+    pages = [run_search(get_db, "song", limit=5, offset=offset) for offset in range(0, 30, 5)]
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3, 0]
+
+    ids = [track.id for page in pages for track in page]
+    assert sorted(ids) == sorted(set(ids))
+    assert len(ids) == 23
+
+
+def test_fuzzy_search(get_db):
+    """
+    Misspelt queries should find nothing exactly, then the closest spellings in fuzzy mode
+    """
+    insert_tracks(get_db, [
+        ("Let It Be", "The Beatles", "Let It Be"),
+        ("Battle Hymn", "Beetle Band", "Singles"),
+        ("Jóga", "Björk", "Homogenic"),
+        ("Creep", "Radiohead", "Pablo Honey"),
+    ])
+
+    assert run_search(get_db, "beetles let", limit=10) == []
+    results = run_search(get_db, "beetles let", limit=10, fuzzy=True)
+    assert [track.title for track in results] == ["Let It Be"]
+
+    results = run_search(get_db, "beetle", limit=10, fuzzy=True)
+    # The exact spelling ranks first
+    assert [track.title for track in results] == ["Battle Hymn", "Let It Be"]
+
+    # Diacritics are folded by the exact search already
+    assert [track.title for track in run_search(get_db, "bjork joga", limit=10)] == ["Jóga"]
+    assert run_search(get_db, "radiohaed creap", limit=10, fuzzy=True)[0].title == "Creep"
+    assert run_search(get_db, "zzzzzz", limit=10, fuzzy=True) == []
+
+
+def test_invalid_query(get_db):
+    """
+    Queries which aren't valid FTS syntax find nothing exactly, the fuzzy search only uses their words
+    """
+    insert_tracks(get_db, [("Thunderstruck", "AC/DC", "The Razors Edge")])
+
+    assert run_search(get_db, "AC/DC \"", limit=10) == []
+    assert [track.title for track in run_search(get_db, "AC/DC \"", limit=10, fuzzy=True)] == ["Thunderstruck"]
+
+
+def test_cached_search(get_db):
+    """
+    Repeated searches should be served from the cache until the library generation changes
+    """
+    insert_tracks(get_db, [("Song", "Artist", "Album")])
+    generation = 0
+
+    async def search():
+        queries = AsyncQueryExecutor(get_db)
+        cache = SearchCache()
+        search = TrackSearch(queries, cache=cache, generation=lambda: generation)
+        try:
+            first = await search.search("song", limit=5)
+            # Served from the cache, even though the database changed
+            get_db.cursor.execute("UPDATE tracks SET title = 'Song 2'")
+            get_db.connection.commit()
+            assert await search.search("SONG ", limit=5) == first
+            assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+            nonlocal generation
+            generation += 1
+            assert [track.title for track in await search.search("song", limit=5)] == ["Song 2"]
+            assert cache.stats.invalidations == 1
+        finally:
+            queries.close()
+
+    asyncio.run(search())
+
+
+def test_stale_results_not_cached(get_db):
+    """
+    Results read while the library generation changed shouldn't be cached
+    """
+    insert_tracks(get_db, [("Song", "Artist", "Album")])
+    generations = iter([0, 1, 1, 1])
+
+    async def search():
+        queries = AsyncQueryExecutor(get_db)
+        cache = SearchCache()
+        # Read once before the query and once after it
+        search = TrackSearch(queries, cache=cache, generation=lambda: next(generations))
+        try:
+            await search.search("song", limit=5)
+            assert len(cache) == 0
+            await search.search("song", limit=5)
+            assert len(cache) == 1
+        finally:
+            queries.close()
+
+    asyncio.run(search())
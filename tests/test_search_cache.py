@@ -0,0 +1,58 @@
+import pytest
+from src.models import Track
+from src.search_cache import SearchCache
+
+
+def tracks(count, prefix="Track"):
+    return [Track(i, f"{prefix} {i}", "Artist", "Album") for i in range(count)]
+
+
+def test_lru_eviction():
+    """
+    The least recently used entry should be evicted once the cache is full
+    """
+    cache = SearchCache(max_entries=2)
+    cache.put("a", tracks(1), generation=0)
+    cache.put("b", tracks(2), generation=0)
+    assert cache.get("a", generation=0) == tracks(1)
+
+    cache.put("c", tracks(3), generation=0)
+    assert cache.get("b", generation=0) is None
+    assert cache.get("a", generation=0) == tracks(1)
+    assert cache.get("c", generation=0) == tracks(3)
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
+    assert (cache.stats.hits, cache.stats.misses) == (3, 1)
+
+
+def test_memory_bound():
+    """
+    Entries should be evicted to keep the cache under its memory budget, oversized ones never stored
+    """
+    cache = SearchCache(max_entries=100, max_bytes=20 * 1024)
+    for i in range(20):
+        cache.put(f"query {i}", tracks(10, prefix=f"Query {i}"), generation=0)
+        assert cache.stats.bytes <= cache.max_bytes
+
+    assert 0 < len(cache) < 20
+    assert cache.get("query 19", generation=0) is not None
+    assert cache.get("query 0", generation=0) is None
+
+    cache.put("huge", tracks(1000), generation=0)
+    assert cache.get("huge", generation=0) is None
+
+
+def test_generation_invalidates():
+    """
+    A new library generation should drop every entry, and results read before it should not be stored
+    """
+    cache = SearchCache()
+    cache.put("a", tracks(1), generation=0)
+    assert cache.get("a", generation=1) is None
+    assert len(cache) == 0
+    assert cache.stats.invalidations == 1
+
+    # Read at generation 1, stored after the library changed again
+    cache.get("b", generation=2)
+    cache.put("b", tracks(1), generation=1)
+    assert cache.get("b", generation=2) is None
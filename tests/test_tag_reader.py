@@ -0,0 +1,161 @@
+import pytest
+import os
+import mutagen
+from pydub import AudioSegment
+from mutagen.id3 import ID3, APIC, TIT2, TPE1
+from src import tag_reader
+from src.scanner import MetadataManager
+from tests.util import FORMATS, TAGS
+
+
+def make_track(directory, extension, tags=TAGS):
+    path = os.path.join(directory, f"track.{extension}")
+    AudioSegment.silent(duration=1500).export(path, **FORMATS[extension])
+
+    audio = mutagen.File(path, easy=True)
+    for key, value in tags.items():
+        audio[key] = value
+    audio.save()
+    return path
+
+
+@pytest.mark.parametrize("extension", FORMATS)
+def test_matches_mutagen(tmp_path, extension):
+    """
+    The header-only readers should find the same tags and stream properties as mutagen
+    """
+    path = make_track(tmp_path, extension)
+
+    result = tag_reader.read_file(path)
+    assert result is not None
+    tags, stream = result
+
+    audio = mutagen.File(path, easy=True)
+    expected = MetadataManager.get_stream_info(audio)
+    assert tags == TAGS
+    assert stream.codec == expected.codec
+    assert stream.channels == expected.channels
+    assert stream.duration == pytest.approx(expected.duration, abs=1e-3)
+    # mutagen doesn't report these for Opus
+    if expected.sample_rate:
+        assert stream.sample_rate == expected.sample_rate
+    if expected.bitrate:
+        assert stream.bitrate == pytest.approx(expected.bitrate, rel=0.01)
+
+
+def test_skips_large_frames(tmp_path, monkeypatch):
+    """
+    Cover art and multiple values in an ID3v2.3 tag. The picture must be skipped, not read
+    """
+    path = make_track(tmp_path, 'mp3', tags={})
+    tags = ID3(path)
+    tags.add(APIC(encoding=3, mime='image/jpeg', type=3, data=b'\xff' * 512 * 1024))
+    tags.add(TIT2(encoding=1, text=["First", "Second"]))
+    tags.add(TPE1(encoding=3, text="Artist"))
+    tags.save(v2_version=3)
+
+    bytes_read = 0
+
+    class CountingFile:
+        def __init__(self, fp):
+            self.fp = fp
+
+        def __getattr__(self, name):
+            return getattr(self.fp, name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.fp.close()
+
+        def read(self, size=-1):
+            nonlocal bytes_read
+            data = self.fp.read(size)
+            bytes_read += len(data)
+            return data
+
+    monkeypatch.setattr(tag_reader, 'open', lambda *args: CountingFile(open(*args)), raising=False)
+
+    tags, stream = tag_reader.read_file(path)
+    # Like mutagen, ID3v2.3 values stay joined with a slash
+    assert tags == {'title': "First/Second", 'artist': "Artist"}
+    assert stream.codec == 'mp3'
+    assert bytes_read < 64 * 1024
+
+
+def test_falls_back_to_mutagen(tmp_path):
+    """
+    Formats and features the readers don't handle should be left to mutagen
+    """
+    wav_path = os.path.join(tmp_path, "track.wav")
+    AudioSegment.silent(duration=1000).export(wav_path, format="wav")
+    assert tag_reader.read_file(wav_path) is None
+
+    metadata = MetadataManager.get_metadata(wav_path)
+    assert metadata.title == "track.wav"
+    assert metadata.stream.codec == 'pcm'
+
+    # Unsynchronised tags
+    path = make_track(tmp_path, 'mp3')
+    with open(path, 'r+b') as fp:
+        fp.seek(5)
+        fp.write(b'\x80')
+    assert tag_reader.read_file(path) is None
+
+
+def test_truncated_file(tmp_path):
+    path = make_track(tmp_path, 'flac')
+    with open(path, 'r+b') as fp:
+        fp.truncate(60)
+
+    assert tag_reader.read_file(path) is None
+
+
+def id3v1_tag(title: bytes, artist: bytes, album: bytes) -> bytes:
+    return b'TAG' + title.ljust(30, b'\0') + artist.ljust(30, b'\0') + album.ljust(30, b'\0') + b'2000' + b'\0' * 30 + b'\xff'
+
+
+def test_id3v1(tmp_path):
+    """
+    ID3v1 tags should be read like mutagen does: on their own, or filling in the ID3v2 tag
+    """
+    path = make_track(tmp_path, 'mp3')
+    ID3(path).delete(path)
+    with open(path, 'ab') as fp:
+        fp.write(id3v1_tag(b"V1 Title", b"V1 Artist", b"V1 Album"))
+
+    assert tag_reader.read_file(path) is None
+    metadata = MetadataManager.get_metadata(path)
+    assert (metadata.title, metadata.artist, metadata.album) == ("V1 Title", "V1 Artist", "V1 Album")
+
+    # ID3v2 tag missing the artist and album
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text="V2 Title"))
+    tags.save(path, v1=0)
+    with open(path, 'ab') as fp:
+        fp.write(id3v1_tag(b"V1 Title", b"V1 Artist", b"V1 Album"))
+    assert tag_reader.read_file(path) is None
+    metadata = MetadataManager.get_metadata(path)
+    assert (metadata.title, metadata.artist, metadata.album) == ("V2 Title", "V1 Artist", "V1 Album")
+
+    # Complete ID3v2 tag, the ID3v1 tag isn't counted as audio
+    path = make_track(tmp_path, 'mp3')
+    with open(path, 'ab') as fp:
+        fp.write(id3v1_tag(b"V1 Title", b"V1 Artist", b"V1 Album"))
+    tags, stream = tag_reader.read_file(path)
+    assert tags == TAGS
+    expected = MetadataManager.get_stream_info(mutagen.File(path, easy=True))
+    assert stream.duration == pytest.approx(expected.duration, abs=1e-3)
+
+
+@pytest.mark.parametrize("frame_duration", [20, 60])
+def test_opus_frame_duration(tmp_path, frame_duration):
+    """
+    The packet duration of Opus files should be read from their first audio packet
+    """
+    path = os.path.join(tmp_path, "track.opus")
+    AudioSegment.silent(duration=1500).export(path, format="opus", parameters=["-frame_duration", str(frame_duration)])
+
+    _, stream = tag_reader.read_file(path)
+    assert stream.frame_duration == frame_duration / 1000
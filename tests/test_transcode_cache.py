@@ -0,0 +1,103 @@
+import os
+import shutil
+import pytest
+from pydub.generators import Sine
+from src.scanner import file_fingerprint
+from src.transcode_cache import TranscodeCache
+
+_TREE_PATH = './tests/tree'
+_CACHE_PATH = './tests/transcode_cache'
+
+
+@pytest.fixture(scope="function")
+def get_tracks():
+    """(path, fingerprint) of a few tracks, fingerprinted the way the scanner does"""
+    shutil.rmtree(_CACHE_PATH, ignore_errors=True)
+    os.makedirs(_TREE_PATH, exist_ok=True)
+    tracks = []
+    for i in range(3):
+        path = f"{_TREE_PATH}/{i}.mp3"
+        Sine(220 * (i + 1)).to_audio_segment(duration=2000).export(path, format="mp3")
+        tracks.append((path, file_fingerprint(path, os.path.getsize(path))))
+    yield tracks
+    shutil.rmtree(_TREE_PATH, ignore_errors=True)
+    shutil.rmtree(_CACHE_PATH, ignore_errors=True)
+
+
+def test_transcode(get_tracks):
+    """
+    Played tracks should be transcoded in the background, then found by fingerprint even once moved
+    """
+    cache = TranscodeCache(_CACHE_PATH, max_bytes=1024 * 1024)
+    path, fingerprint = get_tracks[0]
+    assert cache.lookup(fingerprint) is None
+
+    cached = cache.add(path, fingerprint).result()
+    assert cached.endswith(".opus") and os.path.getsize(cached) == cache.size
+    assert cache.lookup(fingerprint) == cached
+
+    moved = f"{_TREE_PATH}/moved.mp3"
+    os.rename(path, moved)
+    assert cache.add(moved, fingerprint).result() == cached
+    assert len(cache) == 1
+
+    # Entries are found again after a restart
+    cache.close()
+    assert TranscodeCache(_CACHE_PATH, max_bytes=1024 * 1024).lookup(fingerprint) == cached
+
+
+def test_lookup_deleted_entry(get_tracks):
+    """
+    Entries deleted behind the cache's back should be dropped once a lookup touches them
+    """
+    cache = TranscodeCache(_CACHE_PATH, max_bytes=1024 * 1024)
+    path, fingerprint = get_tracks[0]
+    os.remove(cache.transcode(path, fingerprint))
+
+    cache.lookup(fingerprint)
+    # Waits for the touch, queued on the transcoding thread
+    cache._executor.submit(lambda: None).result()
+    assert cache.lookup(fingerprint) is None
+    assert len(cache) == 0 and cache.size == 0
+
+
+def test_lru_eviction(get_tracks):
+    """
+    Past the size limit, the least recently played tracks should be deleted
+    """
+    cache = TranscodeCache(_CACHE_PATH, max_bytes=1024 * 1024)
+    first, second, third = get_tracks
+    entry_size = os.path.getsize(cache.transcode(*first))
+    cache.transcode(*second)
+    cache.max_bytes = 2 * entry_size + entry_size // 2
+
+    # Played again, the first track is now the most recent one
+    assert cache.lookup(first[1])
+    cache.transcode(*third)
+    assert cache.lookup(second[1]) is None
+    assert cache.lookup(first[1]) and cache.lookup(third[1])
+    assert len(os.listdir(_CACHE_PATH)) == 2
+    assert cache.size <= cache.max_bytes
+
+
+def test_warm(get_tracks):
+    """
+    Warming up should transcode files until the cache is full, skipping ones which can't be decoded
+    """
+    broken = f"{_TREE_PATH}/broken.mp3"
+    with open(broken, 'wb') as fp:
+        fp.write(b'\0' * 1024)
+
+    cache = TranscodeCache(_CACHE_PATH, max_bytes=1024 * 1024)
+    assert cache.warm([(broken, "broken")] + get_tracks[:2]) == 2
+    # Stops at the first eviction
+    cache.max_bytes = int(cache.size * 1.25)
+    assert cache.warm(get_tracks) == 1 and len(cache) == 2
+    assert cache.warm(get_tracks[1:]) == 0
+    assert not any(name.endswith('.part') for name in os.listdir(_CACHE_PATH))
+
+    # A lower limit on the next start evicts the oldest entries
+    cache.close()
+    cache = TranscodeCache(_CACHE_PATH, max_bytes=cache.size - 1)
+    assert len(cache) == 1 and cache.evictions == 1
+    assert cache.lookup(get_tracks[1][1]) is None and cache.lookup(get_tracks[2][1])
@@ -0,0 +1,173 @@
+import pytest
+import os
+import time
+from tests.util import DirManager, LibraryManager, remove_database
+from src.db_manager import DatabaseManager
+from src.scanner import FileScanner
+from src.watcher import LibraryWatcher
+
+_DB_PATH = './tests/test_db.sqlite'
+_TREE_PATH = './tests/tree'
+
+@pytest.fixture(scope="function")
+def get_library_manager():
+    dm = DirManager(p_dir=0.3, depth=(2,4), branch=(1,4))
+    lm = LibraryManager(_TREE_PATH, dm)
+    return lm
+
+@pytest.fixture(scope="function")
+def get_db():
+    remove_database(_DB_PATH)
+
+    db = DatabaseManager(_DB_PATH)
+    FileScanner(library_path=_TREE_PATH, db=db).scan()
+    yield db
+    db.close()
+
+def wait_for_rows(db: DatabaseManager, table: str, count: int, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if db.count_rows(table) == count:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+@pytest.mark.parametrize("mode", ["inotify", "poll"])
+def test_watch_add_remove(get_library_manager, get_db, mode):
+    """
+    Add an album, then remove it while the watcher runs. The database should follow without a restart
+    """
+    watcher = LibraryWatcher(_TREE_PATH, _DB_PATH, mode=mode, debounce=0.2, poll_interval=0.5, workers=1)
+    watcher.start()
+    try:
+        index = get_library_manager.make_album(5, "Watched album", "Watched artist", "Watched artist")
+        assert wait_for_rows(get_db, "tracks", 5)
+
+        get_library_manager.rm_album(index)
+        assert wait_for_rows(get_db, "tracks", 0)
+        assert wait_for_rows(get_db, "directories", 0)
+    finally:
+        watcher.stop()
+
+def test_retry_failed_apply(get_library_manager, get_db, monkeypatch):
+    """
+    Changes whose rescan failed should be kept and applied again
+    """
+    scan_paths = FileScanner.scan_paths
+    failures = []
+    def failing_scan_paths(self, *args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise OSError("Interrupted")
+        return scan_paths(self, *args, **kwargs)
+    monkeypatch.setattr(FileScanner, "scan_paths", failing_scan_paths)
+
+    watcher = LibraryWatcher(_TREE_PATH, _DB_PATH, mode="inotify", debounce=0.2, workers=1)
+    watcher.start()
+    try:
+        get_library_manager.make_album(5, "Watched album", "Watched artist", "Watched artist")
+        assert wait_for_rows(get_db, "tracks", 5)
+        assert failures
+    finally:
+        watcher.stop()
+
+def test_directory_removed_before_watch(get_library_manager, get_db, monkeypatch):
+    """
+    A new directory removed before it could be watched should be skipped, the watcher keeps running
+    """
+    walk = os.walk
+    def racing_walk(top, *args, **kwargs):
+        for dir_path, dir_names, file_names in walk(top, *args, **kwargs):
+            if os.path.basename(dir_path) == "vanishing":
+                os.rmdir(dir_path)
+            yield dir_path, dir_names, file_names
+    monkeypatch.setattr(os, "walk", racing_walk)
+
+    watcher = LibraryWatcher(_TREE_PATH, _DB_PATH, mode="inotify", debounce=0.2, workers=1)
+    watcher.start()
+    try:
+        time.sleep(0.2)
+        os.mkdir(os.path.join(_TREE_PATH, "vanishing"))
+        time.sleep(0.5)
+        assert watcher._thread.is_alive()
+
+        get_library_manager.make_album(5, "Watched album", "Watched artist", "Watched artist")
+        assert wait_for_rows(get_db, "tracks", 5)
+    finally:
+        watcher.stop()
+
+def test_watch_new_directory(get_library_manager, get_db):
+    """
+    Move a directory containing an album into the library. Its tracks should be picked up
+    """
+    index = get_library_manager.make_album(4, "Moved album", "Artist", "Artist")
+    staging = "./tests/staging"
+    os.makedirs(staging)
+    for i, path in enumerate(get_library_manager.get_tracks_in_album(index)):
+        os.rename(path, os.path.join(staging, f"track_{i}"))
+
+    watcher = LibraryWatcher(_TREE_PATH, _DB_PATH, mode="inotify", debounce=0.2, workers=1)
+    watcher.start()
+    try:
+        time.sleep(0.5)
+        os.rename(staging, os.path.join(_TREE_PATH, "moved"))
+        assert wait_for_rows(get_db, "tracks", 4)
+    finally:
+        watcher.stop()
+
+def test_initial_scan_in_background(get_library_manager, get_db):
+    """
+    The startup scan runs on the watcher's thread, `ready` is set once the library is indexed
+    """
+    get_library_manager.make_album(6, "Startup album", "Artist", "Artist")
+
+    watcher = LibraryWatcher(_TREE_PATH, _DB_PATH, mode="off", initial_scan="full", workers=1)
+    assert not watcher.progress.running
+    watcher.start()
+    try:
+        assert watcher.ready.wait(timeout=10)
+        assert get_db.count_rows("tracks") == 6
+        assert watcher.progress.written == 6
+        assert not watcher.progress.running
+    finally:
+        watcher.stop()
+
+def test_initial_scan_keeps_fts(get_library_manager, get_db, monkeypatch):
+    """
+    The startup scan should keep the FTS index searchable as it writes, however many tracks it finds
+    """
+    monkeypatch.setattr(FileScanner, "BULK_THRESHOLD", 2)
+    suspended = []
+    monkeypatch.setattr(FileScanner, "_suspend_fts", lambda self: suspended.append(True))
+    get_library_manager.make_album(6, "Startup album", "Artist", "Artist")
+
+    watcher = LibraryWatcher(_TREE_PATH, _DB_PATH, mode="off", initial_scan="full", workers=1)
+    watcher.start()
+    try:
+        assert watcher.ready.wait(timeout=10)
+        assert get_db.count_rows("tracks_fts") == 6
+        assert not suspended
+    finally:
+        watcher.stop()
+
+def test_listeners(get_library_manager, get_db):
+    """
+    Listeners should be called after scans which changed the library, and only those
+    """
+    calls = []
+    watcher = LibraryWatcher(_TREE_PATH, _DB_PATH, mode="inotify", initial_scan="full", debounce=0.2, workers=1)
+    watcher.add_listener(lambda progress: calls.append(progress.written))
+    watcher.start()
+    try:
+        assert watcher.ready.wait(timeout=10)
+        assert calls == []
+
+        get_library_manager.make_album(3, "Listened album", "Artist", "Artist")
+        assert wait_for_rows(get_db, "tracks", 3)
+        deadline = time.monotonic() + 5
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert sum(calls) == 3
+    finally:
+        watcher.stop()
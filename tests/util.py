@@ -1,13 +1,58 @@
 import os
 import random
 import shutil
+import tempfile
 
 from dataclasses import dataclass
 from typing import List
 from pydub import AudioSegment
 from mutagen.mp3 import MP3
 from mutagen.easyid3 import EasyID3
+from mutagen.id3 import ID3, TXXX
 
+from src.db_manager import DatabaseManager
+
+
+# pydub export arguments for each format
+FORMATS = {
+    'mp3': {'format': 'mp3'},
+    'flac': {'format': 'flac'},
+    'opus': {'format': 'opus'},
+    'ogg': {'format': 'ogg', 'codec': 'libvorbis'},
+    'm4a': {'format': 'ipod', 'codec': 'aac'},
+}
+
+TAGS = {
+    'title': "Tïtle",
+    'artist': "Ärtist",
+    'album': "Album",
+    'albumartist': "Album Artist",
+}
+
+
+def remove_database(path: str):
+    """
+    Delete a database along with its WAL files. A WAL left behind would be replayed into the next
+    database created at path.
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def insert_tracks(db: DatabaseManager, tracks):
+    """Insert (title, artist, album) tuples, the FTS triggers index them"""
+    db.cursor.execute("INSERT INTO directories (path) VALUES ('/music')")
+    for i, (title, artist, album) in enumerate(tracks):
+        db.cursor.execute("INSERT OR IGNORE INTO artists (name) VALUES (?)", (artist, ))
+        artist_id = db.cursor.execute("SELECT artist_id FROM artists WHERE name = ?", (artist, )).fetchone()[0]
+        db.cursor.execute("INSERT OR IGNORE INTO albums (name, artist_id) VALUES (?, ?)", (album, artist_id))
+        album_id = db.cursor.execute("SELECT album_id FROM albums WHERE name = ? AND artist_id = ?", (album, artist_id)).fetchone()[0]
+        db.cursor.execute(
+            "INSERT INTO tracks (title, artist_id, album_id, dir_id, filename, mtime) VALUES (?, ?, ?, 1, ?, 0)",
+            (title, artist_id, album_id, f"{i}.mp3")
+        )
+    db.connection.commit()
 
 class DirTree(object):
     def __init__(self, path: str, children=None) -> None:
@@ -29,8 +74,10 @@ class DirTree(object):
             child.display()
 
 class DirManager:
-    def __init__(self, p_dir=0.5, depth=(3, 6), branch=(2, 4)) -> None:
+    def __init__(self, p_dir=0.5, depth=(3, 6), branch=(2, 4), rng: random.Random = None) -> None:
         self.p_dir = p_dir
+        # Pass a seeded generator for reproducible trees
+        self.rng = rng or random.Random()
         self.min_depth = depth[0]
         self.max_depth = depth[1]
         self.min_branch = branch[0]
@@ -39,6 +86,7 @@ class DirManager:
         self.file_counter = 0
         self.tree: DirTree = None
         self.tree_ref_index = {}
+        self.tree_ref_paths = []
     
     def _create_dir(self, parent: DirTree, depth):
         if depth > self.max_depth:
@@ -46,7 +94,7 @@ class DirManager:
         
         min_branch_guarantee = self.min_branch
         for _ in range(self.max_branch):
-            if self.p_dir < random.random() and min_branch_guarantee == 0:
+            if self.p_dir < self.rng.random() and min_branch_guarantee == 0:
                 continue
             elif min_branch_guarantee > 0:
                 min_branch_guarantee -= 1
@@ -71,9 +119,10 @@ class DirManager:
                     self.tree_ref_index[c.path] = c
                 recursion(c)
         recursion(self.tree)        
+        self.tree_ref_paths = list(self.tree_ref_index)
 
     def _get_random_node(self) -> DirTree:
-        return self.tree_ref_index[random.choice(list(self.tree_ref_index))]
+        return self.tree_ref_index[self.rng.choice(self.tree_ref_paths)]
 
     def create_tree(self, base_path: str):
         """
@@ -173,6 +222,37 @@ class LibraryManager:
         self.album_index += 1
         return self.album_index
 
+    def make_library(self, count, album_size=10, tag_size=0):
+        """
+        Create count tagged tracks, grouped in albums of album_size tracks. Unlike make_album, the
+        audio is only encoded once and copied, which keeps large libraries quick to generate.
+        Each file's tags are padded with a frame of tag_size bytes.
+        """
+        fd, template = tempfile.mkstemp(suffix=".mp3")
+        os.close(fd)
+        try:
+            AudioSegment.silent(duration=1000).export(template, format="mp3")
+            if tag_size:
+                tags = ID3(template)
+                tags.add(TXXX(desc="padding", text="x" * tag_size))
+                tags.save()
+
+            for start in range(0, count, album_size):
+                album = len(self.albums)
+                paths = self.dm.create_files(min(album_size, count - start))
+                for i, path in enumerate(paths):
+                    shutil.copyfile(template, path)
+                    audio = MP3(path, ID3=EasyID3)
+                    audio['title'] = f"Track {i + 1}"
+                    audio['album'] = f"Album {album}"
+                    audio['artist'] = f"Artist {album % 100}"
+                    audio.save()
+
+                self.albums.append(paths)
+                self.album_index += 1
+        finally:
+            os.remove(template)
+
     def move_album_to_empty(self, album_index):
         target_dir = self.dm.get_random_empty_dir()
         paths = self.albums[album_index]